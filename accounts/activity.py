@@ -0,0 +1,141 @@
+"""
+Audit log writer. Views call `log_activity(user, action)` instead of ActivityLog.objects.create.
+
+An entry joins the worker's buffer once the request's transaction commits, so work
+that rolls back leaves no entry behind, and a background thread writes the buffer with
+one bulk_create when it reaches BATCH_SIZE entries or FLUSH_INTERVAL seconds have passed.
+Whatever is left is written when the process exits. ACTIVITY_LOG["SYNC"] writes every
+entry inline instead (tests, management commands).
+
+A batch the database refuses is written again entry by entry and the entries that still
+fail are dropped; a batch that can't reach the database is retried by the next flushes,
+MAX_ATTEMPTS times at most.
+"""
+import atexit
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections, transaction
+from django.utils import timezone
+
+from .models import ActivityLog
+
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityLogWriter:
+
+    def __init__(self, batch_size=100, flush_interval=2, max_pending=10000, max_attempts=5, sync=False):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.sync = sync
+        self._cond = threading.Condition()
+        self._pending = []
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush)
+
+    @classmethod
+    def from_settings(cls, setting_name):
+        options = getattr(settings, setting_name, {})
+        return cls(
+            batch_size=options.get("BATCH_SIZE", 100),
+            flush_interval=options.get("FLUSH_INTERVAL", 2),
+            max_pending=options.get("MAX_PENDING", 10000),
+            max_attempts=options.get("MAX_ATTEMPTS", 5),
+            sync=options.get("SYNC", False),
+        )
+
+    def log(self, user, action):
+        entry = ActivityLog(user=user, action=action, date_created=timezone.now())
+
+        if self.sync:
+            entry.save()
+        else:
+            transaction.on_commit(lambda: self.enqueue([entry]))
+
+    def enqueue(self, entries):
+        with self._cond:
+            self._pending.extend(entries)
+            if len(self._pending) > self.max_pending:
+                dropped = len(self._pending) - self.max_pending
+                del self._pending[:dropped]
+                logger.error("activity log buffer full, dropped %s entries", dropped)
+            self._ensure_thread()
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def _ensure_thread(self):
+        # threads don't survive a fork, each worker starts its own on its first entry
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="activity-log-writer", daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._pending) >= self.batch_size, timeout=self.flush_interval)
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        with self._cond:
+            entries, self._pending = self._pending, []
+        if not entries:
+            return 0
+
+        try:
+            with transaction.atomic():
+                ActivityLog.objects.bulk_create(entries, batch_size=self.batch_size)
+        except (OperationalError, InterfaceError):
+            logger.exception("could not reach the database to write %s activity log entries", len(entries))
+            self._retry(entries)
+            return 0
+        except Exception:
+            logger.exception("could not write %s activity log entries at once, writing them one by one", len(entries))
+            return self._write_each(entries)
+
+        return len(entries)
+
+    def _write_each(self, entries):
+        written = 0
+        for i, entry in enumerate(entries):
+            try:
+                with transaction.atomic():
+                    ActivityLog.objects.bulk_create([entry])
+            except (OperationalError, InterfaceError):
+                logger.exception("could not reach the database to write %s activity log entries", len(entries) - i)
+                self._retry(entries[i:])
+                break
+            except Exception:
+                logger.exception("dropped the activity log entry %r, it can't be written", entry.action)
+            else:
+                written += 1
+        return written
+
+    def _retry(self, entries):
+        retried = []
+        for entry in entries:
+            entry.flush_attempts = getattr(entry, "flush_attempts", 0) + 1
+            if entry.flush_attempts < self.max_attempts:
+                retried.append(entry)
+
+        if len(retried) < len(entries):
+            logger.error("dropped %s activity log entries after %s attempts", len(entries) - len(retried), self.max_attempts)
+        with self._cond:
+            self._pending[:0] = retried
+
+
+activity_writer = ActivityLogWriter.from_settings("ACTIVITY_LOG")
+
+
+def log_activity(user, action):
+    activity_writer.log(user, action)
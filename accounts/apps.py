@@ -5,4 +5,7 @@ class AccountsConfig(AppConfig):
     name = 'accounts'
 
     def ready(self):
-        import accounts.signals
\ No newline at end of file
+        import accounts.signals
+
+        from .emails import warm_templates
+        warm_templates()
\ No newline at end of file
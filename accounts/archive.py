@@ -0,0 +1,166 @@
+"""
+Cold storage of ActivityLog rows past their retention period.
+
+Rows are streamed out oldest first (a server-side cursor on postgres) into gzipped JSONL
+segments on the default storage, one directory per UTC day:
+
+    <ARCHIVE_PREFIX>/2023/01/31/<first id>-<last id>.jsonl.gz
+
+and deleted from the table in batches once their segment is saved. `archived_activity`
+reads the segments back for one user without loading them into the database.
+"""
+import gzip
+import io
+import json
+import logging
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ActivityLog
+
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("id", "user_id", "action", "date_created", "is_deleted")
+
+
+def get_archive_settings():
+    return {
+        "RETENTION_DAYS": 90,
+        "ARCHIVE_PREFIX": "archive/activity-logs",
+        "SEGMENT_ROWS": 50000,
+        "CHUNK_SIZE": 2000,
+        **getattr(settings, "ACTIVITY_LOG", {}),
+    }
+
+
+def day_directory(prefix, day):
+    return f"{prefix}/{day:%Y/%m/%d}"
+
+
+class SegmentWriter:
+    """Gzipped JSONL spooled to a temporary file, saved to storage when closed"""
+
+    def __init__(self, storage, prefix, day):
+        self.storage = storage
+        self.directory = day_directory(prefix, day)
+        self.day = day
+        self.ids = []
+        self._file = tempfile.TemporaryFile()
+        self._gzip = gzip.GzipFile(fileobj=self._file, mode="wb")
+
+    def write(self, row):
+        record = {
+            **row,
+            "user_id": str(row["user_id"]) if row["user_id"] else None,
+            "date_created": row["date_created"].isoformat(),
+        }
+        self._gzip.write(json.dumps(record).encode() + b"\n")
+        self.ids.append(row["id"])
+
+    def save(self):
+        self._gzip.close()
+        self._file.seek(0)
+        name = self.storage.save(f"{self.directory}/{self.ids[0]}-{self.ids[-1]}.jsonl.gz", File(self._file))
+        self._file.close()
+        return name
+
+
+def delete_rows(ids, batch_size):
+    deleted = 0
+    for start in range(0, len(ids), batch_size):
+        deleted += ActivityLog.objects.filter(id__in=ids[start:start + batch_size]).delete()[0]
+    return deleted
+
+
+def archive_activity_logs(retention_days=None, storage=default_storage, now=None):
+    """
+    Moves the ActivityLog rows older than the retention period to storage.
+    Returns (segments written, rows archived).
+    """
+
+    options = get_archive_settings()
+    retention_days = options["RETENTION_DAYS"] if retention_days is None else retention_days
+    cutoff = (now or timezone.now()) - timedelta(days=retention_days)
+
+    rows = (
+        ActivityLog.objects.filter(date_created__lt=cutoff)
+        .order_by("date_created", "id")
+        .values(*FIELDS)
+        .iterator(chunk_size=options["CHUNK_SIZE"])
+    )
+
+    segments = archived = 0
+    segment = None
+
+    def close(segment):
+        name = segment.save()
+        # only rows whose segment made it to storage are deleted
+        deleted = delete_rows(segment.ids, settings.PRUNE_BATCH_SIZE)
+        logger.info("archived %s activity log rows to %s", deleted, name)
+        return deleted
+
+    for row in rows:
+        day = row["date_created"].astimezone(dt_timezone.utc).date()
+        if segment is not None and (segment.day != day or len(segment.ids) >= options["SEGMENT_ROWS"]):
+            archived += close(segment)
+            segments += 1
+            segment = None
+        if segment is None:
+            segment = SegmentWriter(storage, options["ARCHIVE_PREFIX"], day)
+        segment.write(row)
+
+    if segment is not None:
+        archived += close(segment)
+        segments += 1
+
+    return segments, archived
+
+
+def archived_days(storage, prefix, since=None, until=None):
+    """UTC days with archived segments between since and until, oldest first"""
+
+    try:
+        years = storage.listdir(prefix)[0]
+    except FileNotFoundError:
+        # nothing archived yet (blob storages just list nothing)
+        return
+
+    for year in sorted(years):
+        for month in sorted(storage.listdir(f"{prefix}/{year}")[0]):
+            for day in sorted(storage.listdir(f"{prefix}/{year}/{month}")[0]):
+                date = datetime(int(year), int(month), int(day), tzinfo=dt_timezone.utc)
+                if since and date + timedelta(days=1) <= since:
+                    continue
+                if until and date >= until:
+                    return
+                yield date.date()
+
+
+def archived_activity(user_id, since=None, until=None, storage=default_storage):
+    """
+    Yields the archived entries of a user, oldest first, streaming the segments of the
+    days between `since` and `until` (aware datetimes) straight from storage.
+    """
+
+    prefix = get_archive_settings()["ARCHIVE_PREFIX"]
+    user_id = str(ActivityLog._meta.get_field("user").target_field.to_python(user_id))
+
+    for day in archived_days(storage, prefix, since, until):
+        directory = day_directory(prefix, day)
+        for name in sorted(storage.listdir(directory)[1], key=lambda name: int(name.split("-")[0])):
+            with storage.open(f"{directory}/{name}", "rb") as segment:
+                for line in io.TextIOWrapper(gzip.GzipFile(fileobj=segment)):
+                    record = json.loads(line)
+                    if record["user_id"] != user_id:
+                        continue
+                    record["date_created"] = parse_datetime(record["date_created"])
+                    if since and record["date_created"] < since or until and record["date_created"] >= until:
+                        continue
+                    yield record
@@ -0,0 +1,56 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import authenticate
+from django.http import JsonResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+from .hashers import HashingPoolFull, login_pool
+from .serializers import LoginSerializer
+from .views import login_payload
+
+
+def _response(data, status):
+    return JsonResponse(data, status=status, encoder=JSONEncoder)
+
+
+async def async_user_login(request):
+    """
+    Same contract as `user_login`, served natively under ASGI (config/asgi.py).
+
+    The password check runs in the bounded login hashing pool so a burst of
+    logins never blocks the event loop, and is refused with a 503 once the pool's
+    queue is full. Queue wait and hash latency are reported at /v1/cache-stats/.
+    """
+
+    if request.method != "POST":
+        return _response({"error": "Method not allowed"}, 405)
+
+    try:
+        payload = json.loads(request.body or b"{}")
+    except ValueError:
+        return _response({"error": "Invalid JSON body"}, 400)
+
+    serializer = LoginSerializer(data=payload)
+    if not serializer.is_valid():
+        return _response({"error": serializer.errors}, 400)
+
+    data = serializer.validated_data
+    try:
+        user = await login_pool.run(authenticate, request, email=data["email"], password=data["password"], is_deleted=False)
+    except HashingPoolFull:
+        return _response({"error": "Too many login attempts in progress, please retry shortly"}, 503)
+
+    if not user:
+        return _response({"error": "Please provide a valid email and a password"}, 401)
+
+    if not user.is_active:
+        return _response({"error": "This account has not been activated"}, 403)
+
+    user_detail = await sync_to_async(login_payload)(request, user)
+
+    return _response({"message": "success", "data": user_detail}, 200)
+
+
+# csrf_exempt() wraps views in a sync function on this django version, flag the coroutine directly
+async_user_login.csrf_exempt = True
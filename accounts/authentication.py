@@ -0,0 +1,51 @@
+import copy
+
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .cache import TwoTierCache
+from .claims import is_stale
+
+
+principal_cache = TwoTierCache.from_settings("principal", "PRINCIPAL_CACHE")
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that serves the user from the principal cache instead of
+    fetching the user row on every request.
+
+    Entries are dropped by the ``post_save``/``post_delete`` receivers on the user model
+    (see accounts/signals.py), which also covers soft deletes since ``User.delete`` saves.
+    """
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+
+        if is_stale(validated_token):
+            raise InvalidToken(
+                {"detail": _("Roles changed since this token was issued, please refresh it"), "code": "token_not_valid"}
+            )
+
+        return validated_token
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = principal_cache.get(str(user_id))
+
+        if user is None:
+            user = super().get_user(validated_token)
+            principal_cache.set(str(user_id), user)
+
+        elif not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        # every request gets its own instance so per-request state such as
+        # the permission caches set by the auth backend never leaks between requests
+        return copy.copy(user)
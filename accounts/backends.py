@@ -0,0 +1,30 @@
+from django.contrib.auth.backends import AllowAllUsersModelBackend
+
+from .cache import PermissionCache
+
+
+permission_cache = PermissionCache.from_settings("PERMISSION_CACHE")
+
+
+class CachedPermissionBackend(AllowAllUsersModelBackend):
+    """
+    Model backend whose permission lookups are served from the shared permission cache.
+
+    `has_perm`/`has_perms` (and therefore every permission class) end up in
+    `get_all_permissions`, so a steady state check costs no database query on any worker.
+    Invalidation is wired to the m2m and group signals in accounts/signals.py.
+    """
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+
+        if not hasattr(user_obj, "_perm_cache"):
+            user_obj._perm_cache = permission_cache.get_or_load(
+                user_obj.pk, lambda: self._load_permissions(user_obj)
+            )
+
+        return user_obj._perm_cache
+
+    def _load_permissions(self, user_obj):
+        return {*self.get_user_permissions(user_obj), *self.get_group_permissions(user_obj)}
@@ -0,0 +1,153 @@
+"""
+Revoked refresh token (jti) stores used by accounts.tokens.RefreshToken.
+
+Revocation checks are answered here, every entry expires on its own at the token's `exp`.
+A store shared by all workers (redis) is authoritative: the token_blacklist tables written
+while TOKEN_BLACKLIST["DURABLE_LOG"] is on (the default) are only a log and are never read
+on a refresh. A store local to one worker (locmem) can't see the others' revocations, so a jti
+it misses is looked up in the log (accounts.tokens.RefreshToken.check_blacklist).
+"""
+import hashlib
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.module_loading import import_string
+
+
+class BloomFilter:
+    """Fixed size bloom filter over strings, k positions derived from one blake2b digest"""
+
+    def __init__(self, size=1 << 20, hashes=7):
+        self.size = size
+        self.hashes = hashes
+        self._bits = bytearray(size // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class BaseBlacklistStore(ABC):
+
+    # whether every worker sees the revocations added through this store
+    shared = False
+
+    @abstractmethod
+    def add(self, jti, exp):
+        """Revokes the token with the given jti until its expiry timestamp"""
+
+    @abstractmethod
+    def contains(self, jti):
+        """Whether the token with the given jti is revoked"""
+
+
+class MemoryBlacklistStore(BaseBlacklistStore):
+    """
+    Per-process store for tests and single process deployments.
+
+    A bloom filter answers the common "never revoked" case without touching the
+    exact set; expired entries are pruned (and the filter rebuilt) every `prune_interval` seconds.
+    """
+
+    def __init__(self, bloom_size=1 << 20, bloom_hashes=7, prune_interval=300, **kwargs):
+        self.bloom_size = bloom_size
+        self.bloom_hashes = bloom_hashes
+        self.prune_interval = prune_interval
+        self._lock = threading.Lock()
+        self._revoked = {}
+        self._bloom = BloomFilter(bloom_size, bloom_hashes)
+        self._pruned_at = time.time()
+
+    def _prune(self, now):
+        self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+        self._bloom = BloomFilter(self.bloom_size, self.bloom_hashes)
+        for jti in self._revoked:
+            self._bloom.add(jti)
+        self._pruned_at = now
+
+    def add(self, jti, exp):
+        now = time.time()
+        with self._lock:
+            if now - self._pruned_at > self.prune_interval:
+                self._prune(now)
+            if exp > now:
+                self._revoked[jti] = exp
+                self._bloom.add(jti)
+
+    def contains(self, jti):
+        with self._lock:
+            if jti not in self._bloom:
+                return False
+            exp = self._revoked.get(jti)
+        return exp is not None and exp > time.time()
+
+
+class CacheBlacklistStore(BaseBlacklistStore):
+    """
+    Exact set kept in a django cache (redis in production), one key per jti whose
+    timeout ends at the token's expiry. A revocation check is a single GET shared by all workers.
+
+    The redis instance must not evict these keys before they expire (maxmemory-policy
+    noeviction or volatile-ttl): once shared, the store is the only thing a refresh checks.
+    Local memory and dummy caches are never considered shared unless `shared` says so.
+
+    No bloom filter here: a filter local to one worker can't see revocations made by the
+    others, and one kept in redis costs the same round trip as the lookup it would save.
+    """
+
+    def __init__(self, cache_alias="default", shared=None, **kwargs):
+        self.cache_alias = cache_alias
+        self._shared = shared
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    @property
+    def shared(self):
+        if self._shared is None:
+            return not isinstance(self.cache, (LocMemCache, DummyCache))
+        return self._shared
+
+    def key(self, jti):
+        return f"blacklist:{jti}"
+
+    def add(self, jti, exp):
+        timeout = int(exp - time.time()) + 1
+        if timeout > 0:
+            self.cache.set(self.key(jti), 1, timeout)
+
+    def contains(self, jti):
+        return self.cache.get(self.key(jti)) is not None
+
+
+def get_blacklist_settings():
+    return {
+        "STORE": "accounts.blacklist.CacheBlacklistStore",
+        "OPTIONS": {},
+        "DURABLE_LOG": True,
+        "COMPACT_LOG": False,
+        **getattr(settings, "TOKEN_BLACKLIST", {}),
+    }
+
+
+def load_store():
+    options = get_blacklist_settings()
+    return import_string(options["STORE"])(**options["OPTIONS"])
+
+
+blacklist_store = load_store()
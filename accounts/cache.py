@@ -0,0 +1,165 @@
+"""
+Caches used on the request hot path.
+
+Values are served from a small per-process LRU first, then from the shared
+django cache (redis in production) and only then from the database.
+"""
+import threading
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.core.cache import caches
+
+
+class CacheStats:
+    """Thread safe hit/miss counters for a single cache"""
+
+    def __init__(self, *names):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(names, 0)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + amount
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+class TwoTierCache:
+    """
+    Per-process LRU in front of the shared django cache.
+
+    The local tier keeps entries for a few seconds only, so a change made on
+    one worker reaches every other worker within ``local_ttl`` even though
+    only the shared tier is invalidated across processes.
+    """
+
+    def __init__(self, prefix, local_size=1024, local_ttl=5, shared_ttl=300, alias="default"):
+        self.prefix = prefix
+        self.shared_ttl = shared_ttl
+        self.alias = alias
+        self._local = TTLCache(maxsize=local_size, ttl=local_ttl)
+        self._lock = threading.Lock()
+        self.stats = CacheStats("local_hits", "shared_hits", "misses", "invalidations")
+
+    @classmethod
+    def from_settings(cls, prefix, setting_name):
+        options = getattr(settings, setting_name, {})
+        return cls(
+            prefix,
+            local_size=options.get("LOCAL_SIZE", 1024),
+            local_ttl=options.get("LOCAL_TTL", 5),
+            shared_ttl=options.get("SHARED_TTL", 300),
+            alias=options.get("CACHE_ALIAS", "default"),
+        )
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def make_key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def get(self, key):
+        with self._lock:
+            value = self._local.get(key)
+
+        if value is not None:
+            self.stats.incr("local_hits")
+            return value
+
+        value = self.shared.get(self.make_key(key))
+        if value is not None:
+            self.stats.incr("shared_hits")
+            with self._lock:
+                self._local[key] = value
+            return value
+
+        self.stats.incr("misses")
+        return None
+
+    def set(self, key, value):
+        self.shared.set(self.make_key(key), value, self.shared_ttl)
+        with self._lock:
+            self._local[key] = value
+
+    def delete(self, key):
+        with self._lock:
+            self._local.pop(key, None)
+        self.shared.delete(self.make_key(key))
+        self.stats.incr("invalidations")
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+
+class PermissionCache:
+    """
+    Cross-worker cache of the permission names held by each user.
+
+    Every entry records the global permission epoch and the user's own version it
+    was computed under. Bumping the epoch drops every entry at once (role edits),
+    bumping a user version drops a single user (group or permission assignment).
+    Entry, epoch and version are read in one round trip to the shared cache.
+    """
+
+    epoch_key = "perms:epoch"
+
+    def __init__(self, ttl=3600, alias="default"):
+        self.ttl = ttl
+        self.alias = alias
+        self.stats = CacheStats("hits", "misses", "user_invalidations", "epoch_bumps")
+
+    @classmethod
+    def from_settings(cls, setting_name):
+        options = getattr(settings, setting_name, {})
+        return cls(ttl=options.get("TTL", 3600), alias=options.get("CACHE_ALIAS", "default"))
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def entry_key(self, user_id):
+        return f"perms:user:{user_id}"
+
+    def version_key(self, user_id):
+        return f"perms:version:{user_id}"
+
+    def _versions(self, user_id):
+        keys = [self.epoch_key, self.version_key(user_id), self.entry_key(user_id)]
+        values = self.shared.get_many(keys)
+        return values.get(keys[0], 0), values.get(keys[1], 0), values.get(keys[2])
+
+    def version_for(self, user_id):
+        """Returns the permission version a user's cached permissions are valid for"""
+
+        keys = [self.epoch_key, self.version_key(user_id)]
+        values = self.shared.get_many(keys)
+        return f"{values.get(keys[0], 0)}.{values.get(keys[1], 0)}"
+
+    def get_or_load(self, user_id, loader):
+        epoch, user_version, entry = self._versions(user_id)
+
+        if entry is not None and entry[:2] == (epoch, user_version):
+            self.stats.incr("hits")
+            return entry[2]
+
+        self.stats.incr("misses")
+        perms = frozenset(loader())
+        self.shared.set(self.entry_key(user_id), (epoch, user_version, perms), self.ttl)
+        return perms
+
+    def _bump(self, key):
+        self.shared.add(key, 0, None)
+        self.shared.incr(key)
+
+    def invalidate_user(self, user_id):
+        self._bump(self.version_key(user_id))
+        self.stats.incr("user_invalidations")
+
+    def bump_epoch(self):
+        self._bump(self.epoch_key)
+        self.stats.incr("epoch_bumps")
@@ -0,0 +1,134 @@
+"""
+Permission and module claims embedded in access tokens.
+
+With ``TOKEN_PERMISSION_CLAIMS`` enabled every access token carries:
+    - perms: bitset of the user's permissions, bit n set for the Permission with pk n
+    - mods: bitset of the ModuleAccess ids assigned to the user's roles
+    - pv: the permission version the claims were compiled under (see PermissionCache)
+
+Primary keys are never reused, which keeps the bit index stable across deploys and workers.
+"""
+import base64
+
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from rest_framework_simplejwt.settings import api_settings
+
+from .backends import permission_cache
+from .cache import TwoTierCache
+from .models import ModuleAccess
+
+
+PERMISSIONS_CLAIM = "perms"
+MODULES_CLAIM = "mods"
+VERSION_CLAIM = "pv"
+
+catalogue_cache = TwoTierCache("claims", local_size=8, local_ttl=60, shared_ttl=None)
+
+
+def claims_enabled():
+    return getattr(settings, "TOKEN_PERMISSION_CLAIMS", False)
+
+
+def encode_bitset(ids):
+    bits = 0
+    for i in ids:
+        bits |= 1 << i
+
+    raw = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_bitset(value):
+    raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+    return int.from_bytes(raw, "little")
+
+
+def bitset_ids(bits):
+    ids = []
+    i = 0
+    while bits:
+        if bits & 1:
+            ids.append(i)
+        bits >>= 1
+        i += 1
+    return ids
+
+
+def permission_index():
+    """Maps "app_label.codename" to the permission's bit position"""
+
+    index = catalogue_cache.get("permissions")
+    if index is None:
+        index = {
+            f"{app_label}.{codename}": pk
+            for pk, app_label, codename in Permission.objects.values_list("pk", "content_type__app_label", "codename")
+        }
+        catalogue_cache.set("permissions", index)
+    return index
+
+
+def module_catalogue():
+    """Maps ModuleAccess ids to their serialized values"""
+
+    modules = catalogue_cache.get("modules")
+    if modules is None:
+        modules = {module["id"]: module for module in ModuleAccess.objects.values()}
+        catalogue_cache.set("modules", modules)
+    return modules
+
+
+def compile_claims(user):
+    """Builds the permission claims of an access token for the given user"""
+
+    # read the version first so a concurrent role change can only make the claims look older
+    version = permission_cache.version_for(user.pk)
+    index = permission_index()
+    perms = user.get_all_permissions()
+    modules = ModuleAccess.objects.filter(group__user=user).values_list("id", flat=True).distinct()
+
+    return {
+        PERMISSIONS_CLAIM: encode_bitset(index[perm] for perm in perms if perm in index),
+        MODULES_CLAIM: encode_bitset(modules),
+        VERSION_CLAIM: version,
+    }
+
+
+def token_has_perms(token, perms):
+    """
+    Checks the permissions against the claims of a validated token.
+
+    Returns:
+        bool: result of the check or None when the token carries no permission claim
+    """
+
+    if not claims_enabled() or token is None or PERMISSIONS_CLAIM not in token:
+        return None
+
+    bits = decode_bitset(token[PERMISSIONS_CLAIM])
+    index = permission_index()
+
+    for perm in perms:
+        pk = index.get(perm)
+        if pk is None or not (bits >> pk) & 1:
+            return False
+    return True
+
+
+def token_modules(token):
+    """Returns the modules listed in the token claims or None when the token carries none"""
+
+    if not claims_enabled() or MODULES_CLAIM not in token:
+        return None
+
+    catalogue = module_catalogue()
+    return [catalogue[i] for i in bitset_ids(decode_bitset(token[MODULES_CLAIM])) if i in catalogue]
+
+
+def is_stale(token):
+    """True when roles changed after the token's claims were compiled"""
+
+    if not claims_enabled() or VERSION_CLAIM not in token:
+        return False
+
+    return token[VERSION_CLAIM] != permission_cache.version_for(token[api_settings.USER_ID_CLAIM])
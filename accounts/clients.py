@@ -0,0 +1,125 @@
+"""
+SDK clients built on first use.
+
+Importing settings or the project builds nothing: each client is created the first
+time get_client() asks for it in a process, and again in a forked child (gunicorn
+--preload, celery prefork workers) instead of sharing the parent's, since the http
+and grpc sessions these SDKs keep are not fork safe.
+
+How long each client took to build is kept for `manage.py startup_report`.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.utils.functional import empty
+
+
+logger = logging.getLogger(__name__)
+
+
+class LazyClient:
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.build_seconds = None
+        self._lock = threading.Lock()
+        self._client = None
+        self._pid = None
+
+    def get(self):
+        if self._pid == os.getpid():
+            return self._client
+
+        with self._lock:
+            if self._pid != os.getpid():
+                started = time.perf_counter()
+                self._client = self.factory()
+                self.build_seconds = time.perf_counter() - started
+                self._pid = os.getpid()
+                logger.debug("built %s client in %.3fs", self.name, self.build_seconds)
+        return self._client
+
+    @property
+    def ready(self):
+        return self._pid == os.getpid()
+
+    def reset_after_fork(self):
+        # the parent may have been building it while forking, the copied lock could be held
+        self._lock = threading.Lock()
+        self._client = None
+        self._pid = None
+        self.build_seconds = None
+
+
+_clients = {}
+
+
+def register_client(name):
+    """Decorator registering a factory as the client `name`"""
+
+    def decorator(factory):
+        _clients[name] = LazyClient(name, factory)
+        return factory
+    return decorator
+
+
+def get_client(name):
+    return _clients[name].get()
+
+
+def registered_clients():
+    return dict(_clients)
+
+
+def _reset_after_fork():
+    for client in _clients.values():
+        client.reset_after_fork()
+    # default_storage (azure) is built lazily too, a child builds its own
+    default_storage._wrapped = empty
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@register_client("firebase")
+def firebase_app():
+    import firebase_admin
+    from firebase_admin import credentials
+
+    if not settings.FIREBASE_CREDENTIALS:
+        raise ImproperlyConfigured("FIREBASE_CREDENTIALS is not set")
+
+    try:
+        inherited = firebase_admin.get_app()
+    except ValueError:
+        pass
+    else:
+        # a forked child still sees the parent's default app in firebase_admin's registry
+        firebase_admin.delete_app(inherited)
+
+    cred = credentials.Certificate(json.loads(settings.FIREBASE_CREDENTIALS))
+    # the default app, so firebase_admin.get_app() and calls without app= work once it is built
+    return firebase_admin.initialize_app(cred)
+
+
+@register_client("google_auth")
+def google_auth_request():
+    import requests
+    from google.auth.transport.requests import Request
+
+    return Request(session=requests.Session())
+
+
+@register_client("storage")
+def storage():
+    # the instance behind default_storage, so file fields and get_client("storage") share it
+    if default_storage._wrapped is empty:
+        default_storage._setup()
+    return default_storage._wrapped
@@ -0,0 +1,85 @@
+"""
+Push device registry.
+
+A user has one DeviceToken per device, keyed on the sha256 of its FCM token, so a
+device registering again (or under another account) is an upsert of that one row
+and several devices of a user all receive pushes.
+
+Apps register their token on every launch. A device already known with the same
+user and platform only has its last_seen refreshed, through a write-behind buffer
+(DEVICE_SEEN_BUFFER) rather than an UPDATE per request.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import DeviceToken
+from .writebehind import device_seen_buffer
+
+
+KNOWN_DEVICE_TTL = 60 * 60 * 24
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def device_key(token_hash):
+    return f"device:{token_hash}"
+
+
+def register_devices(devices, now=None):
+    """
+    Upserts (user id, token, platform) entries with one INSERT ... ON CONFLICT, a token
+    already registered is moved to the given user and platform. Returns the number of devices.
+    """
+
+    now = now or timezone.now()
+    rows = {}
+    for user_id, token, platform in devices:
+        token_hash = hash_token(token)
+        rows[token_hash] = DeviceToken(
+            token_hash=token_hash,
+            user_id=user_id,
+            token=token,
+            platform=platform,
+            date_created=now,
+            last_seen=now,
+        )
+
+    if rows:
+        DeviceToken.objects.bulk_create(
+            rows.values(),
+            update_conflicts=True,
+            unique_fields=["token_hash"],
+            update_fields=["user_id", "platform", "last_seen"],
+        )
+    return len(rows)
+
+
+def register_device(user, token, platform=DeviceToken.ANDROID):
+    """Registers the device of a signed in user, returns False when it was already known and only seen again"""
+
+    token_hash = hash_token(token)
+    owner = [str(user.pk), platform]
+
+    if cache.get(device_key(token_hash)) == owner:
+        device_seen_buffer.record(token_hash, timezone.now())
+        return False
+
+    register_devices([(user.pk, token, platform)])
+    cache.set(device_key(token_hash), owner, KNOWN_DEVICE_TTL)
+    return True
+
+
+def remove_devices(token_hashes, batch_size=1000):
+    """Deletes the given devices, returns the number deleted"""
+
+    token_hashes = list(token_hashes)
+    rows = 0
+    for start in range(0, len(token_hashes), batch_size):
+        chunk = token_hashes[start:start + batch_size]
+        rows += DeviceToken.objects.filter(token_hash__in=chunk).delete()[0]
+        cache.delete_many([device_key(token_hash) for token_hash in chunk])
+    return rows
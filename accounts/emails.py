@@ -1,6 +1,190 @@
+"""
+Email rendering.
+
+Each EmailTemplate compiles its templates once per process (warmed from AccountsConfig.ready)
+and renders the subject, text and html parts of a message from the compiled objects.
+Templates written for templated_mail (`{% block subject %}`, `{% block text_body %}`,
+`{% block html_body %}`) have their blocks looked up once at compile time, through
+`{% extends %}` parents and nested blocks, and are rendered with the same block overrides
+as a full render; a plain html template is rendered whole as the html part, with the
+subject and text given in code.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.template import Context, Template, TemplateDoesNotExist
+from django.template.context import make_context
+from django.template.loader import get_template
+from django.template.loader_tags import BLOCK_CONTEXT_KEY, BlockContext, BlockNode, ExtendsNode
 from djoser.email import PasswordResetEmail
 
-from config.settings import Common
+
+logger = logging.getLogger(__name__)
+
+MAIL_BLOCKS = ("subject", "text_body", "html_body")
+
+
+class EmailTemplate:
+
+    def __init__(self, html_template=None, subject=None, text=None):
+        self.html_template = html_template
+        self.subject = subject
+        self.text = text
+        self._lock = threading.Lock()
+        self._compiled = None
+
+    @staticmethod
+    def plain_text(source):
+        # the subject and text part are not html, nothing in them should be escaped
+        return Template("{% autoescape off %}" + source + "{% endautoescape %}")
+
+    @staticmethod
+    def block_chain(template):
+        """The blocks of `template` and of each template it extends, child first, like ExtendsNode.render collects them"""
+
+        chain = []
+        context = Context()
+        with context.bind_template(template):
+            while True:
+                chain.append({node.name: node for node in template.nodelist.get_nodes_by_type(BlockNode)})
+                extends = template.nodelist.get_nodes_by_type(ExtendsNode)
+                if not extends:
+                    return chain
+                template = extends[0].get_parent(context)
+
+    def compile(self):
+        if self._compiled is not None:
+            return self._compiled
+
+        with self._lock:
+            if self._compiled is None:
+                template, chain, blocks = None, [], {}
+                if self.html_template:
+                    template = get_template(self.html_template).template
+                    chain = self.block_chain(template)
+                    # the outermost definition of a block is the one a full render reaches
+                    for template_blocks in chain:
+                        blocks.update(template_blocks)
+
+                mail_blocks = any(name in blocks for name in MAIL_BLOCKS)
+                self._compiled = {
+                    "template": template,
+                    "chain": chain,
+                    "subject": self.plain_text(self.subject) if self.subject else blocks.get("subject"),
+                    "text": self.plain_text(self.text) if self.text else blocks.get("text_body"),
+                    "html": blocks.get("html_body") if mail_blocks else template,
+                }
+        return self._compiled
+
+    def render(self, context, request=None):
+        """Returns the (subject, text, html) of a message"""
+
+        compiled = self.compile()
+        context = make_context(context, request=request)
+        parts = []
+
+        for name in ("subject", "text", "html"):
+            node = compiled[name]
+            if node is None:
+                parts.append("")
+            elif isinstance(node, Template):
+                parts.append(node.render(context).strip())
+            else:
+                with context.bind_template(compiled["template"]), context.render_context.push_state(compiled["template"]):
+                    # a block renders its most derived override, with block.super, from the block context
+                    block_context = BlockContext()
+                    for template_blocks in compiled["chain"]:
+                        block_context.add_blocks(template_blocks)
+                    context.render_context[BLOCK_CONTEXT_KEY] = block_context
+                    parts.append(node.render(context).strip())
+
+        subject, text, html = parts
+        # a header can't span lines
+        return " ".join(subject.splitlines()), text, html
+
+    def message(self, to, context, from_email=None, request=None):
+        subject, text, html = self.render(context, request)
+        message = EmailMultiAlternatives(subject, text, from_email or settings.DEFAULT_FROM_EMAIL, to)
+        if html and text:
+            message.attach_alternative(html, "text/html")
+        elif html:
+            message.body = html
+            message.content_subtype = "html"
+        return message
+
+    def send(self, to, context, from_email=None, request=None):
+        return self.message(to, context, from_email, request).send()
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def email_template(html_template, subject=None, text=None):
+    """The process wide EmailTemplate of an html template name"""
+
+    key = (html_template, subject, text)
+    if key not in _templates:
+        with _templates_lock:
+            _templates.setdefault(key, EmailTemplate(html_template, subject, text))
+    return _templates[key]
+
+
+ACTIVATION_EMAIL = email_template(
+    "email/activation.html",
+    subject="ACCOUNT VERIFICATION FOR {{ site_name|upper }}",
+    text="""Hi, {{ first_name|title }}.
+    Thank you for signing up!
+    Complete your verification on the {{ site_name }} with the OTP below:
+
+                    {{ code }}
+
+    Expires in {{ expires_in }} minutes!
+
+    Cheers,
+    {{ site_name }} Team
+""",
+)
+
+NEW_OTP_EMAIL = email_template(
+    "email/new_otp.html",
+    subject="NEW OTP FOR {{ site_name }}",
+    text="""Hi, {{ first_name|title }}.
+
+    Complete your verification on {{ site_name }} with the OTP below:
+
+                    {{ code }}
+
+    Expires in {{ expires_in }} minutes!
+
+    Thank you,
+    Desmond
+""",
+)
+
+CONFIRMATION_EMAIL = email_template(
+    "email/confirmation.html",
+    subject="VERIFICATION COMPLETE",
+    text="""Hi, {{ first_name|title }}.
+    Your account has been activated and is ready to use!
+
+    Cheers,
+    {{ site_name }} Team
+""",
+)
+
+
+def warm_templates():
+    """Compiles the registered email templates so the first message doesn't pay for it"""
+
+    for template in list(_templates.values()):
+        try:
+            template.compile()
+        except TemplateDoesNotExist as error:
+            logger.warning("email template %s not found", error)
+
 
 class CustomPasswordResetEmail(PasswordResetEmail):
     template_name = "email/password_reset.html"
@@ -15,4 +199,9 @@ class CustomPasswordResetEmail(PasswordResetEmail):
         context["domain"] = self.request.META.get('HTTP_REFERER')
             
         
-        return context
\ No newline at end of file
+        return context
+
+    def render(self):
+        # same blocks as templated_mail's render, from the compiled template
+        self.subject, self.body, self.html = email_template(self.template_name).render(self.get_context_data(), self.request)
+        self._attach_body()
@@ -0,0 +1,123 @@
+"""
+Password hashing helpers.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.db import close_old_connections
+
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyStats:
+    """Thread safe count/total/max of named timings, reported in milliseconds"""
+
+    def __init__(self, *names):
+        self._lock = threading.Lock()
+        self._timings = {name: [0, 0.0, 0.0] for name in names}
+
+    def record(self, name, seconds):
+        with self._lock:
+            timing = self._timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                name: {
+                    "count": count,
+                    "avg_ms": round(total * 1000 / count, 2) if count else 0,
+                    "max_ms": round(longest * 1000, 2),
+                }
+                for name, (count, total, longest) in self._timings.items()
+            }
+
+
+# django's own count is the floor, a calibration may only make hashes more expensive
+MIN_ITERATIONS = PBKDF2PasswordHasher.iterations
+
+
+class CalibratedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 using the iteration count picked by `manage.py calibrate_hashers`
+    (PASSWORD_HASH_ITERATIONS), never fewer than django's default.
+
+    Hashes stored with another count report `must_update`, so django's check_password
+    rehashes them to the calibrated cost the next time the user logs in through `user_login`.
+    """
+
+    @property
+    def iterations(self):
+        return max(getattr(settings, "PASSWORD_HASH_ITERATIONS", None) or 0, MIN_ITERATIONS)
+
+
+class HashingPoolFull(Exception):
+    """Raised when more password checks are waiting than the pool accepts"""
+
+
+class HashingPool:
+    """
+    Bounded thread pool running password checks off the event loop.
+
+    PBKDF2 runs inside hashlib with the GIL released, so threads hash in parallel.
+    At most ``workers`` checks run at once and at most ``queue_limit`` more may wait;
+    anything beyond that is refused straight away rather than piling up behind a login burst.
+    """
+
+    def __init__(self, workers=4, queue_limit=64):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.stats = LatencyStats("queue_wait", "hash")
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    @classmethod
+    def from_settings(cls, setting_name):
+        options = getattr(settings, setting_name, {})
+        return cls(workers=options.get("WORKERS", 4), queue_limit=options.get("QUEUE_LIMIT", 64))
+
+    @property
+    def executor(self):
+        # threads don't survive a fork, a preloaded master must not hand its pool to the workers
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+                self._pid = os.getpid()
+            return self._executor
+
+    async def run(self, func, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise HashingPoolFull()
+
+        submitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            self.stats.record("queue_wait", started - submitted)
+            close_old_connections()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                self.stats.record("hash", elapsed)
+                close_old_connections()
+                logger.debug("password check waited %.1fms, ran %.1fms", (started - submitted) * 1000, elapsed * 1000)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, job)
+        finally:
+            self._slots.release()
+
+
+login_pool = HashingPool.from_settings("LOGIN_HASH_POOL")
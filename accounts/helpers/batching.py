@@ -0,0 +1,17 @@
+def keyset_batches(queryset, batch_size=1000, field="pk"):
+    """
+    Yields lists of at most `batch_size` keys of `queryset` in ascending order.
+
+    Each batch seeks past the last key seen instead of using OFFSET, so every
+    query costs the same however far into the table it is, and rows deleted
+    between batches don't shift the next one.
+    """
+
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(**{f"{field}__gt": last})
+        keys = list(page.order_by(field).values_list(field, flat=True)[:batch_size])
+        if not keys:
+            return
+        yield keys
+        last = keys[-1]
@@ -0,0 +1,359 @@
+"""
+Profile image pipeline.
+
+Images are content addressed: each is stored once, named after the sha256 of its bytes
+(`profile_photos/<sha256>.jpg` and its variants next to it), so its urls never change
+and can be cached forever, and a ProfileImage row counts the users pointing at it.
+
+During the request an upload is only validated (format, dimensions, from the image
+header) and hashed. An image already stored is attached to the user straight away,
+without any storage write. Otherwise the upload (spooled to a temporary file in chunks
+by accounts/parsers.py) is moved into the staging storage and a celery task writes the
+original and its resized variants (PROFILE_IMAGES["VARIANTS"]) to the default storage
+and attaches them.
+
+Clients can also upload straight to the storage with an upload ticket
+(accounts/uploads.py), the worker then validates the object before processing it.
+
+Images no user points at any more are deleted by collect_orphans once
+ORPHAN_GRACE_SECONDS have passed.
+
+JPEGs are decoded at the smallest scale covering the largest variant, other formats
+(bounded by MAX_PIXELS) are decoded once and shrunk to the largest variant before any
+copy, and every variant is derived from that, so a worker holds one full size buffer
+per image at most.
+"""
+import hashlib
+import io
+import logging
+import posixpath
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from django.utils.functional import LazyObject
+from django.utils.module_loading import import_string
+from PIL import Image, ImageOps
+
+from .models import ProfileImage
+
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"JPEG": "jpg", "PNG": "png"}
+
+
+def get_image_settings():
+    return {
+        "VARIANTS": {"thumbnail": 64, "small": 256, "medium": 512},
+        "MAX_UPLOAD_SIZE": 10 * 1024 * 1024,
+        "MAX_PIXELS": 40_000_000,
+        "QUALITY": 85,
+        "UPLOAD_TO": "profile_photos",
+        "ORPHAN_GRACE_SECONDS": 24 * 60 * 60,
+        "STAGING_STORAGE": "django.core.files.storage.FileSystemStorage",
+        "STAGING_OPTIONS": {},
+        **getattr(settings, "PROFILE_IMAGES", {}),
+    }
+
+
+class StagingStorage(LazyObject):
+    """Where uploads wait for the worker, a directory the web and worker processes share"""
+
+    def _setup(self):
+        options = get_image_settings()
+        self._wrapped = import_string(options["STAGING_STORAGE"])(**options["STAGING_OPTIONS"])
+
+
+staging_storage = StagingStorage()
+
+
+def variant_name(name, variant):
+    root, ext = posixpath.splitext(name)
+    return f"{root}_{variant}{ext}"
+
+
+def inspect_image(file):
+    """Checks the header of an uploaded image, returns its PIL format. Raises ValueError for anything else."""
+
+    options = get_image_settings()
+    if file.size > options["MAX_UPLOAD_SIZE"]:
+        raise ValueError(f"Images are limited to {options['MAX_UPLOAD_SIZE'] // (1024 * 1024)}MB")
+
+    file.seek(0)
+    try:
+        # only the header is read here, the pixels are decoded by the worker
+        with Image.open(file) as image:
+            image_format, (width, height) = image.format, image.size
+    except (OSError, Image.DecompressionBombError):
+        raise ValueError("Upload a valid image")
+    finally:
+        file.seek(0)
+
+    if image_format not in EXTENSIONS:
+        raise ValueError("Only png and jpeg images are supported")
+    if width * height > options["MAX_PIXELS"]:
+        raise ValueError("The image has too many pixels")
+    return image_format
+
+
+def digest_file(file):
+    sha256 = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+def release_image(name, now=None):
+    """Drops one reference to the stored image `name` (a no-op for images stored before content addressing)"""
+
+    if name:
+        ProfileImage.objects.filter(name=name, refcount__gt=0).update(
+            refcount=F("refcount") - 1, date_released=now or timezone.now(),
+        )
+
+
+def attach_image(user_id, digest):
+    """
+    Makes the stored image of `digest` the user's image, moving one reference from the
+    user's previous image to it. Returns False when no image of that digest is stored.
+    """
+
+    User = get_user_model()
+    with transaction.atomic():
+        user = User.objects.select_for_update().get(pk=user_id)
+        # locked so collect_orphans can't delete it before the reference is taken
+        image = ProfileImage.objects.select_for_update().filter(digest=digest).first()
+        if image is None:
+            return False
+
+        if user.image.name != image.name:
+            ProfileImage.objects.filter(pk=image.pk).update(refcount=F("refcount") + 1)
+            release_image(user.image.name)
+            user.image = image.name
+            user.save(update_fields=["image"])
+    return True
+
+
+def submit_upload(user_id, file):
+    """
+    Attaches a validated upload to the user when the same image is stored already and
+    returns None, otherwise moves it into the staging storage and returns
+    (staged name, digest) for process_upload.
+    """
+
+    image_format = inspect_image(file)
+    digest = digest_file(file)
+    if attach_image(user_id, digest):
+        return None
+
+    # a spooled upload is moved there (a rename) by FileSystemStorage, not copied
+    return staging_storage.save(f"{digest}.{EXTENSIONS[image_format]}", file), digest
+
+
+def render_variant(image, size, image_format, quality):
+    variant = image.copy()
+    variant.thumbnail((size, size), Image.LANCZOS)
+    if image_format == "JPEG" and variant.mode not in ("RGB", "L"):
+        variant = variant.convert("RGB")
+
+    buffer = io.BytesIO()
+    variant.save(buffer, image_format, quality=quality, optimize=True)
+    return ContentFile(buffer.getvalue())
+
+
+def image_names(name):
+    return [name] + [variant_name(name, variant) for variant in get_image_settings()["VARIANTS"]]
+
+
+def render_variants(file, sizes, quality):
+    """
+    Decodes the image in `file` once and renders it at each of `sizes` ({variant: size}).
+    Raises ValueError when the image can't be decoded.
+    """
+
+    try:
+        with Image.open(file) as image:
+            image_format = image.format
+            largest = max(sizes.values(), default=0)
+            # JPEG decodes straight at 1/2 .. 1/8 scale when that still covers the largest variant,
+            # other formats are decoded once and shrunk in place before anything is copied
+            image.draft("RGB", (largest, largest))
+            image.thumbnail((largest, largest), Image.LANCZOS)
+            # the box is square, so rotating after the downscale gives the same variants
+            image = ImageOps.exif_transpose(image)
+
+            return {
+                variant: render_variant(image, size, image_format, quality)
+                for variant, size in sorted(sizes.items(), key=lambda item: -item[1])
+            }
+    except (OSError, Image.DecompressionBombError) as error:
+        # e.g. a truncated file whose header passed inspect_image
+        raise ValueError("The image could not be decoded") from error
+
+
+def store_image(staged_name, digest, storage=default_storage, source=staging_storage):
+    """
+    Writes the staged original and its variants to `storage` under names derived from `digest`.
+    Returns the name of the original.
+    """
+
+    options = get_image_settings()
+    name = posixpath.join(options["UPLOAD_TO"], f"{digest}{posixpath.splitext(staged_name)[1]}")
+    # same name, same bytes: files left by an interrupted run or a concurrent upload are kept
+    missing = {
+        variant: size for variant, size in options["VARIANTS"].items() if not storage.exists(variant_name(name, variant))
+    }
+
+    with source.open(staged_name) as staged:
+        # decoded before anything is written, an image that can't be leaves nothing behind
+        rendered = render_variants(staged, missing, options["QUALITY"]) if missing else {}
+        staged.seek(0)
+
+        if not storage.exists(name):
+            # the original is copied in chunks, never decoded
+            storage.save(name, File(staged))
+
+    for variant, content in rendered.items():
+        storage.save(variant_name(name, variant), content)
+
+    return name
+
+
+def store_and_attach(user_id, staged_name, digest=None, source=staging_storage):
+    User = get_user_model()
+    if digest is None:
+        with source.open(staged_name) as staged:
+            digest = digest_file(File(staged))
+
+    # a second pass stores the image again when collect_orphans deleted the stored one meanwhile
+    for attempt in range(2):
+        if not ProfileImage.objects.filter(digest=digest).exists():
+            name = store_image(staged_name, digest, source=source)
+            ProfileImage.objects.get_or_create(digest=digest, defaults={"name": name})
+
+        if not User.objects.filter(pk=user_id).exists():
+            # the image is collected as an orphan
+            logger.info("user %s is gone, dropping its uploaded image", user_id)
+            return False
+        if attach_image(user_id, digest):
+            return True
+    return False
+
+
+def process_upload(user_id, staged_name, digest=None, source=staging_storage):
+    """
+    Stores a staged upload unless the same image was stored meanwhile, and makes it the image of the user.
+
+    The staged file is deleted once processed, or when it can't be decoded; any other error
+    (storage, database) leaves it in place for the task's retries (accounts/tasks.py).
+    """
+
+    try:
+        attached = store_and_attach(user_id, staged_name, digest, source)
+    except ValueError as error:
+        logger.info("rejected upload %s of user %s: %s", staged_name, user_id, error)
+        attached = False
+
+    source.delete(staged_name)
+    return attached
+
+
+def process_direct_upload(user_id, name, storage=default_storage):
+    """
+    Validates an object uploaded to `storage` with an upload ticket (accounts/uploads.py),
+    then processes it like a staged upload.
+    """
+
+    if not storage.exists(name):
+        # a ticket completed twice: the first run processed the object and deleted it
+        logger.info("direct upload %s of user %s is gone, it was processed already", name, user_id)
+        return False
+
+    try:
+        with storage.open(name) as uploaded:
+            file = File(uploaded, name)
+            image_format = inspect_image(file)
+            if EXTENSIONS[image_format] != posixpath.splitext(name)[1][1:]:
+                raise ValueError("The image doesn't match the content type of its ticket")
+            digest = digest_file(file)
+    except ValueError as error:
+        logger.info("rejected direct upload %s of user %s: %s", name, user_id, error)
+        storage.delete(name)
+        return False
+
+    return process_upload(user_id, name, digest, source=storage)
+
+
+def collect_orphans(grace_seconds=None, batch_size=100, storage=default_storage, now=None):
+    """
+    Deletes the images no user has pointed at for `grace_seconds`, with their variants.
+    Returns the number of images deleted.
+    """
+
+    grace_seconds = get_image_settings()["ORPHAN_GRACE_SECONDS"] if grace_seconds is None else grace_seconds
+    cutoff = (now or timezone.now()) - timedelta(seconds=grace_seconds)
+    collected = 0
+
+    while True:
+        with transaction.atomic():
+            # skip_locked: images being attached right now are left alone
+            orphans = list(
+                ProfileImage.objects.select_for_update(skip_locked=True)
+                .filter(refcount=0, date_released__lt=cutoff)
+                .values_list("digest", "name")[:batch_size]
+            )
+            if not orphans:
+                break
+            ProfileImage.objects.filter(digest__in=[digest for digest, _ in orphans], refcount=0).delete()
+
+            # before the commit: while the rows are visible an upload of the same image waits on
+            # their lock in attach_image (then stores it again), once they are gone so are the files.
+            # A file whose delete fails is left behind, never referenced.
+            for _, name in orphans:
+                for stored in image_names(name):
+                    try:
+                        storage.delete(stored)
+                    except Exception:
+                        logger.exception("could not delete orphaned image %s", stored)
+        collected += len(orphans)
+
+    return collected
+
+
+def recount_references():
+    """Recomputes every refcount from the users' images, e.g. after users were deleted in bulk"""
+
+    User = get_user_model()
+    counts = dict(
+        User.objects.filter(image__startswith=get_image_settings()["UPLOAD_TO"] + "/")
+        .values_list("image").annotate(users=Count("pk")).values_list("image", "users")
+    )
+    updated = 0
+    for image in ProfileImage.objects.iterator():
+        if counts.get(image.name, 0) == image.refcount:
+            continue
+
+        # the counts above may predate an attach_image, recount this image under its lock
+        with transaction.atomic():
+            image = ProfileImage.objects.select_for_update().filter(pk=image.pk).first()
+            if image is None:
+                continue
+            refcount = User.objects.filter(image=image.name).count()
+            if refcount == image.refcount:
+                continue
+
+            fields = {"refcount": refcount}
+            if refcount < image.refcount:
+                fields["date_released"] = timezone.now()
+            ProfileImage.objects.filter(pk=image.pk).update(**fields)
+        updated += 1
+    return updated
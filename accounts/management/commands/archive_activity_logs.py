@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts import archive
+
+
+class Command(BaseCommand):
+    help = (
+        'Move activity logs past their retention period to compressed segments on storage, '
+        'or show the archived logs of a user'
+    )
+
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None, help='retention in days, ACTIVITY_LOG["RETENTION_DAYS"] by default',
+        )
+        parser.add_argument('--user', help='print the archived logs of this user id instead of archiving')
+        parser.add_argument('--since-days', type=int, default=None, help='with --user, only the last N days')
+
+
+    def handle(self, *args, **options):
+        
+        if options['user']:
+            since = None
+            if options['since_days'] is not None:
+                since = timezone.now() - timedelta(days=options['since_days'])
+            
+            count = 0
+            for record in archive.archived_activity(options['user'], since=since):
+                self.stdout.write(f"{record['date_created'].isoformat()}  {record['action']}")
+                count += 1
+            self.stdout.write(self.style.SUCCESS(f"{count} archived entries"))
+            return
+        
+        segments, rows = archive.archive_activity_logs(options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {rows} activity logs in {segments} segments"))
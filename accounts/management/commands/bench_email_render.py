@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.template import TemplateDoesNotExist
+from django.template.loader import render_to_string
+
+from accounts import emails
+
+
+class Command(BaseCommand):
+    help = 'Measure the per message render cost of the email templates, compiled once versus loaded and rendered per message'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000, help='messages rendered per template')
+
+
+    def timed(self, func, count):
+        """average duration of func in microseconds"""
+
+        func()  # warm up
+        started = time.perf_counter()
+        for _ in range(count):
+            func()
+        return (time.perf_counter() - started) * 1e6 / count
+
+
+    def handle(self, *args, **options):
+        count = options['messages']
+        context = {'first_name': 'ada', 'code': '123456', 'site_name': 'Site', 'expires_in': 10, 'MARKET_PLACE_URL': ''}
+
+        for template in (emails.ACTIVATION_EMAIL, emails.NEW_OTP_EMAIL, emails.CONFIRMATION_EMAIL):
+            try:
+                template.compile()
+            except TemplateDoesNotExist:
+                self.stdout.write(f"{template.html_template}: skipped, template not found")
+                continue
+
+            # what the signals did before: look the template up through the loaders for every message
+            legacy = self.timed(lambda: render_to_string(template.html_template, context), count)
+            compiled = self.timed(lambda: template.render(context), count)
+            self.stdout.write(
+                f"{template.html_template}: render_to_string {legacy:.1f}us per message, "
+                f"compiled subject/text/html {compiled:.1f}us per message"
+            )
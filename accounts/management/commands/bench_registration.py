@@ -0,0 +1,76 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from accounts.serializers import UserRegistrationSerializer
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure registrations per second through UserRegistrationSerializer, rolled back so no user is kept'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='registrations to run')
+        parser.add_argument(
+            '--with-hashing', action='store_true',
+            help='keep the configured password hasher, by default a cheap one is used so the pipeline itself is measured',
+        )
+
+
+    def register(self, index):
+        serializer = UserRegistrationSerializer(data={
+            'email': f'bench-{index}@example.com',
+            'password': 'Bench#Password-2023',
+            'first_name': 'bench',
+            'last_name': 'user',
+            'role': 'user',
+            'phone': '+2348000000000',
+        })
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+
+    def run(self, count):
+        try:
+            with transaction.atomic():
+                self.register(-1)  # warm up
+                with CaptureQueriesContext(connection) as queries:
+                    self.register(-2)
+                statements = [query['sql'] for query in queries.captured_queries]
+
+                started = time.perf_counter()
+                for index in range(count):
+                    # each registration commits its own savepoint, the outer transaction is thrown away
+                    self.register(index)
+                elapsed = time.perf_counter() - started
+                raise Rollback
+        except Rollback:
+            pass
+        return elapsed, statements
+
+
+    def handle(self, *args, **options):
+        count = options['users']
+        
+        if options['with_hashing']:
+            elapsed, statements = self.run(count)
+        else:
+            with override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']):
+                elapsed, statements = self.run(count)
+        
+        self.stdout.write(f"Statements per registration ({len(statements)}):")
+        for sql in statements:
+            self.stdout.write(f"  {sql[:100]}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{count / elapsed:.0f} registrations/s on one worker, {elapsed * 1000 / count:.2f}ms each "
+            "(activation emails are sent on commit and not included)"
+        ))
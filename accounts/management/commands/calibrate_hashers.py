@@ -0,0 +1,82 @@
+import math
+import time
+
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand
+
+from accounts.hashers import MIN_ITERATIONS, CalibratedPBKDF2PasswordHasher
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the configured password hashers on this host and recommend a cost for a target login latency'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-ms', type=float, default=250, help='hashing time budget of a single login')
+        parser.add_argument('--samples', type=int, default=5, help='timed hashes per hasher')
+
+
+    def timed(self, func, samples):
+        """median duration of func in seconds"""
+
+        func()  # warm up
+        timings = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return sorted(timings)[len(timings) // 2]
+
+
+    def handle(self, *args, **options):
+        target = options['target_ms'] / 1000
+        samples = options['samples']
+        password, salt = "calibration-password", "calibrationsalt0"
+
+        for hasher in get_hashers():
+            name = f"{hasher.algorithm} ({hasher.__class__.__name__})"
+
+            if hasattr(hasher, 'iterations'):
+                iterations = hasher.iterations
+                elapsed = self.timed(lambda: hasher.encode(password, salt, iterations), samples)
+                recommended = max(MIN_ITERATIONS, int(iterations * target / elapsed) // 10000 * 10000)
+                if isinstance(hasher, CalibratedPBKDF2PasswordHasher):
+                    setting = f"PASSWORD_HASH_ITERATIONS={recommended}"
+                else:
+                    setting = f"iterations = {recommended} (subclass {hasher.__class__.__name__})"
+                current = f"{iterations} iterations"
+
+            elif hasattr(hasher, 'work_factor'):
+                work_factor = hasher.work_factor
+                elapsed = self.timed(lambda: hasher.encode(password, salt, work_factor), samples)
+                # scrypt cost is a power of two and memory grows with it as fast as time does
+                recommended = 2 ** max(1, int(math.log2(work_factor * target / elapsed)))
+                setting = f"work_factor = {recommended} (subclass {hasher.__class__.__name__}, check maxmem)"
+                current = f"work factor {work_factor}"
+
+            else:
+                try:
+                    hasher._load_library()
+                except ValueError:
+                    self.stdout.write(f"{name}: skipped, library not installed")
+                    continue
+
+                if hasattr(hasher, 'rounds'):
+                    elapsed = self.timed(lambda: hasher.encode(password, hasher.salt()), samples)
+                    # bcrypt cost doubles with every extra round
+                    recommended = max(4, hasher.rounds + int(math.log2(target / elapsed)))
+                    setting = f"rounds = {recommended} (subclass {hasher.__class__.__name__})"
+                    current = f"{hasher.rounds} rounds"
+
+                else:
+                    elapsed = self.timed(lambda: hasher.encode(password, salt), samples)
+                    recommended = max(1, round(hasher.time_cost * target / elapsed))
+                    setting = f"time_cost = {recommended} (subclass {hasher.__class__.__name__})"
+                    current = f"time cost {hasher.time_cost}"
+
+            self.stdout.write(f"{name}: {current} took {elapsed * 1000:.1f}ms, recommended {setting}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Recommendations target {options['target_ms']:.0f}ms per hash. "
+            "Stored passwords are rehashed to the calibrated cost on the users' next login."
+        ))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from accounts import images
+
+
+class Command(BaseCommand):
+    help = 'Delete the stored profile images no user points at any more'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-seconds', type=int,
+            help='time an image stays unreferenced before it is deleted, PROFILE_IMAGES["ORPHAN_GRACE_SECONDS"] by default',
+        )
+        parser.add_argument('--recount', action='store_true', help='recompute the reference counts from the users first')
+
+
+    def handle(self, *args, **options):
+        
+        if options['recount']:
+            updated = images.recount_references()
+            self.stdout.write(f"Corrected {updated} reference counts")
+        
+        collected = images.collect_orphans(options['grace_seconds'])
+        
+        self.stdout.write(self.style.SUCCESS(f"Deleted {collected} orphaned images"))
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from accounts.devices import register_devices
+from accounts.helpers.batching import keyset_batches
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Copy the fcm_token of each user into the push device registry'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.PRUNE_BATCH_SIZE, help='users upserted per statement')
+        parser.add_argument('--platform', default='android', help='platform recorded for the imported devices')
+
+
+    def handle(self, *args, **options):
+        
+        users = User.objects.exclude(fcm_token__isnull=True).exclude(fcm_token="")
+        imported = 0
+        
+        for ids in keyset_batches(users, options['batch_size']):
+            tokens = User.objects.filter(id__in=ids).values_list('id', 'fcm_token')
+            imported += register_devices((user_id, token, options['platform']) for user_id, token in tokens)
+        
+        self.stdout.write(self.style.SUCCESS(f"Imported {imported} device tokens"))
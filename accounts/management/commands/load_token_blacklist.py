@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from accounts.blacklist import blacklist_store
+
+
+class Command(BaseCommand):
+    help = 'Copy the unexpired tokens of the token_blacklist tables into the configured blacklist store'
+
+
+    def handle(self, *args, **options):
+        
+        count = 0
+        revoked = BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now()).values_list(
+            'token__jti', 'token__expires_at'
+        )
+        
+        for jti, expires_at in revoked.iterator():
+            blacklist_store.add(jti, expires_at.timestamp())
+            count += 1
+            
+        self.stdout.write(self.style.SUCCESS(f"Loaded {count} revoked tokens"))
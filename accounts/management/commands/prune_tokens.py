@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts import pruning
+
+
+class Command(BaseCommand):
+    help = 'Delete expired refresh tokens from the token_blacklist tables in small batches'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.PRUNE_BATCH_SIZE, help='rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0, help='seconds to sleep between batches')
+        parser.add_argument('--compact', action='store_true', help='also blank the stored token text of the remaining rows')
+
+
+    def handle(self, *args, **options):
+        
+        rows, reclaimed = pruning.prune_expired_tokens(options['batch_size'], options['pause'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {rows} expired token rows, {reclaimed / 1024:.1f}KB of token data"))
+        
+        if options['compact']:
+            rows, reclaimed = pruning.compact_tokens(options['batch_size'], options['pause'])
+            self.stdout.write(self.style.SUCCESS(f"Compacted {rows} token rows, {reclaimed / 1024:.1f}KB of token data"))
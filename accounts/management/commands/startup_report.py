@@ -0,0 +1,63 @@
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.clients import registered_clients
+
+
+BOOT_SCRIPT = (
+    "import time; started = time.perf_counter(); "
+    "import configurations; configurations.setup(); "
+    "print(time.perf_counter() - started)"
+)
+
+
+class Command(BaseCommand):
+    help = 'Report the import and boot time of the project in a fresh process, and the build time of the lazy clients'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=15, help='number of slowest imports listed')
+        parser.add_argument(
+            '--clients', nargs='*', help='build and time these clients, every registered one when no name is given',
+        )
+
+
+    def handle(self, *args, **options):
+        
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", BOOT_SCRIPT], capture_output=True, text=True, cwd=settings.BASE_DIR,
+        )
+        if result.returncode:
+            raise CommandError(f"boot failed: {result.stderr.strip().splitlines()[-1]}")
+        
+        imports = []
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line.split(":", 1)[1].split("|")
+            # nested imports are indented, the top level ones carry the cost of everything below them
+            if not name.startswith("  "):
+                imports.append((int(cumulative), name.strip()))
+        
+        self.stdout.write(f"Boot (settings and django.setup): {float(result.stdout.strip().splitlines()[-1]):.3f}s")
+        self.stdout.write("Slowest imports:")
+        for cumulative, name in sorted(imports, reverse=True)[:options['top']]:
+            self.stdout.write(f"  {cumulative / 1e6:8.3f}s  {name}")
+        
+        self.stdout.write("Clients:")
+        for name, client in registered_clients().items():
+            if options['clients'] is not None and (not options['clients'] or name in options['clients']):
+                try:
+                    client.get()
+                except Exception as error:
+                    self.stdout.write(self.style.ERROR(f"  {name}: failed, {error!r}"))
+                    continue
+            if client.ready:
+                self.stdout.write(f"  {client.build_seconds:8.3f}s  {name}")
+            else:
+                self.stdout.write(f"  {'not built':>9}  {name}")
+        
+        self.stdout.write(self.style.SUCCESS("Done"))
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts import pruning
+
+
+class Command(BaseCommand):
+    help = 'Delete expired activation OTPs and the surplus live OTPs of each user'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.PRUNE_BATCH_SIZE, help='rows deleted per statement',
+        )
+        parser.add_argument(
+            '--max-per-user', type=int, default=settings.ACTIVATION_OTP['MAX_LIVE_PER_USER'], help='live OTPs kept per user',
+        )
+
+
+    def handle(self, *args, **options):
+        
+        expired = pruning.prune_expired_otps(options['batch_size'])
+        capped = pruning.cap_live_otps(options['max_per_user'])
+        
+        self.stdout.write(self.style.SUCCESS(f"Deleted {expired} expired and {capped} surplus OTPs"))
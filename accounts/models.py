@@ -26,13 +26,13 @@ class User(AbstractBaseUser, PermissionsMixin):
         - last_name (str): Last name of the user
         - email (str): Email address of the user.
         - role (str): User type i.e admin, user, vendor.
-        - image (img): profile picture of users
+        - image (img): profile picture of users, stored once per content (ProfileImage)
         - password (str): Password of the users
         - is_staff (bool): Field to mark an admin user as a super admin
         - is_admin (bool): Field to mark the  user as an admin
         - is_active (bool): Active status of the user
         - is_deleted (bool): Deleted status of the user
-        - fcm_token (str): User's device firebase token for push notification
+        - fcm_token (str): User's device firebase token, superseded by DeviceToken (manage.py import_device_tokens)
         - provider (str): Channel through which user signed up.
         - date_joined (datetime): Time at which the user signed up.
     """
@@ -76,10 +76,31 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['id','first_name', 'last_name', 'role', 'phone', ]
     
+    # fields the cached permissions and token claims depend on, see accounts/signals.py
+    PERMISSION_FIELDS = ('is_superuser', 'is_staff', 'is_active')
+    
     class Meta:
         verbose_name = _('user')
         verbose_name_plural = _('users')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        # the values a save compares against to tell whether the permissions changed
+        user._loaded_permission_fields = {
+            name: value for name, value in zip(field_names, values) if name in cls.PERMISSION_FIELDS
+        }
+        return user
+
+    def permission_fields_changed(self):
+        """Whether is_superuser, is_staff or is_active differ from the loaded row (always True for unloaded users)"""
+        
+        loaded = getattr(self, '_loaded_permission_fields', {})
+        return any(loaded.get(name, not value) != value for name, value in self.permission_fields().items())
+
+    def permission_fields(self):
+        return {name: getattr(self, name) for name in self.PERMISSION_FIELDS}
+
     def __str__(self):
         return f"{self.email} -- {self.role}"
     
@@ -107,6 +128,24 @@ class User(AbstractBaseUser, PermissionsMixin):
             return self.image.url
         return ""
     
+    @property
+    def image_variants(self):
+        
+        """See the urls of the resized copies of the user's image
+
+        Returns:
+            dict: url of each variant of PROFILE_IMAGES["VARIANTS"], empty if no image uploaded
+        """
+        
+        from .images import get_image_settings, variant_name
+        
+        if not self.image:
+            return {}
+        return {
+            variant: self.image.storage.url(variant_name(self.image.name, variant))
+            for variant in get_image_settings()["VARIANTS"]
+        }
+    
     def delete(self):
         
         """
@@ -149,16 +188,23 @@ class ActivationOtp(models.Model):
 
     Fields:
         - id (int): Unique identifier for the OTP.
-        - code (str): OTP for the user
+        - code (str): HMAC of the user's OTP, see accounts/otp.py
         - user (FK): User attached to the  otp
         - expiry_date (datetime): Time at which the OTP expires.
     """
 
     user  =models.ForeignKey('accounts.User', on_delete=models.CASCADE)
-    code = models.CharField(max_length=6)
+    code = models.CharField(max_length=64)
     expiry_date = models.DateTimeField()
     
     
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "code"], name="activationotp_user_code_idx"),
+            models.Index(fields=["expiry_date"], name="activationotp_expiry_idx"),
+        ]
+    
+    
     def is_valid(self):
         """Checks if the OTP has expires or not
 
@@ -207,10 +253,22 @@ class ActivityLog(models.Model):
     
     user = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
     action = models.CharField(max_length=255)
-    date_created = models.DateTimeField(auto_now_add=True)
+    # set when logged, entries are written in batches later
+    date_created = models.DateTimeField(default=timezone.now, editable=False)
     is_deleted = models.BooleanField(default=False)
     
     
+    class Meta:
+        indexes = [
+            # activity_logs feed: a user's live entries, newest first, keyset paginated on (date_created, id)
+            models.Index(
+                fields=["user", "-date_created", "-id"],
+                name="activitylog_user_feed_idx",
+                condition=models.Q(is_deleted=False),
+            ),
+        ]
+        
+        
     def delete(self):
         self.is_deleted = True
         self.save()
@@ -222,6 +280,126 @@ class ActivityLog(models.Model):
         
     def __str__(self):
         return f"{self.user.first_name} {self.user.last_name} {self.action}"
+
+
+
+class OutboxEmail(models.Model):
+    """
+    Database schema for emails waiting to be delivered, see accounts/outbox.py.
+
+    Fields:
+        - message (json): subject, body, recipients, alternatives and headers of the email
+        - status (str): pending, sent or failed
+        - attempts (int): delivery attempts so far
+        - next_attempt_at (datetime): time before which the email is not retried
+        - last_error (str): error of the last failed attempt
+        - date_created (datetime): time the email was queued
+        - date_sent (datetime): time the email was delivered
+    """
+    
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    )
+    
+    message = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_sent = models.DateTimeField(null=True, blank=True)
+    
     
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["next_attempt_at"],
+                name="outboxemail_due_idx",
+                condition=models.Q(status="pending"),
+            ),
+        ]
     
-    
\ No newline at end of file
+    
+    def __str__(self):
+        return f"{self.message.get('subject')} -> {', '.join(self.message.get('to', []))} ({self.status})"
+
+
+
+class ProfileImage(models.Model):
+    """
+    Database schema for the stored profile images, see accounts/images.py.
+
+    Images are stored once per content under names derived from their sha256, the
+    users with the image point at that name through User.image.
+
+    Fields:
+        - digest (str): sha256 of the original image
+        - name (str): storage name of the original, the variants are stored next to it
+        - refcount (int): number of users with the image
+        - date_created (datetime): time the image was stored
+        - date_released (datetime): last time a user dropped the image, orphans are collected a grace period after it
+    """
+    
+    digest = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=255, unique=True)
+    refcount = models.PositiveIntegerField(default=0)
+    date_created = models.DateTimeField(default=timezone.now)
+    date_released = models.DateTimeField(default=timezone.now)
+    
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=["date_released"], name="profileimage_orphan_idx", condition=models.Q(refcount=0)),
+        ]
+    
+    
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
+
+
+
+class DeviceToken(models.Model):
+    """
+    Database schema for the push notification tokens of users' devices, see accounts/devices.py.
+
+    Fields:
+        - token_hash (str): sha256 of the token, a device is upserted on it
+        - user (FK): user signed in on the device
+        - token (str): firebase registration token of the device
+        - platform (str): android, ios or web
+        - date_created (datetime): time the device was first registered
+        - last_seen (datetime): last time the device registered its token, written behind
+    """
+    
+    ANDROID = "android"
+    IOS = "ios"
+    WEB = "web"
+    PLATFORM_CHOICES = (
+        (ANDROID, "Android"),
+        (IOS, "iOS"),
+        (WEB, "Web"),
+    )
+    
+    token_hash = models.CharField(max_length=64, primary_key=True)
+    # indexed by devicetoken_user_seen_idx
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="devices", db_index=False)
+    token = models.TextField()
+    platform = models.CharField(max_length=10, choices=PLATFORM_CHOICES, default=ANDROID)
+    date_created = models.DateTimeField(default=timezone.now)
+    last_seen = models.DateTimeField(default=timezone.now)
+    
+    
+    class Meta:
+        indexes = [
+            # push fan-out: the devices of a set of users
+            models.Index(fields=["user", "-last_seen"], name="devicetoken_user_seen_idx"),
+        ]
+    
+    
+    def __str__(self):
+        return f"{self.user_id} {self.platform} device"
@@ -0,0 +1,98 @@
+"""
+Activation OTP stores.
+
+Codes are never stored in clear: each is kept as an HMAC of (user id, code), so a
+verification is a lookup of one exact key of one user and consuming the code is the
+same single statement (a DELETE, or a cache delete) that checks it.
+"""
+import secrets
+from abc import ABC, abstractmethod
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from django.utils.module_loading import import_string
+
+from .models import ActivationOtp
+
+
+def hash_code(user_id, code):
+    return salted_hmac("accounts.otp", f"{user_id}:{code}", algorithm="sha256").hexdigest()
+
+
+def generate_code(digits=6):
+    return "".join(secrets.choice("0123456789") for _ in range(digits))
+
+
+class BaseOTPStore(ABC):
+
+    def __init__(self, ttl=600, digits=6, **kwargs):
+        self.ttl = ttl
+        self.digits = digits
+
+    def issue(self, user):
+        """Creates and returns a new code for the user, valid for `ttl` seconds"""
+        code = generate_code(self.digits)
+        self.save(user.pk, hash_code(user.pk, code))
+        return code
+
+    @abstractmethod
+    def save(self, user_id, hashed):
+        """Stores the hashed code as a pending code of the user"""
+
+    @abstractmethod
+    def consume(self, user, code):
+        """True when the code is a pending, unexpired code of the user. A code is only accepted once."""
+
+    def discard(self, user):
+        """Drops the other pending codes of the user once one was accepted"""
+
+
+class DatabaseOTPStore(BaseOTPStore):
+    """ActivationOtp rows, found through the (user, code) index. Expired rows are removed by the sweeper."""
+
+    def save(self, user_id, hashed):
+        ActivationOtp.objects.create(user_id=user_id, code=hashed, expiry_date=timezone.now() + timedelta(seconds=self.ttl))
+
+    def consume(self, user, code):
+        deleted, _ = ActivationOtp.objects.filter(
+            user_id=user.pk, code=hash_code(user.pk, code), expiry_date__gt=timezone.now(),
+        ).delete()
+        return deleted > 0
+
+    def discard(self, user):
+        ActivationOtp.objects.filter(user_id=user.pk).delete()
+
+
+class CacheOTPStore(BaseOTPStore):
+    """
+    One cache key per pending code expiring with it (redis, or locmem for tests),
+    nothing to sweep. Other pending codes of an activated user are left to expire.
+    """
+
+    def __init__(self, cache_alias="default", **kwargs):
+        super().__init__(**kwargs)
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def key(self, user_id, hashed):
+        return f"otp:{user_id}:{hashed}"
+
+    def save(self, user_id, hashed):
+        self.cache.set(self.key(user_id, hashed), 1, self.ttl)
+
+    def consume(self, user, code):
+        return bool(self.cache.delete(self.key(user.pk, hash_code(user.pk, code))))
+
+
+def load_store():
+    options = {"STORE": "accounts.otp.DatabaseOTPStore", "OPTIONS": {}, **getattr(settings, "ACTIVATION_OTP", {})}
+    return import_string(options["STORE"])(**options["OPTIONS"])
+
+
+otp_store = load_store()
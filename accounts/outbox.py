@@ -0,0 +1,182 @@
+"""
+Email outbox.
+
+EMAIL_BACKEND points at OutboxEmailBackend, so send_mail, djoser and templated_mail
+emails are stored as OutboxEmail rows in the request's transaction instead of being
+sent inline. Once that transaction commits a celery task delivers them through
+EMAIL_OUTBOX["DELIVERY_BACKEND"] (smtp in production, locmem/filebased in tests),
+reusing one connection per worker across messages and retrying failures with
+exponential backoff.
+"""
+import base64
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_outbox_settings():
+    return {
+        "DELIVERY_BACKEND": "django.core.mail.backends.smtp.EmailBackend",
+        "BATCH_SIZE": 50,
+        "MAX_ATTEMPTS": 6,
+        "RETRY_BACKOFF": 30,
+        "MAX_RETRY_BACKOFF": 3600,
+        "KEEP_SENT_DAYS": 7,
+        **getattr(settings, "EMAIL_OUTBOX", {}),
+    }
+
+
+def serialize_message(message):
+    attachments = []
+    for attachment in message.attachments:
+        filename, content, mimetype = attachment
+        if isinstance(content, str):
+            content = content.encode()
+        attachments.append([filename, base64.b64encode(content).decode(), mimetype])
+
+    return {
+        "subject": str(message.subject),
+        "body": str(message.body),
+        "from_email": message.from_email,
+        "to": list(message.to),
+        "cc": list(message.cc),
+        "bcc": list(message.bcc),
+        "reply_to": list(message.reply_to),
+        "headers": dict(message.extra_headers),
+        "alternatives": [list(alternative) for alternative in getattr(message, "alternatives", [])],
+        "content_subtype": message.content_subtype,
+        "attachments": attachments,
+    }
+
+
+def deserialize_message(data, connection=None):
+    message = EmailMultiAlternatives(
+        subject=data["subject"],
+        body=data["body"],
+        from_email=data["from_email"],
+        to=data["to"],
+        cc=data["cc"],
+        bcc=data["bcc"],
+        reply_to=data["reply_to"],
+        headers=data["headers"],
+        alternatives=[tuple(alternative) for alternative in data["alternatives"]],
+        connection=connection,
+    )
+    message.content_subtype = data["content_subtype"]
+    for filename, content, mimetype in data["attachments"]:
+        message.attach(filename, base64.b64decode(content), mimetype)
+    return message
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """Queues the messages in the outbox, delivery happens after the current transaction commits"""
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+
+        OutboxEmail.objects.bulk_create([OutboxEmail(message=serialize_message(message)) for message in email_messages])
+
+        # emails a broker outage keeps from being queued now go out with the deliver-outbox beat schedule
+        from .tasks import deliver_outbox, enqueue_on_commit
+        enqueue_on_commit(deliver_outbox)
+        return len(email_messages)
+
+
+class PooledConnection:
+    """
+    One delivery backend connection kept open between tasks of a worker. An smtp
+    connection is checked with NOOP before reuse and reopened when the server dropped it.
+    """
+
+    def __init__(self):
+        self._connection = None
+
+    def get(self):
+        if self._connection is None:
+            self._connection = get_connection(get_outbox_settings()["DELIVERY_BACKEND"])
+
+        smtp = getattr(self._connection, "connection", None)
+        if smtp is not None:
+            try:
+                smtp.noop()
+            except Exception:
+                self.discard()
+                return self.get()
+
+        self._connection.open()
+        return self._connection
+
+    def discard(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+
+pooled_connection = PooledConnection()
+
+
+def retry_delay(attempts, options):
+    return timedelta(seconds=min(options["RETRY_BACKOFF"] * 2 ** (attempts - 1), options["MAX_RETRY_BACKOFF"]))
+
+
+def deliver_due(limit=None):
+    """
+    Delivers the due pending emails in batches, each batch locked with SKIP LOCKED so
+    concurrent workers split the outbox. Returns (sent, failed) counts.
+    """
+
+    options = get_outbox_settings()
+    sent = failed = 0
+
+    while limit is None or sent + failed < limit:
+        with transaction.atomic():
+            batch = list(
+                OutboxEmail.objects.select_for_update(skip_locked=True)
+                .filter(status=OutboxEmail.PENDING, next_attempt_at__lte=timezone.now())
+                .order_by("next_attempt_at")[:options["BATCH_SIZE"]]
+            )
+            if not batch:
+                break
+
+            batch_sent = sent
+            for email in batch:
+                email.attempts += 1
+                try:
+                    deserialize_message(email.message, pooled_connection.get()).send()
+                except Exception as error:
+                    # the connection may be unusable now, the next message gets a fresh one
+                    pooled_connection.discard()
+                    email.last_error = repr(error)
+                    if email.attempts >= options["MAX_ATTEMPTS"]:
+                        email.status = OutboxEmail.FAILED
+                        logger.error("giving up on outbox email %s: %r", email.pk, error)
+                    else:
+                        email.next_attempt_at = timezone.now() + retry_delay(email.attempts, options)
+                    failed += 1
+                else:
+                    email.status = OutboxEmail.SENT
+                    email.date_sent = timezone.now()
+                    email.last_error = ""
+                    sent += 1
+
+            OutboxEmail.objects.bulk_update(batch, ["status", "attempts", "next_attempt_at", "last_error", "date_sent"])
+
+        if sent == batch_sent:
+            # nothing went through, most likely the mail server is down: leave the rest for the next run
+            break
+
+    return sent, failed
@@ -0,0 +1,81 @@
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+class KeysetPagination(BasePagination):
+    """
+    Newest first feed paginated on (date_created, id) instead of OFFSET.
+
+    `?before=<cursor>` returns the entries older than the cursor and `?after=<cursor>` the
+    newer ones; each page only reads `limit` rows from the index whatever its depth.
+    The response's `before` cursor (null on the oldest page) and `after` cursor continue
+    from the last and first entry of the page.
+    """
+
+    ordering_field = "date_created"
+    default_limit = 10
+    max_limit = 100
+
+    def encode_cursor(self, row):
+        position = [row[self.ordering_field].isoformat(), row["id"]]
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            value, pk = parse_datetime(value), int(pk)
+        except (ValueError, TypeError, binascii.Error):
+            value = None
+        if value is None:
+            raise ValidationError(detail={"message": "invalid cursor"})
+        return value, pk
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get("limit", self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+        return max(1, min(limit, self.max_limit))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """`queryset` must be a values() queryset including the ordering field and id"""
+
+        field = self.ordering_field
+        limit = self.get_limit(request)
+        self.after = request.query_params.get("after")
+        before = request.query_params.get("before")
+
+        if self.after:
+            value, pk = self.decode_cursor(self.after)
+            # the redundant bound on the field alone is what limits the index range scan
+            newer = Q(**{f"{field}__gte": value}) & (Q(**{f"{field}__gt": value}) | Q(**{field: value, "id__gt": pk}))
+            rows = list(queryset.filter(newer).order_by(field, "id")[:limit])[::-1]
+            # we came from the older entries
+            self.has_older = bool(rows)
+        else:
+            if before:
+                value, pk = self.decode_cursor(before)
+                older = Q(**{f"{field}__lte": value}) & (Q(**{f"{field}__lt": value}) | Q(**{field: value, "id__lt": pk}))
+                queryset = queryset.filter(older)
+            rows = list(queryset.order_by(f"-{field}", "-id")[:limit + 1])
+            self.has_older = len(rows) > limit
+            rows = rows[:limit]
+
+        self.rows = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        rows = self.rows
+        return Response({
+            "results": data,
+            "before": self.encode_cursor(rows[-1]) if self.has_older else None,
+            # always set so clients can poll for newer entries
+            "after": self.encode_cursor(rows[0]) if rows else self.after,
+        })
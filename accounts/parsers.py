@@ -0,0 +1,40 @@
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import MultiPartParser
+
+from .images import get_image_settings
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """Spools each uploaded file to a temporary file, refusing the upload once a file passes `max_size` bytes"""
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = max_size
+        self.exceeded = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.max_size is not None and start + len(raw_data) > self.max_size:
+            self.exceeded = True
+            self.file.close()
+            raise StopUpload(connection_reset=True)
+        return super().receive_data_chunk(raw_data, start)
+
+
+class ImageMultiPartParser(MultiPartParser):
+    """
+    Multipart parser for image uploads: files go to disk chunk by chunk instead of memory
+    (django keeps uploads under FILE_UPLOAD_MAX_MEMORY_SIZE in memory) and uploads over
+    PROFILE_IMAGES["MAX_UPLOAD_SIZE"] are cut off while they are read.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context["request"]
+        max_size = get_image_settings()["MAX_UPLOAD_SIZE"]
+        handler = LimitedTemporaryFileUploadHandler(request._request, max_size)
+        request.upload_handlers = [handler]
+
+        data_and_files = super().parse(stream, media_type, parser_context)
+        if handler.exceeded:
+            raise ParseError(f"Images are limited to {max_size // (1024 * 1024)}MB")
+        return data_and_files
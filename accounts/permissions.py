@@ -3,14 +3,43 @@ from rest_framework.permissions import BasePermission, SAFE_METHODS
 from rest_framework import exceptions
 from django.contrib.auth import get_user_model
 
+from .claims import token_has_perms
+
 
 
 User = get_user_model()
 
+
+def has_perms(request, perms):
+    """Checks perms against the access token claims when present, otherwise against the user's (cached) permissions"""
+    
+    if request.user.is_active and request.user.is_superuser:
+        return True
+    
+    granted = token_has_perms(request.auth, perms)
+    if granted is None:
+        return request.user.has_perms(perms)
+    
+    return granted
+
+
 class CustomDjangoModelPermissions(DjangoModelPermissions):
     def __init__(self):
         self.perms_map['GET'] = ['%(app_label)s.view_%(model_name)s']
         
+    
+    def has_permission(self, request, view):
+        if not request.user or (
+           not request.user.is_authenticated and self.authenticated_users_only):
+            return False
+
+        if getattr(view, '_ignore_model_permissions', False):
+            return True
+
+        queryset = self._queryset(view)
+        perms = self.get_required_permissions(request.method, queryset.model)
+
+        return has_perms(request, perms)
         
 
         
@@ -63,7 +92,7 @@ class CustomBasePermissions(BasePermission):
 
         perms = self.get_required_permissions(request.method, self.model)
 
-        return request.user.has_perms(perms)
+        return has_perms(request, perms)
     
     
 class UserTablePermissions(CustomBasePermissions):
@@ -78,7 +107,7 @@ class DashboardPermission(BasePermission):
     
     def has_permission(self, request, view):
         return bool(
-            request.user.is_authenticated and request.user.has_perm("accounts.view_dashboard") 
+            request.user.is_authenticated and has_perms(request, ["accounts.view_dashboard"])
         )
         
 
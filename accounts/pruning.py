@@ -0,0 +1,117 @@
+"""
+Housekeeping of tables that only ever grow.
+
+Deletes and updates run in keyset batches (accounts/helpers/batching.py), each
+batch in its own short transaction, so locks are held for one batch at a time.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+from .helpers.batching import keyset_batches
+from .models import ActivationOtp, OutboxEmail
+
+
+logger = logging.getLogger(__name__)
+
+
+def payload_bytes(queryset, *fields):
+    """Approximate stored size of the given text fields, before row and index overhead"""
+
+    sizes = queryset.aggregate(**{field: Sum(Length(field)) for field in fields})
+    return sum(size or 0 for size in sizes.values())
+
+
+def prune_expired_tokens(batch_size=1000, pause=0, now=None):
+    """
+    Deletes OutstandingToken rows (and their BlacklistedToken) whose token has expired,
+    an expired token is refused by its signature check before the blacklist is consulted.
+
+    Returns (rows, bytes) reclaimed.
+    """
+
+    expired = OutstandingToken.objects.filter(expires_at__lt=now or timezone.now())
+    rows = reclaimed = 0
+
+    for ids in keyset_batches(expired, batch_size):
+        with transaction.atomic():
+            batch = OutstandingToken.objects.filter(id__in=ids)
+            reclaimed += payload_bytes(batch, "jti", "token")
+            _, deleted = batch.delete()
+        rows += sum(deleted.values())
+        logger.debug("pruned %s expired tokens", len(ids))
+        if pause:
+            time.sleep(pause)
+
+    return rows, reclaimed
+
+
+def compact_tokens(batch_size=1000, pause=0):
+    """
+    Blanks the stored token text of OutstandingToken rows, jti/exp/user are all
+    revocation needs. Returns (rows, bytes) reclaimed.
+    """
+
+    stored = OutstandingToken.objects.exclude(token="")
+    rows = reclaimed = 0
+
+    for ids in keyset_batches(stored, batch_size):
+        with transaction.atomic():
+            batch = OutstandingToken.objects.filter(id__in=ids)
+            reclaimed += payload_bytes(batch, "token")
+            rows += batch.update(token="")
+        if pause:
+            time.sleep(pause)
+
+    return rows, reclaimed
+
+
+def prune_expired_otps(batch_size=1000, pause=0, now=None):
+    """Deletes the ActivationOtp rows past their expiry_date, returns the number deleted"""
+
+    expired = ActivationOtp.objects.filter(expiry_date__lte=now or timezone.now())
+    rows = 0
+
+    for ids in keyset_batches(expired, batch_size):
+        rows += ActivationOtp.objects.filter(id__in=ids).delete()[0]
+        if pause:
+            time.sleep(pause)
+
+    return rows
+
+
+def cap_live_otps(max_per_user, now=None):
+    """
+    Keeps only the `max_per_user` newest unexpired codes of each user, resends
+    otherwise pile up codes that can all still be used. Returns the number deleted.
+    """
+
+    live = ActivationOtp.objects.filter(expiry_date__gt=now or timezone.now())
+    crowded = live.values("user_id").annotate(codes=Count("id")).filter(codes__gt=max_per_user)
+    rows = 0
+
+    for entry in crowded.iterator():
+        stale = list(
+            live.filter(user_id=entry["user_id"]).order_by("-expiry_date", "-id").values_list("id", flat=True)[max_per_user:]
+        )
+        rows += ActivationOtp.objects.filter(id__in=stale).delete()[0]
+
+    return rows
+
+
+def prune_sent_emails(days, batch_size=1000):
+    """Deletes the delivered outbox emails older than `days`, returns the number deleted"""
+
+    delivered = OutboxEmail.objects.filter(status=OutboxEmail.SENT, date_sent__lt=timezone.now() - timedelta(days=days))
+    rows = 0
+
+    for ids in keyset_batches(delivered, batch_size):
+        rows += OutboxEmail.objects.filter(id__in=ids).delete()[0]
+
+    return rows
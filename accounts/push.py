@@ -0,0 +1,162 @@
+"""
+Push notifications.
+
+PushService streams the registered device tokens of the recipients, sends them in
+multicast batches of up to 500 tokens (the FCM limit) with several batches in flight
+at once, and removes the devices whose token the transport reports as dead so later
+fan-outs skip them. Tokens come from the device registry (accounts/devices.py).
+
+The transport is pluggable (PUSH_NOTIFICATIONS["TRANSPORT"]): FirebasePushTransport talks
+to FCM through firebase_admin, StubPushTransport records the calls for tests and benchmarks.
+"""
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .clients import get_client
+from .devices import hash_token, remove_devices
+from .models import DeviceToken
+
+
+logger = logging.getLogger(__name__)
+
+PushResult = namedtuple("PushResult", ["sent", "failed", "pruned"])
+
+DEAD = "dead"
+FAILED = "failed"
+
+
+class BasePushTransport(ABC):
+
+    max_batch_size = 500
+
+    @abstractmethod
+    def send_multicast(self, tokens, title, body, data=None):
+        """Sends one message to every token, returns {token: DEAD | FAILED} for the tokens it could not reach"""
+
+
+class FirebasePushTransport(BasePushTransport):
+
+    def __init__(self, app=None, dry_run=False, **kwargs):
+        # None for the process' firebase app from accounts/clients.py
+        self.app = app
+        self.dry_run = dry_run
+
+    def send_multicast(self, tokens, title, body, data=None):
+        from firebase_admin import exceptions, messaging
+
+        message = messaging.MulticastMessage(
+            tokens=list(tokens),
+            notification=messaging.Notification(title=title, body=body),
+            data={key: str(value) for key, value in (data or {}).items()},
+        )
+        response = messaging.send_multicast(message, dry_run=self.dry_run, app=self.app or get_client("firebase"))
+
+        errors = {}
+        for token, result in zip(tokens, response.responses):
+            if result.success:
+                continue
+            error = result.exception
+            dead = isinstance(error, (messaging.UnregisteredError, messaging.SenderIdMismatchError)) or (
+                isinstance(error, exceptions.InvalidArgumentError) and "registration token" in str(error)
+            )
+            errors[token] = DEAD if dead else FAILED
+        return errors
+
+
+class StubPushTransport(BasePushTransport):
+    """Records the batches instead of sending them, tokens starting with `dead_prefix` are reported unregistered"""
+
+    def __init__(self, dead_prefix="dead-", **kwargs):
+        self.dead_prefix = dead_prefix
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def send_multicast(self, tokens, title, body, data=None):
+        with self._lock:
+            self.batches.append({"tokens": list(tokens), "title": title, "body": body, "data": data})
+        return {token: DEAD for token in tokens if token.startswith(self.dead_prefix)}
+
+
+class PushService:
+
+    def __init__(self, transport, batch_size=500, concurrency=8):
+        self.transport = transport
+        self.batch_size = min(batch_size, transport.max_batch_size)
+        self.concurrency = concurrency
+
+    @classmethod
+    def from_settings(cls, setting_name):
+        options = getattr(settings, setting_name, {})
+        transport = import_string(options.get("TRANSPORT", "accounts.push.FirebasePushTransport"))(**options.get("OPTIONS", {}))
+        return cls(transport, batch_size=options.get("BATCH_SIZE", 500), concurrency=options.get("CONCURRENCY", 8))
+
+    def device_tokens(self, users):
+        """Yields the (user id, token) of every registered device of the users (a User queryset)"""
+
+        tokens = DeviceToken.objects.filter(user__in=users.values("pk")).values_list("user_id", "token")
+        yield from tokens.iterator(chunk_size=self.batch_size * 4)
+
+    def batches(self, pairs):
+        batch = []
+        for pair in pairs:
+            batch.append(pair)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def send(self, batch, title, body, data):
+        owners = {token: user_id for user_id, token in batch}
+        try:
+            errors = self.transport.send_multicast(list(owners), title, body, data)
+        except Exception:
+            logger.exception("push batch of %s tokens failed", len(owners))
+            errors = dict.fromkeys(owners, FAILED)
+        return owners, errors
+
+    def send_to_users(self, users, title, body, data=None):
+        """Pushes one notification to every registered device of `users`, returns a PushResult"""
+
+        sent = failed = 0
+        dead = set()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="push") as executor:
+            in_flight = set()
+
+            def collect(done):
+                nonlocal sent, failed
+                for future in done:
+                    owners, errors = future.result()
+                    sent += len(owners) - len(errors)
+                    failed += len(errors)
+                    dead.update(token for token, kind in errors.items() if kind == DEAD)
+
+            for batch in self.batches(self.device_tokens(users)):
+                # keep at most `concurrency` batches queued so tokens are read as fast as they are sent
+                if len(in_flight) >= self.concurrency:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                in_flight.add(executor.submit(self.send, batch, title, body, data))
+
+            collect(wait(in_flight).done)
+
+        pruned = self.prune(dead)
+        logger.info("push sent to %s devices, %s failed, %s dead tokens cleared", sent, failed, pruned)
+        return PushResult(sent, failed, pruned)
+
+    def prune(self, dead):
+        """Removes the devices of the dead tokens"""
+
+        if not dead:
+            return 0
+        return remove_devices(hash_token(token) for token in dead)
+
+
+push_service = PushService.from_settings("PUSH_NOTIFICATIONS")
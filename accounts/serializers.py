@@ -1,16 +1,22 @@
-from djoser.serializers import UserCreateSerializer as BaseUserRegistrationSerializer
+from djoser.serializers import UserCreateSerializer as BaseUserRegistrationSerializer, UserCreatePasswordRetypeSerializer
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 from djoser.signals import user_activated
-from django.utils import timezone
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
+from django.db import transaction
 
-from .models import ActivationOtp, ModuleAccess, StoreBankDetail, StoreProfile
-from .signals import generate_otp, site_name
+from .models import DeviceToken, ModuleAccess, StoreBankDetail, StoreProfile
+from .signals import send_activation_email, site_name
 from rest_framework.exceptions import ValidationError
 from django.contrib.auth.models import Permission, Group
+from django.db.models import Prefetch
 from drf_extra_fields.fields import Base64ImageField
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from .tokens import RefreshToken
+from .otp import otp_store
+from .emails import NEW_OTP_EMAIL
+from .images import inspect_image
+from .uploads import CONTENT_TYPES
 
 from config import settings
  
@@ -18,11 +24,37 @@ User = get_user_model()
 
         
 
-class UserRegistrationSerializer(BaseUserRegistrationSerializer):
+class RegistrationMixin:
+    """
+    Creates the user, inactive for the "user" role, and its activation otp in one
+    transaction. The activation email is sent once it commits.
+    """
+    
+    def perform_create(self, validated_data):
+        needs_activation = validated_data.get("role") == "user"
+        if needs_activation:
+            validated_data["is_active"] = False
+        
+        with transaction.atomic():
+            user = User.objects.create_user(**validated_data)
+            if needs_activation:
+                code = otp_store.issue(user)
+                transaction.on_commit(lambda: send_activation_email(user, code))
+        
+        # tells the activate_otp receiver there is nothing left to do
+        user.activation_otp_issued = needs_activation
+        return user
+
+
+class UserRegistrationSerializer(RegistrationMixin, BaseUserRegistrationSerializer):
     
     class Meta(BaseUserRegistrationSerializer.Meta):
         fields = ['id',"first_name", "last_name", "email", "role","phone", "password", "is_active"]
         
+
+class UserRegistrationRetypeSerializer(RegistrationMixin, UserCreatePasswordRetypeSerializer):
+    """Used for registration since USER_CREATE_PASSWORD_RETYPE is on, keeps djoser's fields"""
+        
     
 class UserDeleteSerializer(serializers.Serializer):
     current_password = serializers.CharField(style={"input_type": "password"})
@@ -30,16 +62,32 @@ class UserDeleteSerializer(serializers.Serializer):
 class CustomUserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(style={"input_type": "password"}, write_only=True, required=False)
     image_url = serializers.ReadOnlyField()
+    image_variants = serializers.ReadOnlyField()
+    roles = serializers.SerializerMethodField()
     
     class Meta():
         model = User
-        fields = ['id',"first_name", "last_name", "email", "phone", "password", "is_active", "role", "groups", "user_permissions", "roles", "is_superuser", "image_url", "date_joined"]
+        fields = ['id',"first_name", "last_name", "email", "phone", "password", "is_active", "role", "groups",
+                  "user_permissions", "roles", "is_superuser", "image_url", "image_variants", "date_joined"]
 
         extra_kwargs = {
             'password': {'write_only': True}
         }
         
     
+    @staticmethod
+    def prefetch(queryset):
+        """
+        Prefetches the roles, their permissions and modules and the user permissions of a
+        user queryset, so a page of users is serialized in the same few queries whatever its size
+        """
+        
+        return queryset.prefetch_related(
+            Prefetch("groups", queryset=GroupSerializer.prefetch(Group.objects.all())),
+            "user_permissions",
+        )
+    
+    
     def get_roles(self, admin):
         return GroupSerializer(admin.groups.all(), many=True).data
 
@@ -50,46 +98,61 @@ class LoginSerializer(serializers.Serializer):
     
 class FirebaseSerializer(serializers.Serializer):
     fcm_token = serializers.CharField(max_length=5000)
+    platform = serializers.ChoiceField(choices=DeviceToken.PLATFORM_CHOICES, default=DeviceToken.ANDROID)
 
 
 class LogoutSerializer(serializers.Serializer):
-    refresh_token = serializers.CharField(max_length=700) 
+    refresh_token = serializers.CharField(max_length=700)
+
+
+class TokenRefreshSerializer(serializers.Serializer):
+    refresh = serializers.CharField()
+    access = serializers.ReadOnlyField()
+
+
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+
+        try:
+            data = {'access': str(refresh.access_token)}
+        except User.DoesNotExist:
+            # compiling the claims loads the user, which may have been deleted since
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        if jwt_settings.ROTATE_REFRESH_TOKENS:
+            if jwt_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+
+            refresh.set_jti()
+            refresh.set_exp()
+
+            data['refresh'] = str(refresh)
+
+        return data
     
 
 class OTPVerifySerializer(serializers.Serializer):
+    email = serializers.EmailField()
     otp = serializers.CharField(max_length=6)
     
     
     def verify_otp(self, request):
-        otp = self.validated_data['otp']
-        
-        if ActivationOtp.objects.filter(code=otp).exists():
-            try:
-                otp = ActivationOtp.objects.get(code=otp)
-            except Exception:
-                ActivationOtp.objects.filter(code=otp).delete()
-                raise serializers.ValidationError(detail='Cannot verify otp. Please try later')
-            
-            if otp.is_valid():
-                if otp.user.is_active == False:
-                    otp.user.is_active=True
-                    otp.user.save()
-                    
-                    #clear all otp for this user after verification
-                    all_otps = ActivationOtp.objects.filter(user=otp.user)
-                    all_otps.delete()
-                    user_activated.send(User, user=otp.user, request=request)
-                    return {'message': 'Verification Complete'}
-                else:
-                    raise serializers.ValidationError(detail='User with this otp has been verified before.')
-            
-                
-            else:
-                raise serializers.ValidationError(detail='OTP expired')
-                    
-        
-        else:
-            raise serializers.ValidationError(detail='Invalid OTP')
+        user = User.objects.filter(email=self.validated_data['email']).first()
+        
+        if user is not None and user.is_active:
+            # checked first, an active user's pending code is left alone
+            raise serializers.ValidationError(detail='User with this otp has been verified before.')
+        
+        if user is None or not otp_store.consume(user, self.validated_data['otp']):
+            raise serializers.ValidationError(detail='Invalid or expired OTP')
+        
+        user.is_active = True
+        user.save()
+        
+        #clear all otp for this user after verification
+        otp_store.discard(user)
+        user_activated.send(User, user=user, request=request)
+        return {'message': 'Verification Complete'}
     
 
 class NewOtpSerializer(serializers.Serializer):
@@ -102,32 +165,15 @@ class NewOtpSerializer(serializers.Serializer):
         except User.DoesNotExist:
             raise serializers.ValidationError(detail='Please confirm that the email is correct and has not been verified')
         
-        code = generate_otp(6)
-        expiry_date = timezone.now() + timezone.timedelta(minutes=10)
-        
-        ActivationOtp.objects.create(code=code, user=user, expiry_date=expiry_date)
-        subject = f"NEW OTP FOR {site_name}"
-        
-        message = f"""Hi, {str(user.first_name).title()}.
-
-    Complete your verification on {site_name} with the OTP below:
-
-                    {code}        
-
-    Expires in 5 minutes!
-
-    Thank you,
-    Desmond                
-    """
-        msg_html = render_to_string('email/new_otp.html', {
-                        'first_name': str(user.first_name).title(),
-                        'code':code,
-                        'MARKET_PLACE_URL':settings.Common.MARKETPLACE_URL,
-                        })
+        code = otp_store.issue(user)
         
-        email_from = settings.Common.DEFAULT_FROM_EMAIL
-        recipient_list = [user.email]
-        send_mail( subject, message, email_from, recipient_list, html_message=msg_html)
+        NEW_OTP_EMAIL.send([user.email], {
+            'first_name': str(user.first_name).title(),
+            'code': code,
+            'site_name': site_name,
+            'expires_in': otp_store.ttl // 60,
+            'MARKET_PLACE_URL': getattr(settings.Common, 'MARKETPLACE_URL', ''),
+        }, from_email=settings.Common.DEFAULT_FROM_EMAIL)
         
         return {'message': 'Please check your email for OTP.'}
     
@@ -155,11 +201,18 @@ class GroupSerializer(serializers.ModelSerializer):
         model = Group
         
         
+    @staticmethod
+    def prefetch(queryset):
+        """Prefetches what the serializer reads of each role, see CustomUserSerializer.prefetch"""
+        
+        return queryset.prefetch_related("permissions", "module_access")
+    
+        
     def get_module_access_data(self, obj):
-        return ModuleAccessSerializer(obj.module_access, many=True).data
+        return ModuleAccessSerializer(obj.module_access.all(), many=True).data
     
     def get_permissions_data(self, obj):
-        return PermissionSerializer(obj.permissions, many=True).data
+        return PermissionSerializer(obj.permissions.all(), many=True).data
         
         
     
@@ -184,4 +237,25 @@ class AssignRoleSerializer(serializers.Serializer):
     
     
 class ImageUploadSerializer(serializers.Serializer):
-    image = Base64ImageField()
\ No newline at end of file
+    image = Base64ImageField()
+
+
+class ImageStreamUploadSerializer(serializers.Serializer):
+    # a plain file field, the full image is only decoded by the worker
+    image = serializers.FileField()
+    
+    
+    def validate_image(self, image):
+        try:
+            inspect_image(image)
+        except ValueError as error:
+            raise ValidationError(str(error))
+        return image
+
+
+class UploadTicketSerializer(serializers.Serializer):
+    content_type = serializers.ChoiceField(choices=list(CONTENT_TYPES))
+
+
+class UploadCompleteSerializer(serializers.Serializer):
+    ticket = serializers.CharField()
\ No newline at end of file
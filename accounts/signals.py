@@ -1,15 +1,23 @@
 import random
 from django.dispatch import receiver
 from django.core.mail import send_mail
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete, m2m_changed, post_migrate
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.contrib.auth.models import Group, Permission
+from django.contrib.auth.signals import user_logged_in
 from config import settings
 from djoser.signals import user_registered, user_activated
 
-from .models import ActivationOtp, TempStorage
+from .models import ModuleAccess, TempStorage
+from .authentication import principal_cache
+from .backends import permission_cache
+from .claims import catalogue_cache
+from .writebehind import last_login_buffer
+from .otp import otp_store
+from .images import release_image
+from .emails import ACTIVATION_EMAIL, CONFIRMATION_EMAIL
 from django.utils import timezone
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
 import json
 import os
 import  requests
@@ -49,44 +57,142 @@ Regards,
         
         
         return
-    
-    
 
-            
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_principal(sender, instance, **kwargs):
+    """Drops the cached user served to the jwt authentication. Soft deletes land here too since `User.delete` saves."""
+
+    # after the commit, or another worker could cache the old row again in the meantime
+    user_id = str(instance.pk)
+    transaction.on_commit(lambda: principal_cache.delete(user_id))
+
+
+@receiver(post_delete, sender=User)
+def release_user_image(sender, instance, **kwargs):
+    """A permanently deleted user drops its reference to its stored image"""
+
+    release_image(instance.image.name)
+
+
+# Every invalidation below runs once the change is committed: another worker reading the
+# new version before that would cache the old permissions under it until the ttl.
+
+@receiver(post_save, sender=User)
+def invalidate_changed_user_permissions(sender, instance, created, update_fields, **kwargs):
+    """A superuser demoted, or a user deactivated, loses its cached permissions and its token claims"""
+
+    if created:
+        return
+
+    if update_fields is not None and not set(update_fields) & set(User.PERMISSION_FIELDS):
+        return
+
+    if not instance.permission_fields_changed():
+        return
+
+    instance._loaded_permission_fields = instance.permission_fields()
+    user_id = instance.pk
+    transaction.on_commit(lambda: permission_cache.invalidate_user(user_id))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    """Drops the cached permissions of the users whose groups or direct permissions changed"""
+
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if action != "post_clear" and not pk_set:
+        # e.g. assign_role re-adding roles the user already has
+        return
+
+    if not reverse:
+        user_ids = [instance.pk]
+
+    elif pk_set:
+        user_ids = list(pk_set)
+
+    else:
+        # a group or permission was cleared of all its users, we can't tell which ones
+        transaction.on_commit(permission_cache.bump_epoch)
+        return
+
+    def invalidate():
+        for user_id in user_ids:
+            permission_cache.invalidate_user(user_id)
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(m2m_changed, sender=Group.module_access.through)
+def invalidate_role_permissions(sender, action, pk_set, **kwargs):
+    """A role's permissions or modules changed, every cached permission set and token claim may be stale"""
+
+    if action == "post_clear" or (action in ("post_add", "post_remove") and pk_set):
+        transaction.on_commit(permission_cache.bump_epoch)
+
+
+@receiver(post_delete, sender=Group)
+def invalidate_deleted_role(sender, **kwargs):
+    """Deleting a role (GroupDetail) removes its permissions from its users without m2m_changed"""
+
+    transaction.on_commit(permission_cache.bump_epoch)
+
+
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+@receiver(post_save, sender=ModuleAccess)
+@receiver(post_delete, sender=ModuleAccess)
+def invalidate_claim_catalogues(sender, **kwargs):
+    """Permissions and modules added by migrations or the admin show up in newly compiled token claims"""
+
+    catalogue_cache.delete("permissions" if sender is Permission else "modules")
+
+
+@receiver(post_migrate)
+def invalidate_permission_catalogue(sender, **kwargs):
+    """Permissions created by migrate are bulk inserted without post_save"""
+
+    catalogue_cache.delete("permissions")
+
+
+# django's update_last_login saves the user (one UPDATE and the post_save receivers) on every login
+user_logged_in.disconnect(dispatch_uid="update_last_login")
+
+
+@receiver(user_logged_in)
+def buffer_last_login(sender, user, **kwargs):
+    """Records the login in the write-behind buffer, flushed in bulk without model signals"""
+
+    user.last_login = timezone.now()
+    last_login_buffer.record(user.pk, user.last_login)
+
+
+
+def send_activation_email(user, code):
+    ACTIVATION_EMAIL.send([user.email], {
+        'first_name': str(user.first_name),
+        'code': code,
+        'site_name': site_name,
+        'expires_in': otp_store.ttl // 60,
+    }, from_email=settings.Common.DEFAULT_FROM_EMAIL)
+
+
 @receiver(user_registered)
 def activate_otp(user, request, *args,**kwargs):
     
-    if user.role == "user":
-        user.is_active = False
-        user.save()
-        
-        code = generate_otp(6)
-        expiry_date = timezone.now() + timezone.timedelta(minutes=10)
-        ActivationOtp.objects.create(code=code, expiry_date=expiry_date, user=user)
+    # UserRegistrationSerializer already created the user inactive with its otp
+    if user.role == "user" and not getattr(user, "activation_otp_issued", False):
+        with transaction.atomic():
+            user.is_active = False
+            user.save(update_fields=["is_active"])
+            code = otp_store.issue(user)
         
-        
-        subject = f"ACCOUNT VERIFICATION FOR {site_name}".upper()
-            
-        message = f"""Hi, {str(user.first_name).title()}.
-    Thank you for signing up!
-    Complete your verification on the {site_name} with the OTP below:
-
-                    {code}        
-
-    Expires in 5 minutes!
-
-    Cheers,
-    {site_name} Team            
-    """   
-        msg_html = render_to_string('email/activation.html', {
-                        'first_name': str(user.first_name),
-                        'code':code,
-                        'site_name':site_name,
-                        })
-        
-        email_from = settings.Common.DEFAULT_FROM_EMAIL
-        recipient_list = [user.email]
-        send_mail( subject, message, email_from, recipient_list, html_message=msg_html)
+        transaction.on_commit(lambda: send_activation_email(user, code))
         
         return
 
@@ -97,22 +203,10 @@ def activate_otp(user, request, *args,**kwargs):
 def comfirmaion_email(user, request, *args,**kwargs):
     
     if user.role == "user":
-        subject = "VERIFICATION COMPLETE"
-            
-        message = f"""Hi, {str(user.first_name).title()}.
-    Your account has been activated and is ready to use!
-
-    Cheers,
-    {site_name} Team            
-    """   
-        msg_html = render_to_string('email/confirmation.html', {
-                        'first_name': str(user.first_name).title(),
-                        'site_name':site_name,
-                        })
-        
-        email_from = settings.Common.DEFAULT_FROM_EMAIL
-        recipient_list = [user.email]
-        send_mail( subject, message, email_from, recipient_list, html_message=msg_html)
+        CONFIRMATION_EMAIL.send([user.email], {
+            'first_name': str(user.first_name).title(),
+            'site_name': site_name,
+        }, from_email=settings.Common.DEFAULT_FROM_EMAIL)
                 
 
         return
@@ -0,0 +1,19 @@
+"""
+Storage backends.
+"""
+from storages.backends.azure_storage import AzureStorage as BaseAzureStorage
+
+from .images import get_image_settings
+
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class AzureStorage(BaseAzureStorage):
+    """AzureStorage uploading the profile images, whose names change with their content, with a cache-forever Cache-Control"""
+
+    def get_object_parameters(self, name):
+        parameters = super().get_object_parameters(name)
+        if name.startswith(get_image_settings()["UPLOAD_TO"] + "/"):
+            parameters["cache_control"] = IMMUTABLE
+        return parameters
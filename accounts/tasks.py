@@ -0,0 +1,104 @@
+import logging
+
+from celery import shared_task
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from kombu.exceptions import OperationalError
+
+from . import archive, images, outbox, pruning, uploads
+from .push import push_service
+from .writebehind import device_seen_buffer, last_login_buffer
+
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_on_commit(task, *args, **kwargs):
+    """
+    Queues `task` once the current transaction commits. The request's work is committed
+    by then, so a broker that can't be reached is logged instead of failing the response.
+    """
+
+    def enqueue():
+        try:
+            task.apply_async(args, kwargs)
+        except OperationalError:
+            logger.exception("could not queue %s%r", task.name, args)
+
+    transaction.on_commit(enqueue)
+
+
+@shared_task(ignore_result=True)
+def prune_expired_tokens():
+    rows, reclaimed = pruning.prune_expired_tokens(batch_size=settings.PRUNE_BATCH_SIZE)
+    logger.info("pruned %s expired token rows, %s bytes", rows, reclaimed)
+    return rows, reclaimed
+
+
+@shared_task(ignore_result=True)
+def sweep_activation_otps():
+    expired = pruning.prune_expired_otps(batch_size=settings.PRUNE_BATCH_SIZE)
+    capped = pruning.cap_live_otps(settings.ACTIVATION_OTP["MAX_LIVE_PER_USER"])
+    logger.info("deleted %s expired and %s surplus activation otps", expired, capped)
+    return expired, capped
+
+
+@shared_task(ignore_result=True)
+def archive_activity_logs():
+    segments, rows = archive.archive_activity_logs()
+    logger.info("archived %s activity log rows in %s segments", rows, segments)
+    return segments, rows
+
+
+@shared_task(ignore_result=True)
+def deliver_outbox():
+    sent, failed = outbox.deliver_due()
+    if sent or failed:
+        logger.info("outbox delivered %s emails, %s failed", sent, failed)
+    return sent, failed
+
+
+@shared_task(ignore_result=True)
+def prune_outbox():
+    return pruning.prune_sent_emails(outbox.get_outbox_settings()["KEEP_SENT_DAYS"], settings.PRUNE_BATCH_SIZE)
+
+
+@shared_task(ignore_result=True)
+def flush_timestamp_buffers():
+    return last_login_buffer.flush() + device_seen_buffer.flush()
+
+
+@shared_task(ignore_result=True)
+def send_push_notification(title, body, data=None, user_ids=None):
+    """Pushes to the devices of the given users, or of every active user when user_ids is None"""
+
+    users = get_user_model().objects.filter(is_active=True, is_deleted=False)
+    if user_ids is not None:
+        users = users.filter(id__in=user_ids)
+    return tuple(push_service.send_to_users(users, title, body, data))
+
+
+# storage and database errors are retried with an exponential backoff, an image that
+# can't be decoded is rejected by images.process_upload without raising
+UPLOAD_RETRY_OPTIONS = {
+    "autoretry_for": (Exception,),
+    "retry_backoff": True,
+    "retry_backoff_max": 600,
+    "max_retries": 5,
+}
+
+
+@shared_task(ignore_result=True, **UPLOAD_RETRY_OPTIONS)
+def process_profile_image(user_id, staged_name, digest=None):
+    return images.process_upload(user_id, staged_name, digest)
+
+
+@shared_task(ignore_result=True, **UPLOAD_RETRY_OPTIONS)
+def process_direct_upload(user_id, name):
+    return images.process_direct_upload(user_id, name, storage=uploads.incoming_storage)
+
+
+@shared_task(ignore_result=True)
+def collect_profile_images():
+    return images.collect_orphans(), uploads.sweep_incomplete()
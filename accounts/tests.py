@@ -1,3 +1,890 @@
-from django.test import TestCase
+import asyncio
+import base64
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission
+from django.contrib.auth.signals import user_logged_in
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.mail import send_mail
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.functional import empty
+from kombu.exceptions import OperationalError as BrokerError
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from PIL import Image
+
+from . import archive, images, outbox, pruning, tasks, uploads
+from .activity import ActivityLogWriter
+from .authentication import principal_cache
+from .backends import permission_cache
+from .blacklist import CacheBlacklistStore
+from .clients import LazyClient, get_client, registered_clients
+from .claims import PERMISSIONS_CLAIM, bitset_ids, decode_bitset, permission_index
+from .devices import hash_token, register_device, register_devices
+from .hashers import HashingPool, HashingPoolFull
+from .models import ActivationOtp, ActivityLog, DeviceToken, ModuleAccess, OutboxEmail, ProfileImage, User
+from .otp import CacheOTPStore, DatabaseOTPStore, otp_store
+from .serializers import OTPVerifySerializer
+from .tokens import RefreshToken
+from .writebehind import MemoryTimestampBuffer, device_seen_buffer, last_login_buffer
+
+
+def create_user(n, **extra_fields):
+    extra_fields.setdefault("is_active", True)
+    return User.objects.create_user(
+        email=f"user{n}@example.com", password="password", first_name="first", last_name="last",
+        phone=f"+234{n:010d}", **extra_fields,
+    )
+
+
+def client_for(user):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}")
+    return client
+
+
+def image_bytes(color, image_format="JPEG", size=(80, 60)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+class CacheTestCase(TestCase):
+    """Starts every test with empty caches, the local tiers are per process and outlive a test"""
+
+    def setUp(self):
+        cache.clear()
+        principal_cache.clear_local()
+
+
+class PrincipalCacheTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user(1)
+        self.client = client_for(self.user)
+
+    def test_saving_the_user_drops_the_cached_principal(self):
+        self.assertEqual(self.client.get("/v1/activity-logs/").status_code, 200)
+        self.assertIsNotNone(principal_cache.get(str(self.user.pk)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+
+        self.assertIsNone(principal_cache.get(str(self.user.pk)))
+        self.assertEqual(self.client.get("/v1/activity-logs/").status_code, 401)
+
+    def test_the_principal_is_dropped_only_once_the_save_commits(self):
+        self.client.get("/v1/activity-logs/")
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.save()
+            self.assertIsNotNone(principal_cache.get(str(self.user.pk)))
+
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(principal_cache.get(str(self.user.pk)))
+
+
+class PermissionCacheTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user(1)
+        self.group = Group.objects.create(name="editors")
+        self.permission = Permission.objects.get(codename="view_moduleaccess")
+        self.perm_name = "accounts.view_moduleaccess"
+
+    def reload(self):
+        # a new instance, the backend memoizes permissions on the user object
+        return User.objects.get(pk=self.user.pk)
+
+    def test_joining_a_group_bumps_the_user_version_after_commit(self):
+        before = permission_cache.version_for(self.user.pk)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.groups.add(self.group)
+            self.assertEqual(permission_cache.version_for(self.user.pk), before)
+
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(permission_cache.version_for(self.user.pk), before)
+
+    def test_group_permission_changes_reach_cached_users(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group)
+        self.assertFalse(self.reload().has_perm(self.perm_name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.permissions.add(self.permission)
+        self.assertTrue(self.reload().has_perm(self.perm_name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.delete()
+        self.assertFalse(self.reload().has_perm(self.perm_name))
+
+    def test_demoting_a_superuser_drops_its_cached_permissions(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk=self.user.pk).update(is_superuser=True)
+        # a superuser is granted every permission, cached like any other set
+        self.assertIn(self.perm_name, self.reload().get_all_permissions())
+
+        user = self.reload()
+        user.is_superuser = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+
+        self.assertFalse(self.reload().has_perm(self.perm_name))
+
+    def test_saving_other_fields_keeps_the_user_version(self):
+        before = permission_cache.version_for(self.user.pk)
+
+        user = self.reload()
+        user.first_name = "changed"
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+            user.save(update_fields=["first_name"])
+
+        self.assertEqual(permission_cache.version_for(self.user.pk), before)
+
+    def test_saving_a_group_leaves_the_epoch_alone(self):
+        before = permission_cache.version_for(self.user.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.name = "writers"
+            self.group.save()
+            Group.objects.create(name="readers")
+
+        self.assertEqual(permission_cache.version_for(self.user.pk), before)
+
+
+@override_settings(TOKEN_PERMISSION_CLAIMS=True)
+class PermissionClaimsTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user(1, is_superuser=True)
+        self.refresh = RefreshToken.for_user(self.user)
+
+    def claimed_permissions(self, access):
+        names = {pk: name for name, pk in permission_index().items()}
+        return {names[pk] for pk in bitset_ids(decode_bitset(access[PERMISSIONS_CLAIM]))}
+
+    def test_a_demoted_superuser_refreshes_into_claims_without_its_permissions(self):
+        access = self.refresh.access_token
+        self.assertIn("accounts.view_moduleaccess", self.claimed_permissions(access))
+
+        self.user.is_superuser = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        self.assertEqual(client.get("/v1/activity-logs/").status_code, 401)
+        self.assertEqual(self.claimed_permissions(RefreshToken(str(self.refresh)).access_token), set())
+
+
+class AsyncLoginTests(TransactionTestCase):
+    """The password check runs on another thread, which only sees committed users"""
+
+    def setUp(self):
+        cache.clear()
+        principal_cache.clear_local()
+        self.user = create_user(1)
+        # logins buffer last_login for a flush that would outlive the test database
+        self.addCleanup(last_login_buffer.drain)
+
+    def login(self, password="password"):
+        credentials = {"email": self.user.email, "password": password}
+        return self.async_client.post("/v1/auth/login/async/", credentials, content_type="application/json")
+
+    async def test_a_login_returns_the_tokens(self):
+        response = await self.login()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["email"], self.user.email)
+        self.assertIn("refresh", response.json()["data"])
+
+    async def test_wrong_passwords_and_inactive_users_are_refused(self):
+        self.assertEqual((await self.login("wrong")).status_code, 401)
+
+        await User.objects.filter(pk=self.user.pk).aupdate(is_active=False)
+        self.assertEqual((await self.login()).status_code, 403)
+
+    async def test_a_full_hashing_pool_refuses_the_login(self):
+        pool = HashingPool(workers=1, queue_limit=0)
+        release = threading.Event()
+        busy = asyncio.ensure_future(pool.run(release.wait))
+        await asyncio.sleep(0)
+
+        try:
+            with self.assertRaises(HashingPoolFull):
+                await pool.run(lambda: None)
+            with mock.patch("accounts.async_views.login_pool", pool):
+                self.assertEqual((await self.login()).status_code, 503)
+        finally:
+            release.set()
+            await busy
+
+
+class TokenBlacklistTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user(1)
+        self.refresh = str(RefreshToken.for_user(self.user))
+
+    def refresh_status(self):
+        return APIClient().post("/v1/auth/token/refresh/", {"refresh": self.refresh}, format="json").status_code
+
+    def test_a_logged_out_refresh_token_is_refused(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client_for(self.user).post("/v1/auth/logout/", {"refresh_token": self.refresh}, format="json")
+        self.assertEqual(response.status_code, 204)
+
+        self.assertEqual(self.refresh_status(), 401)
+
+    def test_revocations_outlive_a_local_cache(self):
+        # a locmem store misses what other workers revoked, the log is read instead
+        with self.captureOnCommitCallbacks(execute=True):
+            client_for(self.user).post("/v1/auth/logout/", {"refresh_token": self.refresh}, format="json")
+        cache.clear()
+
+        self.assertEqual(self.refresh_status(), 401)
+
+    def test_a_shared_store_is_never_backed_by_sql(self):
+        with mock.patch("accounts.tokens.blacklist_store", CacheBlacklistStore(shared=True)):
+            with self.assertNumQueries(0):
+                RefreshToken(self.refresh)
+
+            RefreshToken(self.refresh).blacklist()
+            with self.assertNumQueries(0), self.assertRaises(TokenError):
+                RefreshToken(self.refresh)
+
+    def test_a_rotated_refresh_token_is_refused(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.refresh_status(), 200)
+        cache.clear()
+
+        self.assertEqual(self.refresh_status(), 401)
+
+
+class TokenPruningTests(TestCase):
+
+    def setUp(self):
+        user = create_user(1)
+        now = timezone.now()
+        self.tokens = {
+            f"{state}-{n}": OutstandingToken.objects.create(
+                user=user, jti=f"{state}-{n}", token="x" * 100, created_at=now - timedelta(days=2),
+                expires_at=now + timedelta(days=1 if state == "live" else -1),
+            )
+            for state, count in (("expired", 3), ("live", 2))
+            for n in range(count)
+        }
+        BlacklistedToken.objects.create(token=self.tokens["expired-0"])
+
+    def test_expired_tokens_are_pruned_with_their_blacklist_rows(self):
+        self.assertEqual(pruning.prune_expired_tokens(batch_size=2), (4, 3 * len("expired-0" + "x" * 100)))
+
+        self.assertEqual(sorted(OutstandingToken.objects.values_list("jti", flat=True)), ["live-0", "live-1"])
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+    def test_compacting_blanks_the_stored_token_text(self):
+        self.assertEqual(pruning.compact_tokens(batch_size=2), (5, 5 * 100))
+
+        self.assertEqual(set(OutstandingToken.objects.values_list("token", flat=True)), {""})
+        self.assertEqual(pruning.compact_tokens(batch_size=2), (0, 0))
+
+
+class TimestampBufferTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.users = [create_user(1), create_user(2)]
+        self.buffer = MemoryTimestampBuffer("accounts.User", "last_login", flush_interval=3600, max_pending=3)
+        self.addCleanup(self.buffer.drain)
+
+    def last_logins(self):
+        return [User.objects.get(pk=user.pk).last_login for user in self.users]
+
+    def test_the_newest_timestamps_are_written_in_one_update(self):
+        now = timezone.now()
+        self.buffer.record(self.users[0].pk, now)
+        self.buffer.record(self.users[0].pk, now - timedelta(minutes=1))
+        self.buffer.record(self.users[1].pk, now - timedelta(minutes=2))
+        self.assertEqual(self.last_logins(), [None, None])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.last_logins(), [now, now - timedelta(minutes=2)])
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_a_full_buffer_flushes_straight_away(self):
+        now = timezone.now()
+        third = create_user(3)
+        for user in (*self.users, third):
+            self.buffer.record(user.pk, now)
+
+        self.assertEqual(self.last_logins(), [now, now])
+        self.assertEqual(self.buffer.drain(), {})
+
+    def test_logins_are_buffered_without_saving_the_user(self):
+        self.addCleanup(last_login_buffer.drain)
+
+        with self.assertNumQueries(0):
+            user_logged_in.send(sender=User, request=None, user=self.users[0])
+        self.assertIn(self.users[0].pk, last_login_buffer.drain())
+
+
+@mock.patch.object(ActivityLogWriter, "_ensure_thread")
+class ActivityLogWriterTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user(1)
+        self.writer = ActivityLogWriter(max_attempts=2)
+
+    def test_entries_are_buffered_until_the_commit_and_flushed_in_bulk(self, ensure_thread):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.writer.log(self.user, "rolled back")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.writer.log(self.user, "first")
+            self.writer.log(self.user, "second")
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(ActivityLog.objects.exists())
+
+        with self.assertNumQueries(3):
+            self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual(sorted(ActivityLog.objects.values_list("action", flat=True)), ["first", "second"])
+
+    def test_entries_the_database_refuses_are_dropped_alone(self, ensure_thread):
+        taken = ActivityLog.objects.create(user=self.user, action="taken")
+        self.writer.enqueue([
+            ActivityLog(user=self.user, action="first"),
+            ActivityLog(pk=taken.pk, user=self.user, action="duplicate"),
+            ActivityLog(user=self.user, action="second"),
+        ])
+
+        with self.assertLogs("accounts.activity") as logs:
+            self.assertEqual(self.writer.flush(), 2)
+        self.assertIn("'duplicate'", logs.output[-1])
+
+        self.assertEqual(self.writer.flush(), 0)
+        self.assertEqual(ActivityLog.objects.count(), 3)
+
+    def test_an_unreachable_database_is_retried_a_bounded_number_of_times(self, ensure_thread):
+        self.writer.enqueue([ActivityLog(user=self.user, action="first")])
+
+        with mock.patch.object(ActivityLog.objects, "bulk_create", side_effect=OperationalError):
+            with self.assertLogs("accounts.activity") as logs:
+                self.assertEqual(self.writer.flush(), 0)
+                self.assertEqual(self.writer.flush(), 0)
+        self.assertIn("dropped 1 activity log entries after 2 attempts", logs.output[-1])
+
+        self.assertEqual(self.writer.flush(), 0)
+        self.assertFalse(ActivityLog.objects.exists())
+
+
+class ActivityLogPaginationTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user(1)
+        self.client = client_for(self.user)
+        now = timezone.now()
+        # pairs of entries logged at the same instant
+        ActivityLog.objects.bulk_create([
+            ActivityLog(user=self.user, action=f"action {i}", date_created=now - timedelta(minutes=i // 2))
+            for i in range(9)
+        ])
+        self.expected = list(
+            ActivityLog.objects.filter(user=self.user).order_by("-date_created", "-id").values_list("action", flat=True)
+        )
+
+    def page(self, query=""):
+        response = self.client.get(f"/v1/activity-logs/?limit=2{query}")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_older_pages_cover_every_entry_once_in_order(self):
+        seen, page = [], self.page()
+        while True:
+            seen += [entry["action"] for entry in page["results"]]
+            if page["before"] is None:
+                break
+            page = self.page(f"&before={page['before']}")
+
+        self.assertEqual(seen, self.expected)
+
+    def test_the_after_cursor_returns_the_newer_page(self):
+        first = self.page()
+        second = self.page(f"&before={first['before']}")
+
+        self.assertEqual(self.page(f"&after={second['after']}")["results"], first["results"])
+
+    def test_invalid_cursors_are_refused(self):
+        position = [timezone.now().isoformat(), "not an id"]
+        bad_id = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+        for cursor in ("garbage", bad_id):
+            self.assertEqual(self.client.get(f"/v1/activity-logs/?before={cursor}").status_code, 400)
+
+
+class OTPStoreTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user(1, is_active=False)
+
+    def assert_consumed_once(self, store):
+        code = store.issue(self.user)
+        wrong = "0" * len(code) if code != "0" * len(code) else "1" * len(code)
+
+        self.assertFalse(store.consume(self.user, wrong))
+        self.assertTrue(store.consume(self.user, code))
+        self.assertFalse(store.consume(self.user, code))
+
+    def test_database_codes_are_accepted_once(self):
+        self.assert_consumed_once(DatabaseOTPStore(ttl=600))
+
+    def test_cache_codes_are_accepted_once(self):
+        self.assert_consumed_once(CacheOTPStore(ttl=600))
+
+    def test_expired_codes_are_refused(self):
+        store = DatabaseOTPStore(ttl=-1)
+        self.assertFalse(store.consume(self.user, store.issue(self.user)))
+
+    def test_codes_of_another_user_are_refused(self):
+        store = DatabaseOTPStore(ttl=600)
+        self.assertFalse(store.consume(create_user(2, is_active=False), store.issue(self.user)))
+
+    def test_verifying_an_active_user_leaves_its_code_alone(self):
+        code = otp_store.issue(self.user)
+        User.objects.filter(pk=self.user.pk).update(is_active=True)
+
+        serializer = OTPVerifySerializer(data={"email": self.user.email, "otp": code})
+        serializer.is_valid(raise_exception=True)
+        with self.assertRaises(ValidationError):
+            serializer.verify_otp(None)
+        self.assertTrue(otp_store.consume(self.user, code))
+
+
+class OTPSweepTests(TestCase):
+
+    def setUp(self):
+        self.users = [create_user(1, is_active=False), create_user(2, is_active=False)]
+        now = timezone.now()
+        ActivationOtp.objects.bulk_create([
+            ActivationOtp(user=user, code=f"{user.pk}-{minutes}", expiry_date=now + timedelta(minutes=minutes))
+            for user in self.users
+            for minutes in (-5, 1, 2, 3)
+        ])
+
+    def codes(self, user):
+        return list(ActivationOtp.objects.filter(user=user).order_by("expiry_date").values_list("code", flat=True))
+
+    def test_expired_codes_are_deleted_in_batches(self):
+        self.assertEqual(pruning.prune_expired_otps(batch_size=1), 2)
+        self.assertEqual(self.codes(self.users[0]), [f"{self.users[0].pk}-{minutes}" for minutes in (1, 2, 3)])
+
+    def test_each_user_keeps_its_newest_live_codes(self):
+        self.assertEqual(pruning.cap_live_otps(2), 2)
+        # expired codes are left to prune_expired_otps
+        self.assertEqual(self.codes(self.users[1]), [f"{self.users[1].pk}-{minutes}" for minutes in (-5, 2, 3)])
+
+
+@override_settings(
+    EMAIL_BACKEND="accounts.outbox.OutboxEmailBackend",
+    EMAIL_OUTBOX={"DELIVERY_BACKEND": "django.core.mail.backends.locmem.EmailBackend", "MAX_ATTEMPTS": 2},
+)
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        outbox.pooled_connection.discard()
+        self.addCleanup(outbox.pooled_connection.discard)
+
+    def send(self):
+        send_mail("Welcome", "Hello", "noreply@example.com", ["ada@example.com"])
+
+    def test_emails_are_delivered_once_the_transaction_commits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.send()
+            self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.SENT)
+
+    def test_failed_deliveries_back_off_then_give_up(self):
+        self.send()
+        failing = mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=OSError)
+
+        with failing, self.assertLogs("accounts.outbox", "ERROR"):
+            self.assertEqual(outbox.deliver_due(), (0, 1))
+            # not due before its backoff ran out
+            self.assertEqual(outbox.deliver_due(), (0, 0))
+
+            OutboxEmail.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(outbox.deliver_due(), (0, 1))
+
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.FAILED, 2))
+        self.assertEqual(outbox.deliver_due(), (0, 0))
+
+    def test_a_broker_outage_leaves_the_email_queued(self):
+        with mock.patch.object(tasks.deliver_outbox, "apply_async", side_effect=BrokerError):
+            with self.assertLogs("accounts.tasks", "ERROR"), self.captureOnCommitCallbacks(execute=True):
+                self.send()
+
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.PENDING)
+        self.assertEqual(outbox.deliver_due(), (1, 0))
+
+
+class DeviceRegistryTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.users = [create_user(1), create_user(2)]
+        self.addCleanup(device_seen_buffer.drain)
+
+    def test_a_device_registered_again_moves_to_the_new_user(self):
+        register_device(self.users[0], "token-1")
+        register_device(self.users[1], "token-1", DeviceToken.IOS)
+
+        device = DeviceToken.objects.get()
+        self.assertEqual((device.user, device.platform), (self.users[1], DeviceToken.IOS))
+
+    def test_a_batch_keeps_the_last_entry_of_each_token(self):
+        entries = [(self.users[0].pk, "token-1", DeviceToken.ANDROID), (self.users[1].pk, "token-1", DeviceToken.WEB)]
+
+        self.assertEqual(register_devices(entries), 1)
+        self.assertEqual(DeviceToken.objects.get().user, self.users[1])
+
+    def test_a_known_device_only_buffers_its_last_seen(self):
+        self.assertTrue(register_device(self.users[0], "token-1"))
+
+        with self.assertNumQueries(0):
+            self.assertFalse(register_device(self.users[0], "token-1"))
+        self.assertIn(hash_token("token-1"), device_seen_buffer.drain())
+
+
+class LazyClientTests(TestCase):
+
+    def test_a_client_is_built_once_per_process(self):
+        client = LazyClient("test", object)
+        self.assertFalse(client.ready)
+
+        built = client.get()
+        self.assertIs(client.get(), built)
+        self.assertTrue(client.ready)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "needs os.fork")
+    def test_a_forked_child_builds_its_own_client(self):
+        client = LazyClient("test", object)
+        built = client.get()
+        read, write = os.pipe()
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.write(write, b"1" if client.get() is not built else b"0")
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.assertEqual(os.read(read, 1), b"1")
+        self.assertIs(client.get(), built)
+
+    @unittest.skipUnless(settings.FIREBASE_CREDENTIALS, "needs FIREBASE_CREDENTIALS")
+    def test_the_firebase_client_is_the_default_app(self):
+        import firebase_admin
+
+        client = registered_clients()["firebase"]
+        self.addCleanup(client.reset_after_fork)
+        self.addCleanup(lambda: firebase_admin.delete_app(firebase_admin.get_app()))
+
+        self.assertIs(get_client("firebase"), firebase_admin.get_app())
+        # as in a forked child, which inherits the parent's default app
+        client.reset_after_fork()
+        self.assertIs(get_client("firebase"), firebase_admin.get_app())
+
+
+class StorageTestCase(CacheTestCase):
+    """Default, staging and incoming storages in temporary directories"""
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+
+        overrides = self.settings(
+            DEFAULT_FILE_STORAGE="django.core.files.storage.FileSystemStorage",
+            MEDIA_ROOT=f"{root}/media",
+            PROFILE_IMAGES={"STAGING_OPTIONS": {"location": f"{root}/staging"}},
+            UPLOAD_TICKETS={
+                "ISSUER": "accounts.uploads.LocalTicketIssuer",
+                "STORAGE": "django.core.files.storage.FileSystemStorage",
+                "STORAGE_OPTIONS": {"location": f"{root}/incoming"},
+            },
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.reset_storages()
+        self.addCleanup(self.reset_storages)
+
+    @staticmethod
+    def reset_storages():
+        images.staging_storage._wrapped = empty
+        uploads.incoming_storage._wrapped = empty
+
+
+class ActivityLogArchiveTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, other = create_user(1), create_user(2)
+        self.now = datetime(2024, 6, 1, 12, tzinfo=dt_timezone.utc)
+        ActivityLog.objects.bulk_create([
+            ActivityLog(user=self.user, action="oldest", date_created=self.now - timedelta(days=41)),
+            ActivityLog(user=other, action="other user", date_created=self.now - timedelta(days=40, hours=2)),
+            ActivityLog(user=self.user, action="older", date_created=self.now - timedelta(days=40, hours=1)),
+            ActivityLog(user=self.user, action="old", date_created=self.now - timedelta(days=40)),
+            ActivityLog(user=self.user, action="recent", date_created=self.now - timedelta(days=1)),
+        ])
+
+    def archived_actions(self, **kwargs):
+        return [record["action"] for record in archive.archived_activity(self.user.pk, **kwargs)]
+
+    def test_old_entries_move_to_daily_segments(self):
+        self.assertEqual(archive.archive_activity_logs(retention_days=30, now=self.now), (2, 4))
+
+        self.assertEqual(list(ActivityLog.objects.values_list("action", flat=True)), ["recent"])
+        self.assertEqual(self.archived_actions(), ["oldest", "older", "old"])
+        self.assertEqual(self.archived_actions(since=self.now - timedelta(days=40, minutes=30)), ["old"])
+
+    def test_segments_are_split_at_segment_rows(self):
+        with self.settings(ACTIVITY_LOG={"SEGMENT_ROWS": 2}):
+            self.assertEqual(archive.archive_activity_logs(retention_days=30, now=self.now), (3, 4))
+
+        self.assertEqual(self.archived_actions(), ["oldest", "older", "old"])
+
+
+class ProfileImageTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.users = [create_user(n) for n in range(1, 4)]
+
+    def upload(self, user, data):
+        staged = images.staging_storage.save("upload.jpg", ContentFile(data))
+        self.assertTrue(images.process_upload(user.pk, staged))
+        user.refresh_from_db()
+        return user.image.name
+
+    def refcount(self, name):
+        return ProfileImage.objects.get(name=name).refcount
+
+    def test_the_same_image_is_stored_once(self):
+        data = image_bytes("green")
+        names = {self.upload(user, data) for user in self.users}
+
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertEqual(ProfileImage.objects.count(), 1)
+        self.assertEqual(self.refcount(name), 3)
+        for stored in images.image_names(name):
+            self.assertTrue(default_storage.exists(stored))
+
+    def test_replacing_an_image_releases_the_previous_one(self):
+        first = self.upload(self.users[0], image_bytes("green"))
+        self.upload(self.users[1], image_bytes("green"))
+        second = self.upload(self.users[0], image_bytes("red"))
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.refcount(first), 1)
+        self.assertEqual(self.refcount(second), 1)
+
+    def test_orphans_are_collected_after_the_grace_period(self):
+        orphan = self.upload(self.users[0], image_bytes("green"))
+        kept = self.upload(self.users[0], image_bytes("red"))
+
+        self.assertEqual(images.collect_orphans(grace_seconds=60), 0)
+        self.assertEqual(images.collect_orphans(grace_seconds=60, now=timezone.now() + timedelta(seconds=61)), 1)
+
+        self.assertFalse(ProfileImage.objects.filter(name=orphan).exists())
+        for stored in images.image_names(orphan):
+            self.assertFalse(default_storage.exists(stored))
+        self.assertTrue(default_storage.exists(kept))
+
+    def test_a_collected_image_is_stored_again_on_upload(self):
+        data = image_bytes("green")
+        name = self.upload(self.users[0], data)
+        self.upload(self.users[0], image_bytes("red"))
+        images.collect_orphans(grace_seconds=0, now=timezone.now() + timedelta(seconds=1))
+
+        self.assertEqual(self.upload(self.users[1], data), name)
+        self.assertTrue(default_storage.exists(name))
+
+    def test_an_undecodable_upload_is_rejected_and_deleted(self):
+        staged = images.staging_storage.save("upload.jpg", ContentFile(image_bytes("green")[:300]))
+
+        with self.assertLogs("accounts.images", "INFO"):
+            self.assertFalse(images.process_upload(self.users[0].pk, staged))
+        self.assertFalse(images.staging_storage.exists(staged))
+        self.assertFalse(ProfileImage.objects.exists())
+
+    def test_a_storage_error_keeps_the_staged_upload_for_a_retry(self):
+        staged = images.staging_storage.save("upload.jpg", ContentFile(image_bytes("green")))
+
+        with mock.patch.object(FileSystemStorage, "save", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                images.process_upload(self.users[0].pk, staged)
+        self.assertTrue(images.staging_storage.exists(staged))
+
+        self.assertTrue(images.process_upload(self.users[0].pk, staged))
+        self.assertFalse(images.staging_storage.exists(staged))
+
+    def test_recount_references_repairs_refcounts(self):
+        name = self.upload(self.users[0], image_bytes("green"))
+        ProfileImage.objects.filter(name=name).update(refcount=5)
+
+        self.assertEqual(images.recount_references(), 1)
+        self.assertEqual(self.refcount(name), 1)
+
+    def test_a_raised_refcount_keeps_its_release_date(self):
+        name = self.upload(self.users[0], image_bytes("green"))
+        released = timezone.now() - timedelta(days=1)
+        ProfileImage.objects.filter(name=name).update(refcount=0, date_released=released)
+
+        self.assertEqual(images.recount_references(), 1)
+        image = ProfileImage.objects.get(name=name)
+        self.assertEqual((image.refcount, image.date_released), (1, released))
+
+
+class UploadTicketTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user(1)
+        self.client = client_for(self.user)
+
+    def issue(self):
+        response = self.client.post("/v1/auth/image-upload/ticket/", {"content_type": "image/jpeg"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def put(self, ticket, data):
+        path = ticket["upload_url"].split("testserver", 1)[1]
+        return APIClient().generic("PUT", path, data, content_type="image/jpeg")
+
+    def complete(self, ticket):
+        return self.client.post("/v1/auth/image-upload/complete/", {"ticket": ticket["ticket"]}, format="json")
+
+    def test_an_upload_is_attached_once_completed(self):
+        ticket = self.issue()
+        self.assertEqual(self.put(ticket, image_bytes("green")).status_code, 201)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(self.complete(ticket).status_code, 202)
+        self.assertEqual(len(callbacks), 1)
+
+        name = uploads.open_ticket(ticket["ticket"], self.user)
+        self.assertTrue(tasks.process_direct_upload(str(self.user.pk), name))
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.image.name.startswith("profile_photos/"))
+        self.assertFalse(uploads.incoming_storage.exists(name))
+
+        # completed again: nothing left to process
+        self.assertEqual(self.complete(ticket).status_code, 400)
+        self.assertFalse(tasks.process_direct_upload(str(self.user.pk), name))
+
+    def test_tampered_tickets_are_refused(self):
+        ticket = self.issue()["ticket"]
+
+        with self.assertRaises(ValueError):
+            uploads.open_ticket(ticket[:-4] + "abcd")
+        with self.assertRaises(ValueError):
+            uploads.open_ticket(ticket, create_user(2))
+        tampered = {"upload_url": f"http://testserver/v1/auth/image-upload/direct/{ticket}x/"}
+        self.assertEqual(self.put(tampered, b"x").status_code, 403)
+
+    def test_expired_tickets_are_refused(self):
+        ticket = self.issue()
+
+        with self.settings(UPLOAD_TICKETS={**uploads.get_ticket_settings(), "TTL": -1}):
+            with self.assertRaisesMessage(ValueError, "expired"):
+                uploads.open_ticket(ticket["ticket"])
+            self.assertEqual(self.put(ticket, image_bytes("green")).status_code, 403)
+
+    def test_an_upload_without_a_body_is_refused(self):
+        self.assertEqual(self.put(self.issue(), b"").status_code, 411)
+
+    def test_tickets_issue_urls_for_the_incoming_storage(self):
+        request = APIRequestFactory().post("/")
+        ticket = uploads.issue_ticket(self.user, "image/png", request)
+
+        self.assertTrue(uploads.open_ticket(ticket["ticket"], self.user).endswith(".png"))
+        self.assertEqual(ticket["method"], "PUT")
+
+
+class ListQueryCountTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser(
+            email="admin@example.com", password="password", first_name="first", last_name="last", phone="+2349999999999",
+        )
+        self.client = client_for(self.admin)
+        permissions = list(Permission.objects.all()[:6])
+        self.groups = []
+        for i in range(3):
+            group = Group.objects.create(name=f"role {i}")
+            group.permissions.set(permissions[i:i + 3])
+            group.module_access.add(ModuleAccess.objects.create(url=f"/module-{i}", name=f"module {i}"))
+            self.groups.append(group)
+        self.permissions = permissions
+        self.created = 0
+
+    def add_users(self, count, role):
+        for _ in range(count):
+            self.created += 1
+            user = create_user(self.created, role=role, is_admin=role == "admin")
+            user.groups.set(self.groups[:2])
+            user.user_permissions.set(self.permissions[:1])
+
+    def queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(context.captured_queries)
+
+    def test_lists_run_a_constant_number_of_queries(self):
+        urls = ["/v1/auth/users/?limit=100", "/v1/auth/admin/?limit=100", "/v1/roles/"]
+        for url in urls:
+            self.queries(url)  # authentication and catalogue caches warm up
+
+        self.add_users(3, "user")
+        self.add_users(3, "admin")
+        few = [self.queries(url) for url in urls]
+
+        self.add_users(12, "user")
+        self.add_users(12, "admin")
+        self.assertEqual([self.queries(url) for url in urls], few)
@@ -0,0 +1,97 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import tokens
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from .blacklist import blacklist_store, get_blacklist_settings
+from .claims import claims_enabled, compile_claims
+
+
+def durable_log_enabled():
+    return get_blacklist_settings()["DURABLE_LOG"]
+
+
+def logged_token_text(token):
+    """Token text stored in the durable log, blank when TOKEN_BLACKLIST["COMPACT_LOG"] keeps only jti/exp/user"""
+    return "" if get_blacklist_settings()["COMPACT_LOG"] else str(token)
+
+
+class RefreshToken(tokens.RefreshToken):
+    """
+    Refresh token whose access tokens carry the permission claims when
+    ``TOKEN_PERMISSION_CLAIMS`` is enabled. The claims are compiled when the access
+    token is issued, never copied from the refresh token, so a refresh always picks up role changes.
+
+    Revocation goes through the blacklist store (accounts/blacklist.py); the
+    OutstandingToken/BlacklistedToken tables are written after the request's transaction
+    commits as long as TOKEN_BLACKLIST["DURABLE_LOG"] is on, and only read when a store
+    local to this worker misses.
+    """
+
+    _user = None
+
+    @classmethod
+    def for_user(cls, user):
+        # skip BlacklistMixin.for_user, it inserts an OutstandingToken row on every login
+        token = super(tokens.BlacklistMixin, cls).for_user(user)
+        token._user = user
+
+        if durable_log_enabled():
+            row = OutstandingToken(
+                user=user,
+                jti=token[api_settings.JTI_CLAIM],
+                token=logged_token_text(token),
+                created_at=token.current_time,
+                expires_at=datetime_from_epoch(token["exp"]),
+            )
+            transaction.on_commit(row.save)
+
+        return token
+
+    def check_blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        if blacklist_store.contains(jti):
+            raise TokenError(_("Token is blacklisted"))
+        if not blacklist_store.shared and durable_log_enabled() and self._logged_blacklisted(jti):
+            raise TokenError(_("Token is blacklisted"))
+
+    @staticmethod
+    def _logged_blacklisted(jti):
+        # a local store misses whatever other workers revoked
+        expires_at = BlacklistedToken.objects.filter(token__jti=jti).values_list("token__expires_at", flat=True).first()
+        if expires_at is None:
+            return False
+        blacklist_store.add(jti, expires_at.timestamp())
+        return True
+
+    def blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        exp = self.payload["exp"]
+        blacklist_store.add(jti, exp)
+
+        if durable_log_enabled():
+            token = logged_token_text(self)
+            transaction.on_commit(lambda: self._log_blacklisted(jti, exp, token))
+
+    @staticmethod
+    def _log_blacklisted(jti, exp, token):
+        outstanding, _ = OutstandingToken.objects.get_or_create(
+            jti=jti, defaults={"token": token, "expires_at": datetime_from_epoch(exp)},
+        )
+        BlacklistedToken.objects.get_or_create(token=outstanding)
+
+    @property
+    def access_token(self):
+        access = super().access_token
+
+        if claims_enabled():
+            user = self._user
+            if user is None:
+                user = get_user_model().objects.get(**{api_settings.USER_ID_FIELD: self[api_settings.USER_ID_CLAIM]})
+            access.payload.update(compile_claims(user))
+
+        return access
@@ -0,0 +1,172 @@
+"""
+Direct-to-storage profile image uploads.
+
+Instead of sending the image through the app, a client asks for an upload ticket,
+PUTs the bytes straight to the storage with the short-lived signed url that comes
+with it (an Azure SAS url in production), then posts the ticket back. Completing
+only checks the object's size with a HEAD, the image itself is validated, resized
+and attached by the process_direct_upload task (accounts/images.py).
+
+The ticket is a signed (user, object name) pair valid for TTL seconds, so the app
+keeps no state between the two calls. UPLOAD_TICKETS["ISSUER"] builds the signed
+urls for the incoming storage: AzureTicketIssuer for django-storages' AzureStorage
+(real Azure or Azurite), LocalTicketIssuer for a FileSystemStorage in development
+and tests, where the url points at the app's own direct upload endpoint.
+
+Whatever a client PUTs is unchecked until the worker validates it, so the incoming
+storage (UPLOAD_TICKETS["STORAGE"], the default storage class when unset) must not
+serve its objects publicly, e.g. a private Azure container.
+"""
+import logging
+import posixpath
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import get_storage_class
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import LazyObject
+from django.utils.module_loading import import_string
+
+from .images import EXTENSIONS, get_image_settings
+
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {"image/jpeg": EXTENSIONS["JPEG"], "image/png": EXTENSIONS["PNG"]}
+SALT = "accounts.uploads"
+
+
+class BaseTicketIssuer(ABC):
+
+    @abstractmethod
+    def upload_url(self, storage, name, content_type, expiry, ticket, request):
+        """Returns the (url, headers) a client PUTs the object `name` to until `expiry`"""
+
+
+class AzureTicketIssuer(BaseTicketIssuer):
+    """A SAS url allowing only to create and write that one blob"""
+
+    def upload_url(self, storage, name, content_type, expiry, ticket, request):
+        from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+
+        blob_name = storage._get_valid_path(name)
+        # same credentials as AzureStorage.url: the account key, or a user delegation key with a token credential
+        user_delegation_key = storage.get_user_delegation_key(expiry)
+        if not storage.account_key and user_delegation_key is None:
+            raise ImproperlyConfigured("upload tickets need AZURE_ACCOUNT_KEY or AZURE_TOKEN_CREDENTIAL")
+
+        sas_token = generate_blob_sas(
+            storage.account_name,
+            storage.azure_container,
+            blob_name,
+            account_key=storage.account_key,
+            user_delegation_key=user_delegation_key,
+            permission=BlobSasPermissions(create=True, write=True),
+            expiry=expiry,
+            content_type=content_type,
+        )
+        url = f"{storage.client.get_blob_client(blob_name).url}?{sas_token}"
+        return url, {"x-ms-blob-type": "BlockBlob", "Content-Type": content_type}
+
+
+class LocalTicketIssuer(BaseTicketIssuer):
+    """The app's own direct upload endpoint, standing in for a signed storage url"""
+
+    def upload_url(self, storage, name, content_type, expiry, ticket, request):
+        return request.build_absolute_uri(reverse("image-upload-direct", args=[ticket])), {"Content-Type": content_type}
+
+
+def get_ticket_settings():
+    return {
+        "ISSUER": "accounts.uploads.AzureTicketIssuer",
+        "OPTIONS": {},
+        "TTL": 600,
+        "PREFIX": "incoming",
+        "INCOMPLETE_MAX_AGE": 24 * 60 * 60,
+        "STORAGE": None,
+        "STORAGE_OPTIONS": {},
+        **getattr(settings, "UPLOAD_TICKETS", {}),
+    }
+
+
+class IncomingStorage(LazyObject):
+    """Where clients upload with their tickets, kept apart from the publicly served images"""
+
+    def _setup(self):
+        options = get_ticket_settings()
+        self._wrapped = get_storage_class(options["STORAGE"])(**options["STORAGE_OPTIONS"])
+
+
+incoming_storage = IncomingStorage()
+
+
+def get_issuer():
+    options = get_ticket_settings()
+    return import_string(options["ISSUER"])(**options["OPTIONS"])
+
+
+def issue_ticket(user, content_type, request, storage=incoming_storage):
+    """Returns the ticket, upload url and headers for one profile image of the user"""
+
+    options = get_ticket_settings()
+    name = posixpath.join(options["PREFIX"], f"{uuid.uuid4().hex}.{CONTENT_TYPES[content_type]}")
+    ticket = signing.dumps({"user": str(user.pk), "name": name}, salt=SALT)
+    expiry = datetime.now(dt_timezone.utc) + timedelta(seconds=options["TTL"])
+
+    url, headers = get_issuer().upload_url(storage, name, content_type, expiry, ticket, request)
+    return {"ticket": ticket, "upload_url": url, "method": "PUT", "headers": headers, "expires_in": options["TTL"]}
+
+
+def open_ticket(ticket, user=None):
+    """
+    Returns the object name of a valid ticket, of `user` when given.
+    Raises ValueError for a tampered, expired or someone else's ticket.
+    """
+
+    try:
+        data = signing.loads(ticket, salt=SALT, max_age=get_ticket_settings()["TTL"])
+    except signing.SignatureExpired:
+        raise ValueError("The upload ticket has expired")
+    except signing.BadSignature:
+        raise ValueError("Invalid upload ticket")
+
+    if user is not None and data["user"] != str(user.pk):
+        raise ValueError("Invalid upload ticket")
+    return data["name"]
+
+
+def check_uploaded(name, storage=incoming_storage):
+    """Checks the object of a completed ticket exists and is not too large, without reading it"""
+
+    max_size = get_image_settings()["MAX_UPLOAD_SIZE"]
+    if not storage.exists(name):
+        raise ValueError("Nothing was uploaded with this ticket")
+    if storage.size(name) > max_size:
+        storage.delete(name)
+        raise ValueError(f"Images are limited to {max_size // (1024 * 1024)}MB")
+
+
+def sweep_incomplete(max_age=None, storage=incoming_storage, now=None):
+    """Deletes the objects uploaded with tickets that were never completed, returns the number deleted"""
+
+    options = get_ticket_settings()
+    max_age = options["INCOMPLETE_MAX_AGE"] if max_age is None else max_age
+    cutoff = (now or timezone.now()) - timedelta(seconds=max_age)
+
+    try:
+        names = storage.listdir(options["PREFIX"])[1]
+    except FileNotFoundError:
+        return 0
+
+    deleted = 0
+    for name in names:
+        path = posixpath.join(options["PREFIX"], name)
+        if storage.get_modified_time(path) < cutoff:
+            storage.delete(path)
+            deleted += 1
+    return deleted
@@ -1,5 +1,5 @@
 from django.urls import path, include
-from . import views
+from . import views, async_views
 from rest_framework.routers import DefaultRouter
 
 # Create a router and register our viewsets with it.
@@ -14,7 +14,9 @@ urlpatterns = [
     path('auth/admin/', views.AdminListCreateView().as_view()),
     path('auth/admin/<uuid:user_id>/assign-roles/', views.assign_role),
     path('auth/login/', views.user_login, name="login_view"),
+    path('auth/login/async/', async_views.async_user_login, name="async_login_view"),
     path("auth/logout/", views.logout_view, name="logout_view"),
+    path("auth/token/refresh/", views.CustomTokenRefreshView.as_view(), name="token_refresh"),
     path('auth/otp/verify/', views.otp_verification),
     path('auth/otp/new/', views.reset_otp),
     path('auth/fcm-token/', views.update_firebase_token),
@@ -24,4 +26,9 @@ urlpatterns = [
     path("roles/<int:id>", views.GroupDetail.as_view(), ),
     path("activity-logs/", views.activity_logs),
     path("auth/image-upload", views.image_upload, name="image-upload"),
+    path("auth/image-upload/stream/", views.stream_image_upload, name="image-upload-stream"),
+    path("auth/image-upload/ticket/", views.image_upload_ticket, name="image-upload-ticket"),
+    path("auth/image-upload/complete/", views.complete_image_upload, name="image-upload-complete"),
+    path("auth/image-upload/direct/<str:ticket>/", views.direct_image_upload, name="image-upload-direct"),
+    path("cache-stats/", views.cache_stats, name="cache-stats"),
 ]
@@ -2,15 +2,27 @@ from accounts.permissions import *
 from .serializers import *
 from rest_framework import status
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, authentication_classes, permission_classes
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, parser_classes
+from .authentication import CachedJWTAuthentication, principal_cache
+from .backends import permission_cache
+from .hashers import login_pool
 from drf_yasg.utils import swagger_auto_schema
 from django.contrib.auth import get_user_model
 from .helpers.generators import generate_password
 from rest_framework.exceptions import PermissionDenied, AuthenticationFailed, NotFound, ValidationError
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenRefreshView
+from .tokens import RefreshToken
+from .claims import token_modules
+from .activity import log_activity
+from .devices import register_device
+from .pagination import KeysetPagination
+from .parsers import ImageMultiPartParser
+from .images import submit_upload
+from .tasks import enqueue_on_commit, process_direct_upload, process_profile_image
+from . import uploads
+from django.core.files import File
 from rest_framework_simplejwt.exceptions import TokenError
-from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from django.contrib.auth import authenticate, logout
 from django.contrib.auth.signals import user_logged_in, user_logged_out
 from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView, ListAPIView , RetrieveUpdateAPIView
@@ -51,7 +63,7 @@ class CustomUserViewSet(UserViewSet):
     queryset = User.objects.filter(is_deleted=False)
     
     def list(self, request, *args, **kwargs):
-        queryset = self.queryset.filter(role="user")
+        queryset = CustomUserSerializer.prefetch(self.queryset.filter(role="user"))
 
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -71,18 +83,12 @@ class CustomUserViewSet(UserViewSet):
         if check_password(password, instance.password):
             
             self.perform_destroy(instance)
-            ActivityLog.objects.create(
-                user=instance,
-                action = f"Deleted account"
-            )
+            log_activity(instance, f"Deleted account")
             return Response(status=status.HTTP_204_NO_CONTENT)
         
         elif request.user.role == "admin" and check_password(password, request.user.password):
             self.perform_destroy(instance)
-            ActivityLog.objects.create(
-                user=request.user,
-                action = f"Deleted account with ID {instance.id}"
-            )
+            log_activity(request.user, f"Deleted account with ID {instance.id}")
             return Response(status=status.HTTP_204_NO_CONTENT)
         
         # elif password=="google" and request.user.provider=="google":
@@ -97,10 +103,14 @@ class AdminListCreateView(ListCreateAPIView):
     
     queryset = User.objects.filter(is_deleted=False, is_active=True, role="admin").order_by('-date_joined')
     serializer_class =  CustomUserSerializer
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [CustomDjangoModelPermissions]
     
     
+    def get_queryset(self):
+        return CustomUserSerializer.prefetch(super().get_queryset())
+    
+    
     @swagger_auto_schema(method="post", request_body= CustomUserSerializer())
     @action(methods=["post"], detail=True)
     def post(self, request, *args, **kwargs):
@@ -132,10 +142,7 @@ class AdminListCreateView(ListCreateAPIView):
                 'data' : serializer.data,
             }
             
-            ActivityLog.objects.create(
-            user=request.user,
-            action = f"Created admin with email {instance.email}"
-            )
+            log_activity(request.user, f"Created admin with email {instance.email}")
 
             return Response(data, status = status.HTTP_201_CREATED)
 
@@ -152,6 +159,34 @@ class AdminListCreateView(ListCreateAPIView):
 
 
 
+def login_payload(request, user):
+    
+    """Issues the jwt tokens of an authenticated user and builds the user details returned by the login views"""
+    
+    refresh = RefreshToken.for_user(user)
+    access = refresh.access_token
+
+    user_detail = {}
+    user_detail['id']   = user.id
+    user_detail['first_name'] = user.first_name
+    user_detail['last_name'] = user.last_name
+    user_detail['email'] = user.email
+    user_detail['phone'] = user.phone
+    user_detail['role'] = user.role
+    user_detail['is_admin'] = user.is_admin
+    user_detail['is_superuser'] = user.is_superuser
+    user_detail['access'] = str(access)
+    user_detail['refresh'] = str(refresh)
+    user_logged_in.send(sender=user.__class__,
+                        request=request, user=user)
+
+    if user.role == 'admin':
+        modules = token_modules(access)
+        user_detail["modules"] = list(user.module_access) if modules is None else modules
+    
+    return user_detail
+
+
 @swagger_auto_schema(method='post', request_body=LoginSerializer())
 @api_view([ 'POST'])
 def user_login(request):
@@ -169,24 +204,7 @@ def user_login(request):
                 
                     try:
                         
-                        refresh = RefreshToken.for_user(user)
-
-                        user_detail = {}
-                        user_detail['id']   = user.id
-                        user_detail['first_name'] = user.first_name
-                        user_detail['last_name'] = user.last_name
-                        user_detail['email'] = user.email
-                        user_detail['phone'] = user.phone
-                        user_detail['role'] = user.role
-                        user_detail['is_admin'] = user.is_admin
-                        user_detail['is_superuser'] = user.is_superuser
-                        user_detail['access'] = str(refresh.access_token)
-                        user_detail['refresh'] = str(refresh)
-                        user_logged_in.send(sender=user.__class__,
-                                            request=request, user=user)
-
-                        if user.role == 'admin':
-                            user_detail["modules"] = user.module_access
+                        user_detail = login_payload(request, user)
                             
                         data = {
     
@@ -221,9 +239,15 @@ def user_login(request):
                 return Response(data, status=status.HTTP_400_BAD_REQUEST)
             
             
+class CustomTokenRefreshView(TokenRefreshView):
+    """Issues a new access token (and a rotated refresh token). Access tokens carry freshly compiled permission claims."""
+    
+    serializer_class = TokenRefreshSerializer
+    
+    
 @swagger_auto_schema(method="post",request_body=LogoutSerializer())
 @api_view(["POST"])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def logout_view(request):
     """Log out a user by blacklisting their refresh token then making use of django's internal logout function to flush out their session and completely log them out.
@@ -251,7 +275,7 @@ def logout_view(request):
 
 @swagger_auto_schema(method="patch",request_body=FirebaseSerializer())
 @api_view(["PATCH"])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def update_firebase_token(request):
     """Update the FCM token for a logged in use to enable push notifications
@@ -266,8 +290,7 @@ def update_firebase_token(request):
     
     fcm_token = serializer.validated_data.get("fcm_token")
 
-    request.user.fcm_token = fcm_token
-    request.user.save()
+    register_device(request.user, fcm_token, serializer.validated_data.get("platform"))
         
     return Response({"message": "success"}, status=status.HTTP_200_OK)
     
@@ -312,34 +335,34 @@ class PermissionList(ListAPIView):
     serializer_class = PermissionSerializer
     queryset = Permission.objects.exclude(get_query())
     permission_classes = [IsAdminUser]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     
     
 class ModuleAccessList(ListAPIView):
     serializer_class = ModuleAccessSerializer
     queryset = ModuleAccess.objects.all()
     permission_classes = [IsAdminUser]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
 
 
 class GroupListCreate(ListCreateAPIView):
     serializer_class = GroupSerializer
-    queryset = Group.objects.all()
+    queryset = GroupSerializer.prefetch(Group.objects.all())
     permission_classes = [IsAdminUser]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
 
 
 class GroupDetail(RetrieveUpdateDestroyAPIView):
     serializer_class = GroupSerializer
-    queryset = Group.objects.all()
+    queryset = GroupSerializer.prefetch(Group.objects.all())
     lookup_field = "id"
     permission_classes = [IsAdminUser]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     
 
 @swagger_auto_schema(method="patch", request_body=AssignRoleSerializer())
 @api_view(["PATCH"])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([UserTablePermissions])
 def assign_role(request, user_id):
     
@@ -361,33 +384,32 @@ def assign_role(request, user_id):
         roles = serializer.validated_data.get("roles")
         user.groups.add(*roles)
         
-        ActivityLog.objects.create(
-            user=request.user,
-            action = f"Updated roles for {user.email}"
-            )
+        log_activity(request.user, f"Updated roles for {user.email}")
         
         return Response({"message":"success"}, status=status.HTTP_200_OK)
         
         
         
 @api_view(["GET"])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def activity_logs(request):
     
-    """shows 10 most recent logged user activities"""
-    
-    logs = ActivityLog.objects.filter(is_deleted=False, user=request.user).order_by("-date_created").values("action")[:10]
+    """shows the logged user activities, newest first. Pages through older/newer entries with the `before`/`after` cursors"""
     
+    logs = ActivityLog.objects.filter(is_deleted=False, user=request.user).values("id", "action", "date_created")
     
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(logs, request)
+    data = [{"action": log["action"], "date_created": log["date_created"]} for log in page]
     
-    return Response(logs, status=status.HTTP_200_OK)
+    return paginator.get_paginated_response(data)
 
 
 
 @swagger_auto_schema(method="post", request_body=ImageUploadSerializer())
 @api_view(["POST"])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def image_upload(request):
     
@@ -396,12 +418,139 @@ def image_upload(request):
         
         serializer.is_valid(raise_exception=True)
         
-        user = request.user
+        user_id = str(request.user.pk)
+        staged = submit_upload(user_id, serializer.validated_data.get("image"))
         
-        user.image = serializer.validated_data.get("image")
-        
-        user.save()
+        if staged is not None:
+            enqueue_on_commit(process_profile_image, user_id, *staged)
         
         return Response({"message": "upload successful"}, status=status.HTTP_200_OK)
+
+
+@swagger_auto_schema(method="post", request_body=ImageStreamUploadSerializer())
+@api_view(["POST"])
+@parser_classes([ImageMultiPartParser])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def stream_image_upload(request):
+    """Upload a profile image as multipart/form-data, it is spooled to disk and resized in the background
+
+    Returns:
+        Json response with a message and status code of 200 when the same image was stored already and is attached,
+        or 202 when the image is attached to the user once processed.
+    """
+    
+    serializer = ImageStreamUploadSerializer(data=request.data)
+    
+    serializer.is_valid(raise_exception=True)
+    
+    user_id = str(request.user.pk)
+    staged = submit_upload(user_id, serializer.validated_data.get("image"))
+    
+    if staged is None:
+        return Response({"message": "upload successful"}, status=status.HTTP_200_OK)
+    
+    enqueue_on_commit(process_profile_image, user_id, *staged)
+    
+    return Response({"message": "upload accepted"}, status=status.HTTP_202_ACCEPTED)
+
+
+@swagger_auto_schema(method="post", request_body=UploadTicketSerializer())
+@api_view(["POST"])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def image_upload_ticket(request):
+    """Issue a short-lived ticket to upload a profile image straight to the storage
+
+    Returns:
+        Json response with the ticket, the url and headers to PUT the image with, and the seconds the url is valid for.
+    """
+    
+    serializer = UploadTicketSerializer(data=request.data)
+    
+    serializer.is_valid(raise_exception=True)
+    
+    data = uploads.issue_ticket(request.user, serializer.validated_data.get("content_type"), request)
+    
+    return Response(data, status=status.HTTP_200_OK)
+
+
+@swagger_auto_schema(method="post", request_body=UploadCompleteSerializer())
+@api_view(["POST"])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def complete_image_upload(request):
+    """Complete an upload made with a ticket, the image is validated and attached to the user in the background
+
+    Returns:
+        Json response with a message and status code of 202.
+    """
+    
+    serializer = UploadCompleteSerializer(data=request.data)
+    
+    serializer.is_valid(raise_exception=True)
+    
+    try:
+        name = uploads.open_ticket(serializer.validated_data.get("ticket"), request.user)
+        uploads.check_uploaded(name)
+    except ValueError as error:
+        raise ValidationError(detail={"message": str(error)})
+    
+    user_id = str(request.user.pk)
+    enqueue_on_commit(process_direct_upload, user_id, name)
+    
+    return Response({"message": "upload accepted"}, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(["PUT"])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def direct_image_upload(request, ticket):
+    """Stand-in for a signed storage url when UPLOAD_TICKETS uses the LocalTicketIssuer, the ticket authorizes the upload"""
+    
+    if not isinstance(uploads.get_issuer(), uploads.LocalTicketIssuer):
+        raise NotFound()
+    
+    try:
+        name = uploads.open_ticket(ticket)
+    except ValueError as error:
+        raise PermissionDenied(str(error))
+    
+    try:
+        content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        content_length = 0
+    
+    if content_length <= 0:
+        # there is no body to read without it
+        return Response({"message": "Content-Length is required"}, status=status.HTTP_411_LENGTH_REQUIRED)
+    
+    if content_length > uploads.get_image_settings()["MAX_UPLOAD_SIZE"]:
+        raise ValidationError(detail={"message": "The image is too large"})
+    
+    if uploads.incoming_storage.exists(name):
+        return Response({"message": "already uploaded"}, status=status.HTTP_409_CONFLICT)
+    
+    # the body is copied in chunks, like a PUT to the storage would be
+    uploads.incoming_storage.save(name, File(request.stream, name))
+    
+    return Response(status=status.HTTP_201_CREATED)
+
+
+
+
+@api_view(["GET"])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAdminUser])
+def cache_stats(request):
+    
+    """shows the hit/miss counters of the caches held by the worker process serving the request"""
+    
+    data = {
+        "pid": os.getpid(),
+        "principal": principal_cache.stats.as_dict(),
+        "permissions": permission_cache.stats.as_dict(),
+        "login_pool": login_pool.stats.as_dict(),
+    }
     
-    
\ No newline at end of file
+    return Response(data, status=status.HTTP_200_OK)
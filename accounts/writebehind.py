@@ -0,0 +1,166 @@
+"""
+Write-behind buffers for timestamp columns that change on every request of a hot path
+(User.last_login on login, DeviceToken.last_seen on app launch).
+
+Only the newest timestamp per row is kept and a flush writes all of them with one
+UPDATE ... SET col = CASE pk WHEN ... END, which fires no model signals.
+"""
+import atexit
+import logging
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone as dt_timezone
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.db.models import Case, Value, When
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+
+class BaseTimestampBuffer(ABC):
+
+    def __init__(self, model, field, flush_interval=5, max_pending=1000, **kwargs):
+        self.model_label = model
+        self.field = field
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    @abstractmethod
+    def record(self, pk, value):
+        """Keeps `value` as the pending timestamp of row `pk` unless a newer one is pending"""
+
+    @abstractmethod
+    def drain(self):
+        """Removes and returns the pending {pk: datetime}"""
+
+    def write(self, pending):
+        if not pending:
+            return 0
+
+        field = self.model._meta.get_field(self.field)
+        newest = Case(
+            *[When(pk=pk, then=Value(value, output_field=field)) for pk, value in pending.items()],
+            output_field=field,
+        )
+        return self.model._base_manager.filter(pk__in=list(pending)).update(**{self.field: newest})
+
+    def flush(self):
+        pending = self.drain()
+        updated = self.write(pending)
+        if pending:
+            logger.debug("flushed %s %s.%s timestamps", updated, self.model_label, self.field)
+        return updated
+
+
+class MemoryTimestampBuffer(BaseTimestampBuffer):
+    """
+    Per-process buffer. The first record after a flush arms a timer that flushes
+    `flush_interval` seconds later; a full buffer flushes straight away and
+    whatever is pending when the process exits is flushed then.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+        atexit.register(self._flush_in_thread)
+
+    def record(self, pk, value):
+        with self._lock:
+            if pk not in self._pending or self._pending[pk] < value:
+                self._pending[pk] = value
+            full = len(self._pending) >= self.max_pending
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_in_thread)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        return pending
+
+    def _flush_in_thread(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("could not flush %s.%s timestamps", self.model_label, self.field)
+        finally:
+            close_old_connections()
+
+
+class RedisTimestampBuffer(BaseTimestampBuffer):
+    """
+    Buffer shared by every worker, a redis hash of pk -> epoch seconds kept at the max by a script.
+
+    Whichever worker records first after `flush_interval` has passed takes the flush, the
+    accounts.tasks.flush_timestamp_buffers beat task picks up what's left when logins stop.
+    """
+
+    RECORD_SCRIPT = """
+    local current = redis.call('HGET', KEYS[1], ARGV[1])
+    if not current or tonumber(current) < tonumber(ARGV[2]) then
+        redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    end
+    return redis.call('HLEN', KEYS[1])
+    """
+
+    DRAIN_SCRIPT = """
+    local pending = redis.call('HGETALL', KEYS[1])
+    redis.call('DEL', KEYS[1])
+    return pending
+    """
+
+    def __init__(self, *args, cache_alias="default", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    @property
+    def client(self):
+        return self.cache._cache.get_client(write=True)
+
+    def key(self, suffix):
+        return self.cache.make_key(f"writebehind:{self.model_label}.{self.field}:{suffix}")
+
+    def record(self, pk, value):
+        size = self.client.eval(self.RECORD_SCRIPT, 1, self.key("pending"), str(pk), value.timestamp())
+        if size >= self.max_pending or self.cache.add(
+            f"writebehind:{self.model_label}.{self.field}:flushed", 1, self.flush_interval
+        ):
+            self.flush()
+
+    def drain(self):
+        pending = self.client.eval(self.DRAIN_SCRIPT, 1, self.key("pending"))
+        pk_field = self.model._meta.pk
+        return {
+            pk_field.to_python(pk.decode()): datetime.fromtimestamp(float(value), tz=dt_timezone.utc)
+            for pk, value in zip(pending[::2], pending[1::2])
+        }
+
+
+def load_buffer(setting_name):
+    options = getattr(settings, setting_name)
+    return import_string(options["STORE"])(**options["OPTIONS"])
+
+
+last_login_buffer = load_buffer("LAST_LOGIN_BUFFER")
+device_seen_buffer = load_buffer("DEVICE_SEEN_BUFFER")
@@ -8,7 +8,9 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 """
 
 import os
+from dotenv import find_dotenv, load_dotenv
 
+load_dotenv(find_dotenv())
 
 configuration = os.getenv('ENVIRONMENT', 'development').title()
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
@@ -0,0 +1,23 @@
+"""
+Celery app for the project, run with `celery -A config worker` and `celery -A config beat`.
+
+Settings prefixed with CELERY_ in config/settings.py configure it.
+"""
+
+import os
+from dotenv import find_dotenv, load_dotenv
+
+load_dotenv(find_dotenv())
+
+configuration = os.getenv('ENVIRONMENT', 'development').title()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+os.environ.setdefault('DJANGO_CONFIGURATION', configuration)
+
+from configurations import importer  # noqa
+importer.install()
+
+from celery import Celery  # noqa
+
+app = Celery('config')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -0,0 +1,19 @@
+"""
+Logging handlers used by LOGGING in config/settings.py.
+"""
+import logging
+import os
+
+
+class LazyFileHandler(logging.FileHandler):
+    """
+    FileHandler that opens its file, creating the directory, on the first record
+    instead of when logging is configured, so commands that never log touch no files.
+    """
+
+    def __init__(self, filename, mode="a", encoding=None, errors=None):
+        super().__init__(filename, mode, encoding, delay=True, errors=errors)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
@@ -12,18 +12,13 @@ from pathlib import Path
 from django.utils.timezone import timedelta
 
 from configurations import Configuration, values
-import firebase_admin
-from firebase_admin import credentials
-import json
 
 
 
 class Common(Configuration):
     
+    # Service account json, the firebase app is built on first use (accounts/clients.py)
     FIREBASE_CREDENTIALS = os.getenv("FIREBASE_CREDENTIALS")
-    
-    cred = credentials.Certificate(json.loads(FIREBASE_CREDENTIALS))
-    firebase_admin.initialize_app(cred)
 
     # Build paths inside the project like this: BASE_DIR / 'subdir'.
     BASE_DIR = Path(__file__).resolve().parent.parent
@@ -103,6 +98,141 @@ class Common(Configuration):
         'sqlite:///{}'.format(os.path.join(BASE_DIR, 'db.sqlite3'))
     )
 
+    # Cache
+    # https://docs.djangoproject.com/en/4.1/topics/cache/
+    REDIS_URL = os.getenv("REDIS_URL")
+
+    if REDIS_URL:
+        CACHES = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                'LOCATION': REDIS_URL,
+            }
+        }
+    else:
+        CACHES = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            }
+        }
+
+    # Celery, the broker defaults to the cache redis
+    CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", REDIS_URL)
+    # without a broker tasks run inline, e.g. the outbox delivers right after the request commits
+    CELERY_TASK_ALWAYS_EAGER = not CELERY_BROKER_URL
+    CELERY_TIMEZONE = 'Africa/Lagos'
+    CELERY_BEAT_SCHEDULE = {
+        'prune-expired-tokens': {
+            'task': 'accounts.tasks.prune_expired_tokens',
+            'schedule': timedelta(hours=6),
+        },
+        'sweep-activation-otps': {
+            'task': 'accounts.tasks.sweep_activation_otps',
+            'schedule': timedelta(minutes=15),
+        },
+        'archive-activity-logs': {
+            'task': 'accounts.tasks.archive_activity_logs',
+            'schedule': timedelta(days=1),
+        },
+        'collect-profile-images': {
+            'task': 'accounts.tasks.collect_profile_images',
+            'schedule': timedelta(hours=6),
+        },
+        'deliver-outbox': {
+            'task': 'accounts.tasks.deliver_outbox',
+            'schedule': timedelta(minutes=1),
+        },
+        'prune-outbox': {
+            'task': 'accounts.tasks.prune_outbox',
+            'schedule': timedelta(days=1),
+        },
+        'flush-timestamp-buffers': {
+            'task': 'accounts.tasks.flush_timestamp_buffers',
+            'schedule': timedelta(minutes=1),
+        },
+    }
+
+    # Batch size of the pruning jobs (accounts/pruning.py)
+    PRUNE_BATCH_SIZE = int(os.getenv("PRUNE_BATCH_SIZE", 1000))
+
+    # Authenticated users served to the jwt authentication (seconds)
+    PRINCIPAL_CACHE = {
+        'LOCAL_SIZE': 1024,
+        'LOCAL_TTL': 5,
+        'SHARED_TTL': 300,
+        'CACHE_ALIAS': 'default',
+    }
+
+    # Permission names of each user shared by all workers (seconds)
+    PERMISSION_CACHE = {
+        'TTL': 3600,
+        'CACHE_ALIAS': 'default',
+    }
+
+    # Thread pool running the password checks of the async login view
+    LOGIN_HASH_POOL = {
+        'WORKERS': int(os.getenv("LOGIN_HASH_WORKERS", 4)),
+        'QUEUE_LIMIT': int(os.getenv("LOGIN_HASH_QUEUE_LIMIT", 64)),
+    }
+
+    # last_login is written behind, newest timestamp per user flushed in one UPDATE
+    LAST_LOGIN_BUFFER = {
+        'STORE': 'accounts.writebehind.RedisTimestampBuffer' if REDIS_URL else 'accounts.writebehind.MemoryTimestampBuffer',
+        'OPTIONS': {
+            'model': 'accounts.User',
+            'field': 'last_login',
+            'flush_interval': int(os.getenv("LAST_LOGIN_FLUSH_INTERVAL", 5)),
+        },
+    }
+
+    # Push devices seen again only refresh last_seen through this buffer, see accounts/devices.py
+    DEVICE_SEEN_BUFFER = {
+        'STORE': 'accounts.writebehind.RedisTimestampBuffer' if REDIS_URL else 'accounts.writebehind.MemoryTimestampBuffer',
+        'OPTIONS': {
+            'model': 'accounts.DeviceToken',
+            'field': 'last_seen',
+            'flush_interval': int(os.getenv("DEVICE_SEEN_FLUSH_INTERVAL", 60)),
+        },
+    }
+
+    # ActivityLog entries are buffered per worker and written with bulk_create, SYNC writes them inline.
+    # Rows older than RETENTION_DAYS are moved to gzipped JSONL segments under ARCHIVE_PREFIX on the default storage
+    ACTIVITY_LOG = {
+        'BATCH_SIZE': 100,
+        'FLUSH_INTERVAL': 2,
+        'MAX_ATTEMPTS': 5,
+        'SYNC': os.getenv("ACTIVITY_LOG_SYNC", "False") == "True",
+        'RETENTION_DAYS': int(os.getenv("ACTIVITY_LOG_RETENTION_DAYS", 90)),
+        'ARCHIVE_PREFIX': 'archive/activity-logs',
+        'SEGMENT_ROWS': 50000,
+    }
+
+    # Activation OTPs, hashed in ActivationOtp rows or kept in the cache ('accounts.otp.CacheOTPStore') until they expire.
+    # The sweeper deletes expired rows and all but the MAX_LIVE_PER_USER newest codes of a user
+    ACTIVATION_OTP = {
+        'STORE': os.getenv("ACTIVATION_OTP_STORE", 'accounts.otp.DatabaseOTPStore'),
+        'OPTIONS': {'ttl': 600},
+        'MAX_LIVE_PER_USER': 3,
+    }
+
+    # Push notifications, multicast batches of BATCH_SIZE tokens (500 at most) with CONCURRENCY batches in flight
+    PUSH_NOTIFICATIONS = {
+        'TRANSPORT': 'accounts.push.FirebasePushTransport',
+        'OPTIONS': {},
+        'BATCH_SIZE': 500,
+        'CONCURRENCY': int(os.getenv("PUSH_CONCURRENCY", 8)),
+    }
+
+    # Password hashing, see `manage.py calibrate_hashers` for PASSWORD_HASH_ITERATIONS (never below django's default)
+    PASSWORD_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", 0)) or None
+    PASSWORD_HASHERS = [
+        'accounts.hashers.CalibratedPBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+        'django.contrib.auth.hashers.Argon2PasswordHasher',
+        'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+        'django.contrib.auth.hashers.ScryptPasswordHasher',
+    ]
+
     # Password validation
     # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
     AUTH_PASSWORD_VALIDATORS = [
@@ -164,6 +294,7 @@ class Common(Configuration):
         'ACTIVATION_URL' : 'activate/{uid}/{token}',
         'SERIALIZERS':{
             'user_create': 'accounts.serializers.UserRegistrationSerializer',
+            'user_create_password_retype': 'accounts.serializers.UserRegistrationRetypeSerializer',
             'user': 'accounts.serializers.CustomUserSerializer',
             'user_delete': 'accounts.serializers.UserDeleteSerializer',
             "current_user" : 'accounts.serializers.CustomUserSerializer',
@@ -176,7 +307,7 @@ class Common(Configuration):
 
     REST_FRAMEWORK = {
         'DEFAULT_AUTHENTICATION_CLASSES': (
-            'rest_framework_simplejwt.authentication.JWTAuthentication',
+            'accounts.authentication.CachedJWTAuthentication',
         ),
 
 
@@ -187,7 +318,7 @@ class Common(Configuration):
     SIMPLE_JWT = {
         'ACCESS_TOKEN_LIFETIME': timedelta(minutes=30),
         'REFRESH_TOKEN_LIFETIME': timedelta(days=5),
-        'UPDATE_LAST_LOGIN': True,
+        'UPDATE_LAST_LOGIN': False,  # user_logged_in buffers last_login, see LAST_LOGIN_BUFFER
         'SIGNING_KEY': SECRET_KEY,
         'AUTH_HEADER_TYPES': ('Bearer',),
         'AUTH_HEADER_NAME': 'HTTP_AUTHORIZATION',
@@ -197,6 +328,18 @@ class Common(Configuration):
 
     }
 
+    # Revoked refresh tokens are checked in the cache, the token_blacklist tables are a log that is only read
+    # when the cache is local to a worker (the redis instance must not evict them, see accounts/blacklist.py)
+    TOKEN_BLACKLIST = {
+        'STORE': 'accounts.blacklist.CacheBlacklistStore',
+        'OPTIONS': {'cache_alias': 'default'},
+        'DURABLE_LOG': os.getenv("TOKEN_BLACKLIST_DURABLE_LOG", "True") == "True",
+        'COMPACT_LOG': os.getenv("TOKEN_BLACKLIST_COMPACT_LOG", "False") == "True",
+    }
+
+    # Embed permission and module bitsets in access tokens so permission classes skip the database
+    TOKEN_PERMISSION_CLAIMS = values.BooleanValue(False)
+
     #Cors headers
     CORS_ORIGIN_ALLOW_ALL = True
     CORS_ALLOW_ALL_ORIGINS = True
@@ -213,7 +356,7 @@ class Common(Configuration):
         }
     
     
-    AUTHENTICATION_BACKENDS = ['django.contrib.auth.backends.AllowAllUsersModelBackend']
+    AUTHENTICATION_BACKENDS = ['accounts.backends.CachedPermissionBackend']
     
     
     LOGIN_URL = '/admin/login/'
@@ -222,6 +365,13 @@ class Common(Configuration):
     
     #OAuth credentials
     GOOGLE_CLIENT_ID= os.getenv("GOOGLE_CLIENT_ID")
+    # Google's id token signing certificates, cached for their max-age (social_auth/social_helpers/certs.py)
+    GOOGLE_CERTS = {
+        'URL': os.getenv("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v1/certs"),
+        'REFRESH_MARGIN': 300,
+        # a token signed with a key the cached certificates lack refetches them, at most once a minute
+        'UNKNOWN_KEY_INTERVAL': 60,
+    }
     
     # Azure Blob Storage settings or use any storage you want
     AZURE_ACCOUNT_NAME = os.getenv('AZURE_ACCOUNT_NAME')
@@ -230,14 +380,45 @@ class Common(Configuration):
     AZURE_CONNECTION_TIMEOUT_SECS = 60
 
 
-    DEFAULT_FILE_STORAGE = 'storages.backends.azure_storage.AzureStorage' #change to the correct storage backend from django-storages
+    # django-storages' AzureStorage, serving the content addressed profile images with a cache-forever Cache-Control
+    DEFAULT_FILE_STORAGE = 'accounts.storage.AzureStorage' #change to the correct storage backend from django-storages
     AZURE_CUSTOM_DOMAIN = f'{AZURE_ACCOUNT_NAME}.blob.core.windows.net'
 
     MEDIA_URL = f'https://{AZURE_CUSTOM_DOMAIN}/{AZURE_CONTAINER}/'
     # MEDIA_ROOT = ''
+
+    # Profile images, stored once per content, staged by the upload endpoints and resized by celery (accounts/images.py).
+    # STAGING_OPTIONS must point at a directory shared by the web and worker processes
+    PROFILE_IMAGES = {
+        'VARIANTS': {'thumbnail': 64, 'small': 256, 'medium': 512},
+        'MAX_UPLOAD_SIZE': 10 * 1024 * 1024,
+        'MAX_PIXELS': 40_000_000,
+        'ORPHAN_GRACE_SECONDS': 24 * 60 * 60,
+        'STAGING_STORAGE': 'django.core.files.storage.FileSystemStorage',
+        'STAGING_OPTIONS': {'location': os.getenv("UPLOAD_STAGING_DIR", os.path.join(BASE_DIR, 'uploads'))},
+    }
+
+    # Direct-to-storage image uploads (accounts/uploads.py), LocalTicketIssuer when the default storage is a FileSystemStorage
+    UPLOAD_TICKETS = {
+        'ISSUER': 'accounts.uploads.AzureTicketIssuer',
+        'OPTIONS': {},
+        'TTL': 600,
+        'PREFIX': 'incoming',
+        # uploads are unchecked until the worker validates them: keep them in a private container
+        'STORAGE': 'accounts.storage.AzureStorage',
+        'STORAGE_OPTIONS': {'azure_container': os.getenv("AZURE_UPLOAD_CONTAINER", "profile-uploads")},
+    }
     
     #use any email backend 
-    EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    # Emails are queued in the outbox (accounts/outbox.py) and delivered by celery through DELIVERY_BACKEND
+    EMAIL_BACKEND = 'accounts.outbox.OutboxEmailBackend'
+    EMAIL_OUTBOX = {
+        'DELIVERY_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+        'BATCH_SIZE': 50,
+        'MAX_ATTEMPTS': 6,
+        'RETRY_BACKOFF': 30,
+        'KEEP_SENT_DAYS': 7,
+    }
     EMAIL_HOST = "smtp.mailgun.org"
     EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
     EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
@@ -250,9 +431,7 @@ class Common(Configuration):
     # Configure the logging settings
     LOG_DIR = os.path.join(BASE_DIR, 'logs')
 
-    # Ensure the logs directory exists
-    if not os.path.exists(LOG_DIR):
-        os.makedirs(LOG_DIR)
+    # The log files (and LOG_DIR) are created on the first record written to them
 
     # Logging configuration for errors
     LOG_FILE_ERROR = os.path.join(LOG_DIR, 'error.log')
@@ -262,7 +441,7 @@ class Common(Configuration):
         'handlers': {
             'error_file': {
                 'level': 'ERROR',
-                'class': 'logging.FileHandler',
+                'class': 'config.log.LazyFileHandler',
                 'filename': LOG_FILE_ERROR,
                 'formatter': 'verbose',
             },
@@ -280,7 +459,7 @@ class Common(Configuration):
     LOG_FILE_SERVER = os.path.join(LOG_DIR, 'server.log')
     LOGGING['handlers']['server_file'] = {
         'level': 'INFO',
-        'class': 'logging.FileHandler',
+        'class': 'config.log.LazyFileHandler',
         'filename': LOG_FILE_SERVER,
         'formatter': 'verbose',
     }
@@ -1,3 +1,11 @@
 from django.contrib import admin
 
+from .models import SocialIdentity
+
 # Register your models here.
+
+
+@admin.register(SocialIdentity)
+class SocialIdentityAdmin(admin.ModelAdmin):
+    list_display = ["provider", "subject", "user", "date_created"]
+    raw_id_fields = ["user"]
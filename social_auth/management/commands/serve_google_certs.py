@@ -0,0 +1,74 @@
+import datetime
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from django.core.management.base import BaseCommand
+
+
+def generate_certificate(key_id):
+    """A new RSA key and its self-signed certificate, as ({key_id: certificate pem}, private key pem)"""
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, key_id)])
+    now = datetime.datetime.utcnow()
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .sign(key, hashes.SHA256())
+    )
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    return {key_id: certificate.public_bytes(serialization.Encoding.PEM).decode()}, private_pem.decode()
+
+
+class Command(BaseCommand):
+    help = 'Serve signing certificates like Google\'s oauth2 certs endpoint, point GOOGLE_CERTS_URL at it in tests'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--max-age', type=int, default=3600, help='Cache-Control max-age of the responses')
+        parser.add_argument('--certs', help='json file of {key id: certificate pem} to serve')
+        parser.add_argument(
+            '--key-out', default='google-certs-key.pem',
+            help='where the private key of a generated certificate is written, to sign test id tokens',
+        )
+
+
+    def handle(self, *args, **options):
+        
+        if options['certs']:
+            with open(options['certs']) as f:
+                certs = json.load(f)
+        else:
+            certs, private_pem = generate_certificate("test-key")
+            with open(options['key_out'], 'w') as f:
+                f.write(private_pem)
+            self.stdout.write(f"Signing key of kid test-key written to {options['key_out']}")
+        
+        body = json.dumps(certs).encode()
+        max_age = options['max_age']
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=UTF-8')
+                self.send_header('Cache-Control', f'public, max-age={max_age}, must-revalidate, no-transform')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        
+        server = ThreadingHTTPServer(('127.0.0.1', options['port']), Handler)
+        self.stdout.write(self.style.SUCCESS(f"Serving certificates on http://127.0.0.1:{options['port']}/"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
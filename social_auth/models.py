@@ -1,3 +1,32 @@
+from django.conf import settings
 from django.db import models
 
 # Create your models here.
+
+
+class SocialIdentity(models.Model):
+    """
+    Database schema for the social accounts users sign in with.
+
+    Fields:
+        - provider (str): social provider of the account, e.g google
+        - subject (str): the provider's id of the account (`sub` of a google id token)
+        - user (FK): user the account signs in
+        - date_created (datetime): time the account was first used
+    """
+    
+    provider = models.CharField(max_length=50)
+    subject = models.CharField(max_length=255)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="social_identities")
+    date_created = models.DateTimeField(auto_now_add=True)
+    
+    
+    class Meta:
+        constraints = [
+            # social login looks the account up on (provider, subject)
+            models.UniqueConstraint(fields=["provider", "subject"], name="socialidentity_provider_subject_uniq"),
+        ]
+    
+    
+    def __str__(self):
+        return f"{self.provider}:{self.subject}"
@@ -0,0 +1,157 @@
+"""
+Google's id token signing certificates.
+
+The certificates are fetched over the pooled google_auth session (accounts/clients.py)
+and kept for the max-age of the response's Cache-Control, in process memory and in
+the shared django cache so one worker's fetch serves all of them. In the last
+`refresh_margin` seconds of that lifetime one worker refetches in a background thread
+while the current certificates keep being served, so verifying a token is normally
+only the local signature check. A token signed with a key id the cached certificates
+don't have (Google rotated its keys early) forces one refetch, at most every
+`unknown_key_interval` seconds across the workers.
+
+GOOGLE_CERTS["URL"] can point at a stand-in server in tests, see
+`manage.py serve_google_certs`.
+"""
+import base64
+import binascii
+import json
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from google.auth import exceptions
+
+from accounts.clients import get_client
+
+
+logger = logging.getLogger(__name__)
+
+MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+def token_key_id(token):
+    """The `kid` of a jwt's header, read without verifying anything"""
+
+    try:
+        header = (token.decode() if isinstance(token, bytes) else token).split(".", 1)[0]
+        return json.loads(base64.urlsafe_b64decode(header + "=" * (-len(header) % 4))).get("kid")
+    except (ValueError, TypeError, AttributeError, binascii.Error):
+        return None
+
+
+class GoogleCertCache:
+
+    def __init__(self, url, refresh_margin=300, default_max_age=3600, unknown_key_interval=60, cache_alias="default"):
+        self.url = url
+        self.refresh_margin = refresh_margin
+        self.default_max_age = default_max_age
+        self.unknown_key_interval = unknown_key_interval
+        self.cache_alias = cache_alias
+        self.key = f"google_certs:{url}"
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._entry = None
+        self._forced_at = 0
+
+    @classmethod
+    def from_settings(cls, setting_name):
+        options = getattr(settings, setting_name, {})
+        return cls(
+            options["URL"],
+            refresh_margin=options.get("REFRESH_MARGIN", 300),
+            default_max_age=options.get("DEFAULT_MAX_AGE", 3600),
+            unknown_key_interval=options.get("UNKNOWN_KEY_INTERVAL", 60),
+            cache_alias=options.get("CACHE_ALIAS", "default"),
+        )
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def max_age(self, headers):
+        match = MAX_AGE.search(headers.get("cache-control", ""))
+        if match is None:
+            return self.default_max_age
+        # a cached response has already spent `age` seconds of its max-age
+        return max(int(match.group(1)) - int(headers.get("age", 0)), 0)
+
+    def fetch(self):
+        """Downloads the certificates, returns ({key id: certificate}, expiry epoch seconds)"""
+
+        response = get_client("google_auth")(self.url, method="GET")
+        if response.status != 200:
+            raise exceptions.TransportError(f"Could not fetch certificates at {self.url}: {response.status}")
+
+        headers = {name.lower(): value for name, value in response.headers.items()}
+        return json.loads(response.data.decode("utf-8")), time.time() + self.max_age(headers)
+
+    def refresh(self):
+        entry = self.fetch()
+        self._entry = entry
+        self.cache.set(self.key, entry, max(int(entry[1] - time.time()), 1))
+        return entry
+
+    def refresh_in_background(self, entry):
+        # another worker may have refreshed the shared copy already
+        shared = self.cache.get(self.key)
+        if shared is not None and shared[1] > entry[1]:
+            self._entry = shared
+            return
+
+        with self._lock:
+            if self._refreshing or not self.cache.add(f"{self.key}:refreshing", 1, 30):
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_quietly, name="google-certs", daemon=True).start()
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("could not refresh the google certificates, serving the cached ones")
+        finally:
+            self._refreshing = False
+
+    def refresh_for_unknown_key(self, kid, entry):
+        # another worker may have fetched the new keys already
+        shared = self.cache.get(self.key)
+        if shared is not None and kid in shared[0]:
+            self._entry = shared
+            return shared
+
+        with self._lock:
+            now = time.time()
+            if now - self._forced_at < self.unknown_key_interval:
+                return entry
+            self._forced_at = now
+
+        if not self.cache.add(f"{self.key}:unknown_key", 1, self.unknown_key_interval):
+            return entry
+        logger.info("google key %s is not in the cached certificates, refetching them", kid)
+        return self.refresh()
+
+    def certs(self, kid=None):
+        """The certificates by key id, refetched once when `kid` (the key of the token to verify) is unknown"""
+
+        now = time.time()
+        entry = self._entry
+
+        if entry is None or entry[1] <= now:
+            entry = self.cache.get(self.key)
+            if entry is None or entry[1] <= now:
+                entry = self.refresh()
+            self._entry = entry
+
+        if kid is not None and kid not in entry[0]:
+            entry = self.refresh_for_unknown_key(kid, entry)
+
+        elif entry[1] - now < self.refresh_margin:
+            self.refresh_in_background(entry)
+        return entry[0]
+
+
+google_certs = GoogleCertCache.from_settings("GOOGLE_CERTS")
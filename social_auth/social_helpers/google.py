@@ -1,5 +1,6 @@
-from google.auth.transport import requests
-from google.oauth2 import id_token
+from google.auth import jwt
+
+from .certs import google_certs, token_key_id
 
 
 class Google:
@@ -8,14 +9,13 @@ class Google:
     @staticmethod
     def validate(auth_token):
         """
-        validate method Queries the Google oAUTH2 api to fetch the user info
+        validate method checks the id token against Google's cached signing certificates and returns the user info
         """
         try:
-            idinfo = id_token.verify_oauth2_token(
-                auth_token, requests.Request())
+            idinfo = jwt.decode(auth_token, certs=google_certs.certs(token_key_id(auth_token)))
 
             if 'accounts.google.com' in idinfo['iss']:
                 return idinfo
 
         except:
-            return "The token is either invalid or has expired"
\ No newline at end of file
+            return "The token is either invalid or has expired"    
\ No newline at end of file
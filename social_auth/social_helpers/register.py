@@ -1,7 +1,9 @@
-from django.contrib.auth import authenticate, get_user_model
-import os
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
 from rest_framework.exceptions import AuthenticationFailed
-from rest_framework_simplejwt.tokens import RefreshToken
+from accounts.tokens import RefreshToken
+
+from ..models import SocialIdentity
 
 User = get_user_model()
 
@@ -11,72 +13,64 @@ def split_name(name):
     return first_name.title(), last_name.title()
 
 
-def register_social_user(provider, user_id,email, name):
-    """Allows user to login even if they didn't initially signup with google. """
+def social_login_response(user, provider):
+    refresh = RefreshToken.for_user(user)
+    return {
+        'id':user.id,
+        'first_name': user.first_name,
+        'last_name':user.last_name,
+        'email': user.email,
+        'role':user.role,
+        "phone":user.phone,
+        'is_admin':user.is_admin,
+        'is_superuser' : user.is_superuser,
+        "provider":provider,
+        'refresh': str(refresh),
+        'access' : str(refresh.access_token)
+    }
+
+
+def active_identity(provider, user_id):
+    return SocialIdentity.objects.select_related("user").filter(
+        provider=provider, subject=user_id, user__is_deleted=False, user__is_active=True,
+    ).first()
+
+
+def register_social_user(provider, user_id,email, name, email_verified=False):
+    """
+    Allows user to login even if they didn't initially signup with google.
+
+    The provider has verified the account already, so no password is checked (or hashed):
+    a returning account is one lookup of its SocialIdentity, the first login of an account
+    links it to the user with its email or to a new user without a usable password.
+    The link is kept for good, so it is only made for an email the provider verified.
+    """
     
-    filtered_user_by_email = User.objects.filter(email=email, is_deleted=False, is_active=True)
-
-    if filtered_user_by_email.exists():
-        if provider == filtered_user_by_email[0].provider:
-
-            registered_user = authenticate(
-                email=email, password=os.getenv('SOCIAL_SECRET'))
-        
-        else:
-            registered_user = filtered_user_by_email[0]
-            
-            
-        refresh = RefreshToken.for_user(registered_user)
-        return {
-            'id':registered_user.id,
-            'first_name': registered_user.first_name,
-            'last_name':registered_user.last_name,
-            'email': registered_user.email,
-            'role':registered_user.role,
-            "phone":registered_user.phone,
-            'is_admin':registered_user.is_admin,
-            'is_superuser' : registered_user.is_superuser,
-            "provider":provider,
-            'refresh': str(refresh),
-            'access' : str(refresh.access_token)
-        }
-
-
-        
-
-    else:
-        first_name, last_name = split_name(name)
-        user = {
-            'first_name': first_name, 
-            'last_name' :last_name,
-            'email': email,
-            'phone':None,
-            'role': 'user',
-            'password': os.getenv('SOCIAL_SECRET')}
-        
-        user = User.objects.create_user(**user)
-        user.is_active = True
-        user.provider = provider
-        user.save()
-        
-        # print(user.id)
-
-        new_user = authenticate(
-            email=user.email, password=os.getenv('SOCIAL_SECRET'), is_deleted=False)
-        
-        
-        
-        refresh = RefreshToken.for_user(new_user)
-        return {
-                'id':user.id,
-                'first_name': user.first_name,
-                'last_name':user.last_name,
-                'email': user.email,
-                'role':user.role,
-                "phone" : user.phone,
-                'is_admin':user.is_admin,
-                'is_superuser' : user.is_superuser,
-                "provider":provider,
-                'refresh': str(refresh),
-                'access' : str(refresh.access_token)
-            }
+    identity = active_identity(provider, user_id)
+
+    if identity is not None:
+        return social_login_response(identity.user, provider)
+
+    if not email_verified:
+        raise AuthenticationFailed('The email of this account is not verified.')
+
+    user = User.objects.filter(email=email, is_deleted=False, is_active=True).first()
+
+    try:
+        with transaction.atomic():
+            if user is None:
+                first_name, last_name = split_name(name)
+                user = User.objects.create_user(
+                    email=email, password=None, first_name=first_name, last_name=last_name,
+                    phone=None, role='user', is_active=True, provider=provider,
+                )
+            SocialIdentity.objects.create(provider=provider, subject=user_id, user=user)
+    except IntegrityError:
+        # either a concurrent first login of the same account linked it already,
+        # or the email belongs to an inactive or deleted user
+        identity = active_identity(provider, user_id)
+        if identity is None:
+            raise AuthenticationFailed('The account with this email is not active.')
+        user = identity.user
+
+    return social_login_response(user, provider)
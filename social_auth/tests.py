@@ -1,5 +1,97 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import SocialIdentity
+from .social_helpers.certs import GoogleCertCache, token_key_id
+from .social_helpers.register import register_social_user
+
+
+User = get_user_model()
+
+
+class RegisterSocialUserTests(TestCase):
+
+    def login(self, subject="google-subject", email="ada@example.com", email_verified=True):
+        return register_social_user("google", subject, email, "Ada Lovelace", email_verified=email_verified)
+
+    def test_first_login_creates_a_user_without_a_usable_password(self):
+        response = self.login()
+
+        user = User.objects.get(email="ada@example.com")
+        self.assertEqual(response["id"], user.id)
+        self.assertFalse(user.has_usable_password())
+        self.assertEqual(SocialIdentity.objects.get(subject="google-subject").user, user)
+
+    def test_a_returning_account_logs_in_through_its_identity(self):
+        first = self.login()
+        self.assertEqual(self.login(email="changed@example.com")["id"], first["id"])
+
+    def test_an_existing_user_is_linked_by_verified_email(self):
+        user = User.objects.create_user(
+            email="ada@example.com", password="password", first_name="Ada", last_name="Lovelace",
+            phone="+2340000000001", is_active=True,
+        )
+
+        with self.assertRaises(AuthenticationFailed):
+            self.login(email_verified=False)
+        self.assertFalse(SocialIdentity.objects.exists())
+
+        self.assertEqual(self.login()["id"], user.id)
+
+    def test_inactive_and_deleted_users_are_refused(self):
+        self.login()
+        user = User.objects.get(email="ada@example.com")
+
+        for state in ({"is_active": False, "is_deleted": False}, {"is_active": True, "is_deleted": True}):
+            User.objects.filter(pk=user.pk).update(**state)
+            with self.assertRaises(AuthenticationFailed):
+                self.login()
+
+
+class StaticCertCache(GoogleCertCache):
+    """Serves the certificates of `served` instead of downloading them, counting the fetches"""
+
+    def __init__(self, served, **kwargs):
+        super().__init__("https://certs.test/", **kwargs)
+        self.served = served
+        self.fetches = 0
+
+    def fetch(self):
+        self.fetches += 1
+        return dict(self.served), time.time() + 3600
+
+
+class GoogleCertCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_certificates_are_fetched_once_for_their_max_age(self):
+        certs = StaticCertCache({"key-1": "certificate"})
+
+        for _ in range(3):
+            self.assertEqual(certs.certs("key-1"), {"key-1": "certificate"})
+        self.assertEqual(certs.fetches, 1)
+
+    def test_an_unknown_key_refetches_once_per_interval(self):
+        certs = StaticCertCache({"key-1": "certificate"}, unknown_key_interval=60)
+        certs.certs("key-1")
+
+        # google rotated its keys before the max-age ran out
+        certs.served = {"key-2": "new certificate"}
+        self.assertIn("key-2", certs.certs("key-2"))
+        self.assertEqual(certs.fetches, 2)
 
-# Create your tests here.
+        certs.certs("key-3")
+        certs.certs("key-4")
+        self.assertEqual(certs.fetches, 2)
 
+    def test_token_key_id_reads_the_unverified_header(self):
+        token = "eyJhbGciOiJSUzI1NiIsImtpZCI6ImtleS0xIn0.e30.c2ln"
 
+        self.assertEqual(token_key_id(token), "key-1")
+        self.assertIsNone(token_key_id("not a token"))